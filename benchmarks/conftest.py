@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark configuration.
+
+The benchmarks use `pytest-benchmark
+<https://pytest-benchmark.readthedocs.io/>`_ and the signed fixture
+responses of the test suite. Run them and store the results as JSON with:
+
+.. code-block:: console
+
+    $ pytest benchmarks --benchmark-json=benchmarks.json
+
+Compare two stored runs with ``pytest-benchmark compare``.
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+from flask import Flask
+from invenio_accounts import InvenioAccounts
+from invenio_db import InvenioDB, db
+
+from shibboleth_authenticator import ShibbolethAuthenticator
+from shibboleth_authenticator.views import blueprint
+
+from .helpers import DATA, load_response
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.extend(['test_async.py', 'test_concurrency.py'])
+
+
+@pytest.fixture
+def database_uri():
+    """URI of the database of the application."""
+    return os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite://')
+
+
+@pytest.fixture
+def threaded_database_uri(tmpdir):
+    """URI of a database that can be used from several threads.
+
+    In-memory SQLite databases share one connection between all threads, so
+    unless ``SQLALCHEMY_DATABASE_URI`` is set a SQLite file with write-ahead
+    logging is used.
+    """
+    if os.getenv('SQLALCHEMY_DATABASE_URI'):
+        return os.getenv('SQLALCHEMY_DATABASE_URI')
+    filename = str(tmpdir.join('benchmark.db'))
+    connection = sqlite3.connect(filename)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.close()
+    return 'sqlite:///{0}'.format(filename)
+
+
+@pytest.fixture
+def app(request, database_uri):
+    """Flask application with a single remote application ``idp``."""
+    instance_path = tempfile.mkdtemp()
+    app = Flask('benchmarkapp', instance_path=instance_path)
+    app.config.update(
+        ACCOUNTS_SESSION_REDIS_URL=os.getenv('ACCOUNTS_SESSION_REDIS_URL',
+                                             'redis://localhost:6379/0'),
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        OAUTHCLIENT_SESSION_KEY_PREFIX='prefix',
+        SHIBBOLETH_REMOTE_APPS=dict(
+            idp=dict(
+                title='Benchmark identity provider',
+                saml_path=os.path.join(DATA, 'settings'),
+                mappings=dict(
+                    email='mail',
+                    full_name='sn',
+                    user_unique_id='uid',
+                )
+            )
+        ),
+        # The fixture responses are replayed on purpose.
+        SHIBBOLETH_REPLAY_CACHE=None,
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SERVER_NAME='localhost.localdomain',
+        SECRET_KEY='BENCHMARK',
+        SECURITY_DEPRECATED_PASSWORD_SCHEMES=[],
+        SECURITY_SEND_REGISTER_EMAIL=False,
+        SECURITY_PASSWORD_HASH='plaintext',
+        SECURITY_PASSWORD_SCHEMES=['plaintext'],
+    )
+    InvenioDB(app)
+    InvenioAccounts(app)
+    ShibbolethAuthenticator(app)
+    app.register_blueprint(blueprint)
+
+    with app.app_context():
+        db.create_all()
+
+    def teardown():
+        with app.app_context():
+            db.session.close()
+            db.drop_all()
+        shutil.rmtree(instance_path)
+
+    request.addfinalizer(teardown)
+
+    ctx = app.test_request_context()
+    ctx.push()
+    request.addfinalizer(ctx.pop)
+    return app
+
+
+@pytest.fixture
+def registered_app(app):
+    """Application where the user of the fixture response is registered."""
+    with app.test_client() as client:
+        resp = client.post(
+            '/shibboleth/authorized/idp',
+            data=dict(SAMLResponse=load_response()),
+        )
+        assert resp.status_code == 302
+    return app
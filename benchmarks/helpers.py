@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmark helpers."""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+
+def load_response(filename='valid.xml.base64'):
+    """Load an encoded SAML response of the test suite."""
+    with open(os.path.join(DATA, filename)) as f:
+        return f.read()
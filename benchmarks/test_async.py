@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks of the async views.
+
+The coroutines are driven by an event loop in the benchmark process, so the
+numbers show the overhead of handing the blocking work to the executor
+compared to the synchronous views in the ``views`` group.
+"""
+
+from __future__ import absolute_import, print_function
+
+import asyncio
+
+import pytest
+
+from shibboleth_authenticator import asyncviews
+
+from .helpers import load_response
+
+
+@pytest.fixture
+def database_uri(threaded_database_uri):
+    """Database shared with the executor threads."""
+    return threaded_database_uri
+
+
+@pytest.mark.benchmark(group='views-async')
+def test_authorized(benchmark, registered_app):
+    """Login of a registered user with a signed response."""
+    loop = asyncio.get_event_loop()
+    data = dict(SAMLResponse=load_response())
+
+    def authorized():
+        with registered_app.test_request_context(
+                '/shibboleth/authorized/idp', method='POST', data=data):
+            return loop.run_until_complete(asyncviews.authorized('idp'))
+
+    resp = benchmark(authorized)
+    assert resp.status_code == 302
+
+
+@pytest.mark.benchmark(group='views-async')
+def test_metadata(benchmark, app):
+    """Metadata served from the cache."""
+    loop = asyncio.get_event_loop()
+
+    def metadata():
+        with app.test_request_context('/shibboleth/metadata/idp'):
+            return loop.run_until_complete(asyncviews.metadata('idp'))
+
+    resp = benchmark(metadata)
+    assert resp.status_code == 200
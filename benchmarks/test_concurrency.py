@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Benchmarks of concurrent logins.
+
+Every round sends ``CONCURRENCY`` logins of a registered user at once from
+as many threads, once through the synchronous blueprint and once through the
+async views. Like Flask 2 does for coroutine views, every request runs the
+async view in a new event loop, while the blocking work is handed to the
+executor of the extension.
+"""
+
+from __future__ import absolute_import, print_function
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from invenio_db import db
+from invenio_db.shared import do_sqlite_begin
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from shibboleth_authenticator import asyncviews, views
+
+from .helpers import load_response
+
+CONCURRENCY = 16
+"""Number of logins sent at once."""
+
+
+@pytest.fixture
+def database_uri(threaded_database_uri):
+    """Database shared by the threads."""
+    return threaded_database_uri
+
+
+@pytest.fixture
+def concurrent_app(registered_app):
+    """Application where the user of the fixture response is registered.
+
+    SQLite fails transactions that read the user before updating it while
+    another thread writes, so every transaction takes the write lock when
+    it starts.
+    """
+    if db.engine.name != 'sqlite':
+        yield registered_app
+        return
+
+    def begin_immediate(connection):
+        connection.execute('BEGIN IMMEDIATE')
+
+    event.remove(Engine, 'begin', do_sqlite_begin)
+    event.listen(Engine, 'begin', begin_immediate)
+    try:
+        yield registered_app
+    finally:
+        event.remove(Engine, 'begin', begin_immediate)
+        event.listen(Engine, 'begin', do_sqlite_begin)
+
+
+def _login_round(benchmark, app, authorized):
+    data = dict(SAMLResponse=load_response())
+
+    def login():
+        with app.test_request_context(
+                '/shibboleth/authorized/idp', method='POST', data=data):
+            return authorized('idp').status_code
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        def logins():
+            return list(executor.map(
+                lambda i: login(), range(CONCURRENCY)
+            ))
+
+        codes = benchmark(logins)
+    assert codes == [302] * CONCURRENCY
+
+
+@pytest.mark.benchmark(group='views-concurrent')
+def test_authorized(benchmark, concurrent_app):
+    """Concurrent logins through the synchronous views."""
+    _login_round(benchmark, concurrent_app, views.authorized)
+
+
+@pytest.mark.benchmark(group='views-concurrent')
+def test_authorized_async(benchmark, concurrent_app):
+    """Concurrent logins through the async views."""
+    def authorized(remote_app):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(asyncviews.authorized(remote_app))
+        finally:
+            loop.close()
+
+    _login_round(benchmark, concurrent_app, authorized)
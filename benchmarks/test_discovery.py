@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks of the discovery of 5,000 identity providers."""
+
+from __future__ import absolute_import, print_function
+
+import random
+
+import pytest
+from flask import url_for
+
+from shibboleth_authenticator.discovery import Catalogue, IdP
+
+WORDS = (
+    'University', 'College', 'Institute', 'Technical', 'Applied', 'Sciences',
+    'Research', 'Centre', 'National', 'Library', 'Hospital', 'Academy',
+    'Dresden', 'Berlin', 'Munich', 'Vienna', 'Zurich', 'Prague', 'Warsaw',
+    'Helmholtz', 'Max', 'Planck', 'Fraunhofer', 'Leibniz', u'M\xfcnster',
+)
+
+QUERIES = dict(
+    empty='',
+    letter='u',
+    prefix='helm',
+    terms='univ dresden',
+    infix='hofer',
+    scope='idp42.example',
+)
+
+
+def idps(count=5000):
+    """Create IdPs with random names."""
+    rnd = random.Random(42)
+    for i in range(count):
+        name = ' '.join(rnd.choice(WORDS) for _ in range(3))
+        yield IdP(
+            remote_app='idp{0}'.format(i),
+            entity_id='https://idp{0}.example.org/idp/shibboleth'.format(i),
+            display_names=dict(en=name),
+            scopes=['idp{0}.example.org'.format(i)],
+        )
+
+
+@pytest.fixture(scope='module')
+def catalogue():
+    """Catalogue of 5,000 IdPs."""
+    return Catalogue(idps())
+
+
+@pytest.mark.benchmark(group='discovery')
+def test_build(benchmark):
+    """Build the index of 5,000 IdPs."""
+    entries = list(idps())
+    catalogue = benchmark(Catalogue, entries)
+    assert len(catalogue) == 5000
+
+
+@pytest.mark.benchmark(group='discovery')
+@pytest.mark.parametrize('kind', sorted(QUERIES))
+def test_search(benchmark, catalogue, kind):
+    """Search the catalogue."""
+    benchmark(catalogue.search, QUERIES[kind])
+
+
+@pytest.mark.benchmark(group='discovery')
+def test_view(benchmark, app):
+    """First page of the discovery view for a prefix."""
+    app.config['SHIBBOLETH_REMOTE_APPS'] = dict(
+        (idp.remote_app, dict(title=idp.display_names['en'],
+                              scopes=idp.scopes))
+        for idp in idps()
+    )
+    url = url_for('shibboleth_authenticator.discovery', q='univ')
+    with app.test_client() as client:
+        client.get(url)
+        resp = benchmark(client.get, url)
+    assert resp.status_code == 200
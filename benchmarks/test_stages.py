@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks of the stages of the authorized view.
+
+Each benchmark measures one step the authorized view takes for a signed
+response: request preparation, settings load, signature verification,
+attribute mapping, user lookup and the database commit.
+"""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+from flask import request
+from invenio_db import db
+from invenio_oauthclient.utils import oauth_get_user
+from onelogin.saml2.response import OneLogin_Saml2_Response
+
+from shibboleth_authenticator.cache import load_settings
+from shibboleth_authenticator.utils import get_account_info
+from shibboleth_authenticator.views import prepare_flask_request
+
+from .helpers import load_response
+
+
+def _post(app):
+    return app.test_request_context(
+        '/shibboleth/authorized/idp', method='POST',
+        data=dict(SAMLResponse=load_response()),
+    )
+
+
+def _saml_path(app):
+    return app.config['SHIBBOLETH_REMOTE_APPS']['idp']['saml_path']
+
+
+def _response(app):
+    with _post(app):
+        req = prepare_flask_request(request)
+    settings = load_settings(_saml_path(app))
+    response = OneLogin_Saml2_Response(settings,
+                                       req['post_data']['SAMLResponse'])
+    assert response.is_valid(req)
+    return response
+
+
+@pytest.mark.benchmark(group='stages')
+def test_prepare_request(benchmark, app):
+    """Conversion of the Flask request for python3-saml."""
+    with _post(app):
+        req = benchmark(prepare_flask_request, request)
+    assert 'SAMLResponse' in req['post_data']
+
+
+@pytest.mark.benchmark(group='stages')
+def test_settings_load(benchmark, app):
+    """Parsing of the python3-saml settings."""
+    settings = benchmark(load_settings, _saml_path(app))
+    assert settings.get_idp_data()
+
+
+@pytest.mark.benchmark(group='stages')
+def test_settings_cached(benchmark, app):
+    """Lookup of the python3-saml settings in the cache."""
+    cache = app.extensions['shibboleth-authenticator'].settings_cache
+    settings = benchmark(cache.get, 'idp', _saml_path(app))
+    assert settings.get_idp_data()
+
+
+@pytest.mark.benchmark(group='stages')
+def test_signature_verification(benchmark, app):
+    """Decoding, parsing and validation of the signed response."""
+    with _post(app):
+        req = prepare_flask_request(request)
+    settings = app.extensions['shibboleth-authenticator'].settings_cache.get(
+        'idp', _saml_path(app)
+    )
+
+    def verify():
+        return OneLogin_Saml2_Response(
+            settings, req['post_data']['SAMLResponse']
+        ).is_valid(req, raise_exceptions=True)
+
+    assert benchmark(verify)
+
+
+@pytest.mark.benchmark(group='stages')
+def test_attribute_mapping(benchmark, app):
+    """Mapping of the SAML attributes to the account information."""
+    attributes = _response(app).get_attributes()
+    account_info = benchmark(get_account_info, attributes, 'idp')
+    assert account_info['user']['email']
+
+
+@pytest.mark.benchmark(group='stages')
+def test_user_lookup(benchmark, registered_app):
+    """Lookup of the registered user by external id."""
+    account_info = get_account_info(
+        _response(registered_app).get_attributes(), 'idp'
+    )
+    user = benchmark(oauth_get_user, 'idp', account_info=account_info)
+    assert user is not None
+
+
+@pytest.mark.benchmark(group='stages')
+def test_db_commit(benchmark, registered_app):
+    """Commit of a modified user."""
+    account_info = get_account_info(
+        _response(registered_app).get_attributes(), 'idp'
+    )
+    user = oauth_get_user('idp', account_info=account_info)
+
+    def modify():
+        user.active = not user.active
+
+    benchmark.pedantic(db.session.commit, setup=modify, rounds=200,
+                       warmup_rounds=1)
+    assert user.id
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks of the state token formats.
+
+The size of the tokens is stored in the ``extra_info`` of the results.
+"""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from shibboleth_authenticator.state import (STATE_SERIALIZERS,
+                                            MemoryStateStore,
+                                            StoredStateSerializer)
+
+STATE = dict(app='idp', next='/deposit/new?c=rodare', sid='a' * 128)
+
+
+@pytest.fixture(params=sorted(STATE_SERIALIZERS) + ['memory'])
+def serializer(request):
+    """State serializer of every format and the in-process store."""
+    if request.param == 'memory':
+        return StoredStateSerializer(MemoryStateStore(300))
+    return STATE_SERIALIZERS[request.param](['secret'], 300)
+
+
+@pytest.mark.benchmark(group='state-dumps')
+def test_dumps(benchmark, serializer):
+    """Creation of a state token."""
+    token = benchmark(serializer.dumps, STATE)
+    benchmark.extra_info['size'] = len(token)
+
+
+@pytest.mark.benchmark(group='state-loads')
+def test_loads(benchmark, serializer):
+    """Verification of a state token."""
+    # Stored states can only be loaded once.
+    tokens = []
+
+    def setup():
+        tokens.append(serializer.dumps(STATE))
+        return (tokens[-1], ), {}
+
+    state = benchmark.pedantic(serializer.loads, setup=setup, rounds=2000)
+    assert state['app'] == 'idp'
+    benchmark.extra_info['size'] = len(tokens[-1])
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Microbenchmarks of the redirect target check."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+
+from shibboleth_authenticator.utils import get_safe_redirect_target
+
+TARGETS = dict(
+    relative='/records/1234?tab=files',
+    encoded='/search?q=a%20b',
+    allowed='https://www.example.org/records/1234',
+    wildcard='https://data.rodare.example.com/records/1234',
+    foreign='https://evil.example.net/records/1234',
+)
+
+
+@pytest.mark.benchmark(group='redirect-target')
+@pytest.mark.parametrize('kind', sorted(TARGETS))
+def test_get_safe_redirect_target(benchmark, app, kind):
+    """Check of the ``next`` parameter of the login view."""
+    app.config['APP_ALLOWED_HOSTS'] = [
+        'localhost', 'www.example.org', '*.example.com',
+    ] + ['host{0}.example.edu'.format(i) for i in range(50)]
+    with app.test_request_context(query_string=dict(next=TARGETS[kind])):
+        target = benchmark(get_safe_redirect_target)
+    assert target
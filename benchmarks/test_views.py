@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""End-to-end benchmarks of the blueprint views."""
+
+from __future__ import absolute_import, print_function
+
+import pytest
+from flask import url_for
+
+from .helpers import load_response
+
+
+@pytest.mark.benchmark(group='views')
+def test_login(benchmark, app):
+    """Redirect to the IdP."""
+    url = url_for('shibboleth_authenticator.login', remote_app='idp')
+    with app.test_client() as client:
+        resp = benchmark(client.get, url)
+    assert resp.status_code == 302
+
+
+@pytest.mark.benchmark(group='views')
+def test_authorized(benchmark, registered_app):
+    """Login of a registered user with a signed response."""
+    url = url_for('shibboleth_authenticator.authorized', remote_app='idp')
+    data = dict(SAMLResponse=load_response())
+    with registered_app.test_client() as client:
+        resp = benchmark(client.post, url, data=data)
+    assert resp.status_code == 302
+
+
+@pytest.mark.benchmark(group='views')
+def test_metadata(benchmark, app):
+    """Metadata served from the cache."""
+    url = url_for('shibboleth_authenticator.metadata', remote_app='idp')
+    with app.test_client() as client:
+        resp = benchmark(client.get, url)
+    assert resp.status_code == 200
+
+
+@pytest.mark.benchmark(group='views')
+def test_metadata_uncached(benchmark, app):
+    """Metadata rendered and validated on every request."""
+    url = url_for('shibboleth_authenticator.metadata', remote_app='idp')
+    cache = app.extensions['shibboleth-authenticator'].metadata_cache
+    with app.test_client() as client:
+        resp = benchmark.pedantic(
+            client.get, args=(url, ), setup=cache.invalidate,
+            rounds=50, warmup_rounds=1,
+        )
+    assert resp.status_code == 200
@@ -50,11 +50,18 @@ install_requires = [
     'Flask-WTF>=0.13.1',
     'oauthlib>=1.1.2,!=2.0.3,!=2.0.4,!=2.0.5,<3.0.0',
     'python3-saml>=1.4.0',
+    'requests>=2.4.0',
     'requests-oauthlib>=0.6.2,<1.2.0',
     'uritools>=1.0.1',
 ]
 
 extras_require = {
+    'async': [
+        'Flask[async]>=2.0.0',
+    ],
+    'benchmarks': [
+        'pytest-benchmark>=3.1.0',
+    ],
     'docs': [
         'recommonmark>=0.4.0',
         'Sphinx>=1.5.1,<2.0',  # FIXME: Remove pinning when
@@ -63,17 +70,23 @@ extras_require = {
     'mysql': [
         'invenio-oauthclient[mysql]>=1.0.0',
     ],
+    'prometheus': [
+        'prometheus_client>=0.0.20',
+    ],
     'postgresql': [
         'invenio-oauthclient[postgresql]>=1.0.0',
     ],
     'sqlite': [
         'invenio-oauthclient[sqlite]>=1.0.0',
     ],
+    'statsd': [
+        'statsd>=3.2.1',
+    ],
     'tests': tests_require,
 }
 extras_require['all'] = []
 for name, reqs in extras_require.items():
-    if name in ('mysql', 'postgresql', 'sqlite'):
+    if name in ('async', 'mysql', 'postgresql', 'sqlite'):
         continue
     extras_require['all'].extend(reqs)
 
@@ -107,7 +120,10 @@ setup(
         'invenio_base.blueprints': [
             'shibboleth_authenticator = '
             'shibboleth_authenticator.views:blueprint',
-        ]
+        ],
+        'flask.commands': [
+            'shibboleth = shibboleth_authenticator.cli:shibboleth',
+        ],
     },
     extras_require=extras_require,
     install_requires=install_requires,
@@ -25,6 +25,16 @@ except ImportError:
     from flask_login import _create_identifier
 
 try:
-    from urllib.parse import urlparse
+    from flask import _request_ctx_stack
 except ImportError:
-    from urlparse import urlparse
+    _request_ctx_stack = None
+
+try:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+except ImportError:
+    from werkzeug.contrib.fixers import ProxyFix
+
+try:
+    string_types = (basestring, )
+except NameError:
+    string_types = (str, )
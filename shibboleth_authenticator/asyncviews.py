@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Blueprint with coroutine views for async stacks.
+
+The views behave like the ones in :mod:`shibboleth_authenticator.views` and
+share the settings, metadata and state caches of the extension. Processing
+the SAML response, rendering metadata and the database work of the signup
+handler run in the executor of the extension, so that the event loop is not
+blocked while they wait.
+
+Register this blueprint instead of
+:data:`shibboleth_authenticator.views.blueprint` on Flask 2 with async
+support (``pip install flask[async]``). It requires Python 3.5 or newer.
+"""
+
+from __future__ import absolute_import, print_function
+
+import asyncio
+
+from flask import (Blueprint, abort, copy_current_request_context, g, redirect,
+                   request, session)
+from flask_login import current_user, logout_user
+from onelogin.saml2.errors import OneLogin_Saml2_Error
+
+from ._compat import _request_ctx_stack
+from .cache import SPMetadata
+from .instrumentation import timed
+from .views import (_ext, check_state, create_state_token, discovery_response,
+                    get_metadata, get_remote_app_config, init_saml_auth,
+                    is_replayed, logout_response, metadata_response,
+                    prepare_flask_request, remember_session, sls_response)
+
+blueprint = Blueprint(
+    'shibboleth_authenticator',
+    __name__,
+    url_prefix='/shibboleth',
+)
+
+
+def _reload_user():
+    # Flask-Login caches the user per context, drop it so that a user logged
+    # in by the executor is loaded from the session.
+    g.pop('_login_user', None)
+    if _request_ctx_stack is not None and \
+            hasattr(_request_ctx_stack.top, 'user'):
+        del _request_ctx_stack.top.user
+
+
+def _request_context():
+    if _request_ctx_stack is not None:
+        return _request_ctx_stack.top
+    from flask.globals import request_ctx
+    return request_ctx._get_current_object()
+
+
+async def run_sync(func, *args):
+    """
+    Run a blocking function in the executor of the extension.
+
+    The function runs in a copy of the current request context. Functions
+    it registers with :func:`flask.after_this_request`, like the session
+    regeneration and activity tracking of Invenio-Accounts, are moved to
+    the current request context so that they run with the response.
+
+    Args:
+        func(callable): The function.
+        *args: The arguments of the function.
+
+    Returns:
+        The return value of the function.
+
+    """
+    current_session = session._get_current_object()
+    after_request = []
+
+    @copy_current_request_context
+    def call():
+        ctx = _request_context()
+        # Copied contexts only share the session since Flask 1.1.
+        ctx.session = current_session
+        try:
+            return func(*args)
+        finally:
+            after_request.extend(ctx._after_request_functions)
+
+    loop = asyncio.get_event_loop()
+    try:
+        return await loop.run_in_executor(_ext.executor, call)
+    finally:
+        _request_context()._after_request_functions.extend(after_request)
+        _reload_user()
+
+
+@blueprint.route('/login/<remote_app>/', methods=['GET', 'POST'])
+async def login(remote_app):
+    """
+    Redirect user to remote application for authentication.
+
+    Args:
+        remote_app (str): The remote application key name.
+
+    Returns:
+        flask.Response: Redirect response to the IdP.
+
+    """
+    conf = get_remote_app_config(remote_app)
+    state_token = create_state_token(remote_app)
+    req = prepare_flask_request(request)
+    try:
+        auth = init_saml_auth(req, conf['saml_path'], remote_app=remote_app)
+    except OneLogin_Saml2_Error:
+        return abort(500)
+
+    return redirect(auth.login(state_token))
+
+
+@blueprint.route('/authorized/<remote_app>', methods=['GET', 'POST'])
+async def authorized(remote_app=None):
+    """
+    Authorize handler callback.
+
+    Args:
+        remote_app (str): The remote application key name.
+
+    Returns:
+        flask.Response: Redirect response or abort in case of failure.
+
+    """
+    if current_user.is_authenticated:
+        logout_user()
+    conf = get_remote_app_config(remote_app)
+    saml_response = request.form.get('SAMLResponse')
+    if saml_response is not None and \
+            _ext.response_checker.check(saml_response) is not None:
+        return abort(400)
+    req = prepare_flask_request(request)
+    auth = None
+    if _ext.verify_pool is not None and saml_response is not None:
+        try:
+            with timed('process_response', remote_app):
+                auth = await run_sync(
+                    _ext.verify_pool.verify, remote_app, conf, req
+                )
+        except OneLogin_Saml2_Error:
+            return abort(400)
+    if auth is None:
+        try:
+            with timed('init_saml_auth', remote_app):
+                auth = init_saml_auth(req, conf['saml_path'],
+                                      remote_app=remote_app)
+        except OneLogin_Saml2_Error:
+            return abort(500)
+        try:
+            with timed('process_response', remote_app):
+                await run_sync(auth.process_response)
+        except OneLogin_Saml2_Error:
+            return abort(400)
+    errors = auth.get_errors()
+    if len(errors) == 0 and auth.is_authenticated():
+        check_state(remote_app)
+        if is_replayed(auth, remote_app):
+            return abort(403)
+        from .handlers import authorized_signup_handler
+        response = await run_sync(authorized_signup_handler, auth,
+                                  remote_app)
+        remember_session(auth, remote_app)
+        return response
+    return abort(403)
+
+
+@blueprint.route('/logout/<remote_app>/')
+async def logout(remote_app):
+    """
+    Log the user out locally and at the IdP.
+
+    Args:
+        remote_app (str): The remote application key name.
+
+    Returns:
+        flask.Response: Redirect response to the IdP.
+
+    """
+    return await run_sync(logout_response, remote_app)
+
+
+@blueprint.route('/sls/<remote_app>')
+async def sls(remote_app):
+    """
+    Single logout service of the remote application.
+
+    Args:
+        remote_app (str): The remote application key name.
+
+    Returns:
+        flask.Response: Redirect response.
+
+    """
+    return await run_sync(sls_response, remote_app)
+
+
+@blueprint.route('/metadata/<remote_app>')
+async def metadata(remote_app):
+    """
+    Create remote application specific metadata xml for ServiceProvider.
+
+    Args:
+        remote_app (str): The remote application key name.
+
+    Returns:
+        flask.Response: The SP's metadata xml.
+
+    """
+    conf = get_remote_app_config(remote_app)
+    entry = await run_sync(get_metadata, remote_app, conf)
+    if not isinstance(entry, SPMetadata):
+        return entry
+    return metadata_response(entry)
+
+
+@blueprint.route('/discovery')
+async def discovery():
+    """
+    Discovery service for the configured IdPs.
+
+    Returns:
+        flask.Response: The matching IdPs as JSON.
+
+    """
+    return discovery_response()
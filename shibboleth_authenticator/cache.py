@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Caches for the python3-saml settings of the remote applications."""
+
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from onelogin.saml2.errors import OneLogin_Saml2_Error
+
+SETTINGS_FILES = ('settings.json', 'advanced_settings.json')
+"""Settings files python3-saml reads from the ``saml_path``."""
+
+CERT_FILES = (
+    ('sp', 'privateKey', 'sp.key'),
+    ('sp', 'x509cert', 'sp.crt'),
+    ('sp', 'x509certNew', 'sp_new.crt'),
+    ('idp', 'x509cert', 'idp.crt'),
+)
+"""Certificates in ``saml_path/certs`` that are inlined into the settings."""
+
+METADATA_CERT_FILES = ('metadata.key', 'metadata.crt')
+"""Files used by python3-saml to sign the SP metadata."""
+
+
+def _read(filename):
+    with open(filename, 'r') as f:
+        return f.read()
+
+
+def settings_stamp(saml_path):
+    """Return a stamp identifying the current state of a ``saml_path``.
+
+    The stamp changes whenever one of the settings or certificate files is
+    created, removed or modified.
+
+    :param saml_path: The path to the configuration files for python3-saml.
+    :returns: A hashable stamp.
+    """
+    saml_path = os.path.abspath(saml_path)
+    cert_path = os.path.join(saml_path, 'certs')
+    filenames = [os.path.join(saml_path, f) for f in SETTINGS_FILES]
+    filenames.extend(os.path.join(cert_path, f)
+                     for _, _, f in CERT_FILES)
+    filenames.extend(os.path.join(cert_path, f)
+                     for f in METADATA_CERT_FILES)
+
+    stamp = [saml_path]
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            stamp.append(None)
+        else:
+            stamp.append((st.st_mtime, st.st_size))
+    return tuple(stamp)
+
+
+def read_settings(saml_path):
+    """Read the python3-saml settings of a ``saml_path`` into a dictionary.
+
+    ``settings.json`` and ``advanced_settings.json`` are merged the same way
+    python3-saml does it. Certificates and keys stored in the ``certs``
+    folder are inlined, so that the parsed settings never have to go back to
+    the disk.
+
+    :param saml_path: The path to the configuration files for python3-saml.
+    :returns: The settings dictionary.
+    """
+    filename = os.path.join(saml_path, 'settings.json')
+    if not os.path.exists(filename):
+        raise OneLogin_Saml2_Error(
+            'Settings file not found: %s',
+            OneLogin_Saml2_Error.SETTINGS_FILE_NOT_FOUND,
+            filename
+        )
+    settings = json.loads(_read(filename))
+
+    advanced_filename = os.path.join(saml_path, 'advanced_settings.json')
+    if os.path.exists(advanced_filename):
+        settings.update(json.loads(_read(advanced_filename)))
+
+    # python3-saml ignores a custom base path found in the settings files.
+    settings.pop('custom_base_path', None)
+
+    cert_path = os.path.join(saml_path, 'certs')
+    for section, key, name in CERT_FILES:
+        cert_filename = os.path.join(cert_path, name)
+        if section in settings and not settings[section].get(key) and \
+                os.path.exists(cert_filename):
+            settings[section][key] = _read(cert_filename)
+    return settings
+
+
+def load_settings(saml_path, idp=None):
+    """Load and validate the python3-saml settings of a ``saml_path``.
+
+    :param saml_path: The path to the configuration files for python3-saml.
+    :param idp: Optional ``idp`` settings replacing the ones found in
+        ``settings.json``.
+    :returns: A :class:`onelogin.saml2.settings.OneLogin_Saml2_Settings`
+        instance.
+    """
+    from onelogin.saml2.settings import OneLogin_Saml2_Settings
+    settings = read_settings(saml_path)
+    if idp is not None:
+        settings['idp'] = idp
+    return OneLogin_Saml2_Settings(settings, custom_base_path=saml_path)
+
+
+class SettingsCache(object):
+    """Cache of parsed python3-saml settings keyed by remote application.
+
+    Settings are loaded on first use and kept in memory. Every lookup
+    compares the modification times of the files in ``saml_path`` with the
+    ones seen while loading, so changes on disk are picked up without a
+    restart.
+    """
+
+    def __init__(self, on_load=None):
+        """Initialize an empty cache.
+
+        :param on_load: Optional callable invoked with the remote application
+            and the new settings whenever settings are (re)loaded.
+        """
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._app_locks = {}
+        self.on_load = on_load
+
+    def _app_lock(self, remote_app):
+        # Settings of different remote applications are loaded in parallel.
+        lock = self._app_locks.get(remote_app)
+        if lock is None:
+            with self._lock:
+                lock = self._app_locks.setdefault(remote_app,
+                                                  threading.Lock())
+        return lock
+
+    def get(self, remote_app, saml_path, entity_id=None, index=None):
+        """Return the settings of a remote application.
+
+        :param remote_app: The remote application key name.
+        :param saml_path: The path to the configuration files for
+            python3-saml.
+        :param entity_id: The entityID of the IdP to take from the
+            federation index instead of ``settings.json``.
+        :param index: The
+            :class:`shibboleth_authenticator.federation.FederationIndex`.
+        :returns: A :class:`onelogin.saml2.settings.OneLogin_Saml2_Settings`
+            instance.
+        """
+        stamp = settings_stamp(saml_path)
+        if entity_id is not None:
+            if index is None:
+                raise OneLogin_Saml2_Error(
+                    'No federation index configured for IdP %s',
+                    OneLogin_Saml2_Error.SETTINGS_INVALID,
+                    entity_id
+                )
+            stamp += (entity_id, index.stamp())
+        entry = self._entries.get(remote_app)
+        if entry is None or entry[0] != stamp:
+            with self._app_lock(remote_app):
+                entry = self._entries.get(remote_app)
+                if entry is None or entry[0] != stamp:
+                    idp = None
+                    if entity_id is not None:
+                        idp = index.idp_settings(entity_id)
+                    entry = (stamp, load_settings(saml_path, idp=idp))
+                    self._entries[remote_app] = entry
+                    if self.on_load is not None:
+                        self.on_load(remote_app, entry[1])
+        return entry[1]
+
+    def invalidate(self, remote_app=None):
+        """Drop cached settings.
+
+        :param remote_app: The remote application key name. If ``None`` the
+            settings of all remote applications are dropped.
+        """
+        if remote_app is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(remote_app, None)
+
+    def __contains__(self, remote_app):
+        """Check if settings of a remote application are cached."""
+        return remote_app in self._entries
+
+
+SPMetadata = namedtuple('SPMetadata', 'stamp xml etag last_modified expires')
+"""Rendered and validated SP metadata of a remote application."""
+
+
+class MetadataCache(object):
+    """Cache of rendered SP metadata keyed by remote application.
+
+    The metadata only changes when the files in ``saml_path`` change. Since
+    python3-saml puts a ``validUntil`` attribute into the document, entries
+    additionally expire after a maximum age.
+    """
+
+    def __init__(self):
+        """Initialize an empty cache."""
+        self._entries = {}
+
+    def get(self, remote_app, stamp):
+        """Return the cached metadata of a remote application.
+
+        :param remote_app: The remote application key name.
+        :param stamp: The current stamp of the ``saml_path``, see
+            :func:`settings_stamp`.
+        :returns: A :class:`SPMetadata` or ``None`` if the metadata has to be
+            rendered again.
+        """
+        entry = self._entries.get(remote_app)
+        if entry is None or entry.stamp != stamp or \
+                entry.expires <= time.time():
+            return None
+        return entry
+
+    def set(self, remote_app, stamp, xml, max_age):
+        """Store rendered metadata of a remote application.
+
+        :param remote_app: The remote application key name.
+        :param stamp: The stamp of the ``saml_path`` the metadata was
+            rendered from.
+        :param xml: The validated metadata XML.
+        :param max_age: Number of seconds the entry is valid.
+        :returns: The new :class:`SPMetadata`.
+        """
+        if not isinstance(xml, bytes):
+            xml = xml.encode('utf-8')
+        now = int(time.time())
+        entry = SPMetadata(
+            stamp=stamp,
+            xml=xml,
+            etag=hashlib.sha1(xml).hexdigest(),
+            last_modified=now,
+            expires=now + max_age,
+        )
+        self._entries[remote_app] = entry
+        return entry
+
+    def invalidate(self, remote_app=None):
+        """Drop cached metadata.
+
+        :param remote_app: The remote application key name. If ``None`` the
+            metadata of all remote applications is dropped.
+        """
+        if remote_app is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(remote_app, None)
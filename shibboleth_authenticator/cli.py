@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Command line interface for shibboleth-authenticator."""
+
+from __future__ import absolute_import, print_function
+
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .federation import build_index
+
+
+@click.group()
+def shibboleth():
+    """Shibboleth authenticator commands."""
+
+
+@shibboleth.command('index')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--output', type=click.Path(dir_okay=False),
+              help='Index file. Defaults to SHIBBOLETH_FEDERATION_INDEX.')
+@with_appcontext
+def index(source, output):
+    """Build the federation index from a metadata aggregate."""
+    output = output or current_app.config.get('SHIBBOLETH_FEDERATION_INDEX')
+    if not output:
+        raise click.UsageError(
+            'No output given and SHIBBOLETH_FEDERATION_INDEX is not set.'
+        )
+    start = time.time()
+    count = build_index(source, output)
+    click.secho(
+        'Indexed {0} identity providers in {1:.1f}s: {2}'.format(
+            count, time.time() - start, output),
+        fg='green'
+    )
+
+
+@shibboleth.command('refresh')
+@with_appcontext
+def refresh():
+    """Refresh the federation index from SHIBBOLETH_FEDERATION_URL."""
+    refresher = current_app.extensions['shibboleth-authenticator'] \
+        .metadata_refresher
+    if refresher is None:
+        raise click.UsageError('SHIBBOLETH_FEDERATION_URL is not set.')
+    status = refresher.refresh()
+    if status == 'failed':
+        raise click.ClickException(
+            'Refresh failed, keeping the previous index: {0}'.format(
+                refresher.last_error)
+        )
+    click.secho('Federation index {0}: {1}'.format(
+        status.replace('_', ' '), refresher.index.filename), fg='green')
+
+
+@shibboleth.command('provision')
+@click.argument('remote_app')
+@click.argument('source', type=click.File('r'))
+@click.option('-f', '--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+              help='Format of the export. Guessed from the file extension '
+              'by default.')
+@click.option('--separator', default=';', show_default=True,
+              help='Separator of multiple values in CSV exports.')
+@click.option('--chunk-size', default=1000, show_default=True,
+              type=click.IntRange(min=1),
+              help='Number of records written per transaction.')
+@with_appcontext
+def provision_users(remote_app, source, fmt, separator, chunk_size):
+    """Create users and links from an export of IdP attributes."""
+    from .provisioning import provision, read_csv, read_jsonl
+
+    if remote_app not in current_app.config['SHIBBOLETH_REMOTE_APPS']:
+        raise click.BadParameter('Unknown remote application.',
+                                 param_hint='REMOTE_APP')
+    if fmt is None:
+        fmt = 'jsonl' if source.name.endswith(('.jsonl', '.json')) \
+            else 'csv'
+    if fmt == 'csv':
+        records = read_csv(source, separator=separator)
+    else:
+        records = read_jsonl(source)
+
+    start = time.time()
+
+    def progress(processed, stats):
+        click.echo(
+            '{0} records ({1[created]} created, {1[linked]} linked, '
+            '{1[existing]} existing), {2:.0f} records/s'.format(
+                processed, stats, processed / max(time.time() - start,
+                                                  1e-6))
+        )
+
+    stats = provision(records, remote_app, chunk_size=chunk_size,
+                      progress=progress)
+    click.secho(
+        'Created {0[created]} users and linked {0[linked]} existing users '
+        'in {1:.1f}s. Skipped {0[existing]} linked, {0[duplicate]} '
+        'duplicate and {0[invalid]} invalid records.'.format(
+            stats, time.time() - start),
+        fg='green'
+    )
@@ -18,13 +18,184 @@
 
 """Configuration variables for service provider.
 
-========================== ===================================================
-`SHIBBOLETH_REMOTE_APPS`   Dictionary of remote applications.
-                           See example below. **Default:** ``{}``
+==================================== ==========================================
+`SHIBBOLETH_REMOTE_APPS`             Dictionary of remote applications.
+                                     See example below. **Default:** ``{}``
 
-`SHIBBOLETH_STATE_EXPIRES` Number of seconds after which the state token
-                           expires. **Default:** ``OAUTHCLIENT_STATE_EXPIRES``.
-========================== ===================================================
+`SHIBBOLETH_STATE_EXPIRES`           Number of seconds after which the state
+                                     token expires. **Default:**
+                                     ``OAUTHCLIENT_STATE_EXPIRES``.
+
+`SHIBBOLETH_STATE_FORMAT`            Format of the state token, ``'jws'`` or
+                                     ``'compact'``. **Default:** ``'jws'``.
+
+`SHIBBOLETH_STATE_KEYS`              List of keys signing the state token.
+                                     The first key signs, all keys verify.
+                                     **Default:** ``[SECRET_KEY]``.
+
+`SHIBBOLETH_STATE_STORE`             Server-side store of the state,
+                                     ``'memory'`` or ``'redis'``. ``None``
+                                     passes the signed state to the IdP.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_STATE_STORE_SIZE`        Number of states kept by the ``memory``
+                                     store. **Default:** ``10000``.
+
+`SHIBBOLETH_STATE_REDIS_URL`         URL of the Redis database used by the
+                                     ``redis`` store. **Default:**
+                                     ``ACCOUNTS_SESSION_REDIS_URL``.
+
+`SHIBBOLETH_WARMUP`                  Load all remote applications when the
+                                     application starts. ``'degrade'`` logs
+                                     remote applications that fail to load,
+                                     ``'fail'`` raises an error. ``None``
+                                     loads them on first use.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_WARMUP_THREADS`          Number of remote applications loaded in
+                                     parallel. **Default:** ``4``.
+
+`SHIBBOLETH_PROXY_FIX`               Arguments of werkzeug's ``ProxyFix``
+                                     applied to the application, or ``True``
+                                     to trust one proxy for all
+                                     ``X-Forwarded-*`` headers.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_METADATA_MAX_AGE`        Number of seconds the rendered SP metadata
+                                     is kept in memory and may be cached by
+                                     clients. **Default:** ``3600``.
+
+`SHIBBOLETH_DISCOVERY_PAGE_SIZE`     Number of IdPs returned by the discovery
+                                     view per page. **Default:** ``20``.
+
+`SHIBBOLETH_DISCOVERY_MAX_PAGE_SIZE` Maximum page size a client may request
+                                     from the discovery view.
+                                     **Default:** ``100``.
+
+`SHIBBOLETH_DISCOVERY_MAX_AGE`       Number of seconds clients may cache
+                                     results of the discovery view.
+                                     **Default:** ``300``.
+
+`SHIBBOLETH_FEDERATION_INDEX`        Path of the index built from federation
+                                     metadata, see below.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_FEDERATION_URL`          URL of the federation metadata the index
+                                     is refreshed from. **Default:**
+                                     ``None``.
+
+`SHIBBOLETH_FEDERATION_CERT`         Path of the PEM certificate the
+                                     federation metadata is signed with.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_FEDERATION_REFRESH`      Number of seconds between two refreshes
+                                     of the federation metadata by a thread
+                                     of every process. ``None`` only
+                                     refreshes on the command line.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_FEDERATION_TIMEOUT`      Timeout of the requests fetching the
+                                     federation metadata in seconds.
+                                     **Default:** ``30``.
+
+`SHIBBOLETH_KEY_CACHE_SIZE`          Number of IdP verification keys kept in
+                                     memory per application. Enabling the
+                                     cache replaces the signature validation
+                                     function of python3-saml in the process;
+                                     outside of the application it falls back
+                                     to the original. ``0`` disables the
+                                     cache. **Default:** ``0``.
+
+`SHIBBOLETH_REPLAY_CACHE`            Backend remembering consumed assertions,
+                                     ``'memory'`` or ``'redis'``. ``None``
+                                     disables replay detection.
+                                     **Default:** ``'memory'``.
+
+`SHIBBOLETH_REPLAY_CACHE_SIZE`       Number of assertion IDs kept by the
+                                     ``memory`` backend.
+                                     **Default:** ``10000``.
+
+`SHIBBOLETH_REPLAY_REDIS_URL`        URL of the Redis database used by the
+                                     ``redis`` backend. **Default:**
+                                     ``ACCOUNTS_SESSION_REDIS_URL``.
+
+`SHIBBOLETH_REPLAY_TTL`              Seconds assertions without
+                                     ``NotOnOrAfter`` are remembered.
+                                     ``None`` uses
+                                     ``PERMANENT_SESSION_LIFETIME``.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_SESSION_INDEX`           Backend indexing the sessions of SAML
+                                     subjects for single logout, only
+                                     ``'redis'``. ``None`` only logs out the
+                                     current session.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_SESSION_INDEX_REDIS_URL` URL of the Redis database used by the
+                                     ``redis`` backend. **Default:**
+                                     ``ACCOUNTS_SESSION_REDIS_URL``.
+
+`SHIBBOLETH_WRITE_QUEUE`             Queue of deferred profile writes,
+                                     ``'local'`` or ``None`` to write the
+                                     profile during registration.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_WRITE_BATCH_SIZE`        Maximum number of deferred writes per
+                                     transaction. **Default:** ``100``.
+
+`SHIBBOLETH_WRITE_INTERVAL`          Maximum number of seconds a deferred
+                                     write waits. **Default:** ``1.0``.
+
+`SHIBBOLETH_WRITE_QUEUE_SIZE`        Maximum number of queued writes. Further
+                                     writes are done by the request.
+                                     **Default:** ``10000``.
+
+`SHIBBOLETH_RESPONSE_MAX_SIZE`       Maximum length of the base64 encoded
+                                     ``SAMLResponse``. ``None`` disables the
+                                     check. **Default:** ``None``.
+
+`SHIBBOLETH_RESPONSE_MAX_DEPTH`      Maximum nesting depth of the elements of
+                                     a SAML response. ``None`` disables the
+                                     check. **Default:** ``None``.
+
+`SHIBBOLETH_VERIFY_PROCESSES`        Number of processes verifying SAML
+                                     responses. ``0`` verifies them in the
+                                     request thread. **Default:** ``0``.
+
+`SHIBBOLETH_VERIFY_QUEUE_SIZE`       Maximum number of responses waiting for
+                                     a verification process. Further
+                                     responses are verified inline.
+                                     **Default:** ``None``, twice the number
+                                     of processes.
+
+`SHIBBOLETH_VERIFY_TIMEOUT`          Number of seconds to wait for a
+                                     verification process. On a timeout the
+                                     response is verified again inline while
+                                     the worker keeps running and keeps its
+                                     slot, doubling the CPU cost of the
+                                     response. **Default:** ``5.0``.
+
+`SHIBBOLETH_ASYNC_WORKERS`           Number of threads running the blocking
+                                     work of the async views. **Default:**
+                                     ``None``, the default of
+                                     ``ThreadPoolExecutor``.
+
+`SHIBBOLETH_USER_CACHE`              Backend remembering the users linked to
+                                     external ids, ``'memory'`` (single
+                                     process only) or ``'redis'``. ``None``
+                                     disables the cache.
+                                     **Default:** ``None``.
+
+`SHIBBOLETH_USER_CACHE_TTL`          Number of seconds a resolved user is
+                                     remembered. **Default:** ``300``.
+
+`SHIBBOLETH_USER_CACHE_SIZE`         Number of users kept by the ``memory``
+                                     backend. **Default:** ``10000``.
+
+`SHIBBOLETH_USER_CACHE_REDIS_URL`    URL of the Redis database used by the
+                                     ``redis`` backend. **Default:**
+                                     ``ACCOUNTS_SESSION_REDIS_URL``.
+==================================== ==========================================
 
 Each remote application must be defined in the ``SHIBBOLETH_REMOTE_APPS``
 dictionary, where the keys are the application names and the values the
@@ -47,21 +218,34 @@ authorized and metadata endpoints:
 - Login endpoint: ``/shibboleth/login/<remote_app>``
 - Authorized endpoint: ``/shibboleth/authorized/<remote_app>``
 - Metadata endpoint: ``/shibboleth/metadata/<remote_app>``
+- Logout endpoint: ``/shibboleth/logout/<remote_app>``
+- Single logout service: ``/shibboleth/sls/<remote_app>``
+- Discovery endpoint: ``/shibboleth/discovery``
 
 Remote application
 ^^^^^^^^^^^^^^^^^^
 Configuration of a single remote application is a dictionary with the
 following keys:
 
-- ``title`` - Title of the remote application. Not in use so far.
+- ``title`` - Title of the remote application, shown by the discovery
+  endpoint. May also be a dictionary of titles by language.
 - ``description`` - Short description of the remote application. Not in use so
   far.
 - ``saml_path`` - This is the path, that will target the specific 'saml' folder
   of the remote application. Python3-saml requires it to load the settings
   files.
+- ``entity_id`` - Optional entityID of the IdP. If given, the IdP settings
+  are taken from the federation index instead of ``settings.json``.
+- ``scopes`` - Optional list of scopes (e.g. ``hzdr.de``) users can search
+  for in the discovery endpoint. Scopes from the federation index are
+  added.
+- ``discovery`` - Set to ``False`` to hide the remote application from the
+  discovery endpoint.
 - ``mappings`` - This is a dictionary, that contains key-value pairs to map
   the response of the IDP to the keys required by shibboleth-authenticator.
-  The required keys are: ``email``, ``fullname``, ``username``
+  The required keys are: ``email``, ``full_name``, ``user_unique_id``.
+  Values may also be lists of fallback attributes or dictionaries with
+  transforms, see :mod:`shibboleth_authenticator.mapping`.
 
 Example
 ^^^^^^^
@@ -110,10 +294,173 @@ the private key that the SP will use.
 - ``sp.crt`` - The public certificate of the SP
 - ``sp.key`` - The private key of the SP.
 
+The settings and certificates are parsed once per remote application and
+kept in memory. Changes to the files in ``saml_path`` are detected by their
+modification time and picked up with the next request.
+
 For further information about the configuration of python3-saml have a look
 into their `Documentation
 <https://github.com/onelogin/python3-saml/blob/master/README.md>`_.
 
+State token
+^^^^^^^^^^^
+The login passes a signed state token to the IdP as ``RelayState``. The
+``compact`` format is considerably smaller and cheaper than the default JSON
+web signature and usually fits into the 80 bytes SAML allows for
+``RelayState``. To rotate keys, prepend the new key to
+``SHIBBOLETH_STATE_KEYS`` and remove the old one after
+``SHIBBOLETH_STATE_EXPIRES`` seconds.
+
+With ``SHIBBOLETH_STATE_STORE`` set, the state is kept on the server and
+``RelayState`` only carries a random handle of 22 characters, independent
+of the length of the next URL. A stored state can only be used once. The
+``memory`` store is local to a process; use ``redis`` if the application
+runs in several processes.
+
+Replayed responses
+^^^^^^^^^^^^^^^^^^
+The IDs of accepted assertions are remembered until the ``NotOnOrAfter`` of
+their subject confirmation. A response carrying an assertion that has been
+consumed before is rejected with ``403`` before any database work is done.
+python3-saml only reports ``NotOnOrAfter`` in strict mode, so replays are
+detected only if ``strict`` is enabled in ``settings.json``.
+
+The ``memory`` backend is local to a process. Use the ``redis`` backend if
+the application runs in several processes or on several hosts.
+
+Single logout
+^^^^^^^^^^^^^
+The logout endpoint ends the session of the user and sends a
+``LogoutRequest`` to the IdP, if the IdP has a ``singleLogoutService``. Set
+the ``singleLogoutService`` of the SP in ``settings.json`` to the single
+logout service, which processes the ``LogoutResponse`` and the
+``LogoutRequest`` messages of the IdP (HTTP-Redirect binding).
+
+Without further configuration, a ``LogoutRequest`` of the IdP only ends the
+session of the browser sending it. With ``SHIBBOLETH_SESSION_INDEX = 'redis'``,
+the session id is indexed under the ``NameID`` and ``SessionIndex`` of the
+user at login, and a ``LogoutRequest`` deletes all sessions found under them
+from the session store, regardless of the browser sending it. This requires
+a server-side session store (Invenio-Accounts). Index entries expire after
+``PERMANENT_SESSION_LIFETIME`` like the sessions, and are renewed whenever
+the session store saves the session again.
+
+Resolved users
+^^^^^^^^^^^^^^
+With ``SHIBBOLETH_USER_CACHE`` enabled, the id of the user linked to an
+external id is remembered, and returning users are loaded by primary key.
+Cached entries are dropped when external ids are linked, relinked or
+unlinked through the ORM, and when the cached user no longer exists. Changes
+made with bulk queries are only picked up after
+``SHIBBOLETH_USER_CACHE_TTL``.
+
+Only the process that changes an external id drops its cached entry. The
+``memory`` backend is therefore only suitable for deployments running a
+single process; with several workers, a user unlinked in one worker is still
+logged in through the stale entries of the others until they expire. Use the
+``redis`` backend, which is shared by all processes, in that case.
+
+Bulk provisioning
+^^^^^^^^^^^^^^^^^
+Users can be created before their first login from an export of their IdP
+attributes. The attributes are mapped with the ``mappings`` of the remote
+application:
+
+.. code-block:: console
+
+    $ invenio shibboleth provision idp1 users.csv
+    $ invenio shibboleth provision idp1 users.jsonl
+
+The first row of a CSV export names the attributes, multiple values are
+separated by ``;``. Every line of a JSON lines export is an object of
+attribute names and values.
+
+Deferred writes
+^^^^^^^^^^^^^^^
+With ``SHIBBOLETH_WRITE_QUEUE`` set to ``'local'``, first logins only create
+the user row, and a background thread of each process writes the full name,
+the extra mapped attributes and the time of the login in batches. Extra
+attributes and the last login are kept in the ``extra_data`` of the user's
+remote account. Queued writes are lost if the process is killed.
+
+Malformed responses
+^^^^^^^^^^^^^^^^^^^
+Before a ``SAMLResponse`` is handed to python3-saml, it is checked for valid
+base64, for a ``Response`` root element and for document type or entity
+declarations. The size of the response and the nesting depth of its elements
+are only limited if ``SHIBBOLETH_RESPONSE_MAX_SIZE`` and
+``SHIBBOLETH_RESPONSE_MAX_DEPTH`` are set. Signed responses of IdPs releasing
+many attributes can exceed several hundred kilobytes, so choose the limits
+from the responses seen in production. Responses failing any of these checks
+are rejected with ``400`` without being parsed.
+The number of rejections per reason is available from
+``app.extensions['shibboleth-authenticator'].response_checker.info()``.
+Use Flask's ``MAX_CONTENT_LENGTH`` to limit the size of the request body
+itself.
+
+Federation metadata
+^^^^^^^^^^^^^^^^^^^
+Instead of maintaining the IdP section of ``settings.json`` by hand, the IdPs
+can be taken from the metadata aggregate of a federation. The aggregate is
+parsed once into an index file:
+
+.. code-block:: console
+
+    $ invenio shibboleth index /path/to/aggregate.xml
+
+Point ``SHIBBOLETH_FEDERATION_INDEX`` to the index and set the ``entity_id``
+of the remote applications. The ``saml_path`` still provides the SP settings.
+The index is memory-mapped and therefore shared by all workers of a host.
+An index rebuilt at the same path is picked up without a restart.
+
+With ``SHIBBOLETH_FEDERATION_URL`` set, the index is refreshed by running
+the following command from cron:
+
+.. code-block:: console
+
+    $ invenio shibboleth refresh
+
+It fetches the metadata with a conditional GET and rebuilds the index. New
+metadata is only used if it is signed with the
+``SHIBBOLETH_FEDERATION_CERT``, if it has a ``validUntil`` that has not
+passed and if it contains the IdPs of all remote applications. Otherwise the
+previous index is kept and
+:data:`~shibboleth_authenticator.signals.metadata_refreshed` reports the
+failure. Checking the signature loads the whole metadata into memory.
+
+Alternatively, ``SHIBBOLETH_FEDERATION_REFRESH`` starts a background thread
+in every process that refreshes the index every that many seconds. The
+processes sharing the index take turns through the lock file
+``SHIBBOLETH_FEDERATION_INDEX + '.lock'``.
+
+Discovery
+^^^^^^^^^
+``/shibboleth/discovery?q=<terms>`` searches the remote applications by the
+display names and scopes of their IdP, their entityID and their name, and
+returns JSON suitable for an autocomplete:
+
+.. code-block:: json
+
+    {
+        "query": "dres",
+        "total": 1,
+        "page": 1,
+        "size": 20,
+        "results": [{
+            "remote_app": "hzdr",
+            "entity_id": "https://www.hzdr.de/idp/shibboleth",
+            "name": "Helmholtz-Zentrum Dresden-Rossendorf",
+            "scopes": ["hzdr.de"],
+            "login_url": "/shibboleth/login/hzdr/"
+        }]
+    }
+
+Use ``page`` and ``size`` to page through the results. A ``next`` parameter
+is passed on to the login URLs. The display name is chosen by the
+``Accept-Language`` of the request. The search index is kept in memory and
+rebuilt when remote applications are added or removed, or when the
+federation index is rebuilt.
+
 """
 
 SHIBBOLETH_REMOTE_APPS = {}
@@ -121,3 +468,117 @@ SHIBBOLETH_REMOTE_APPS = {}
 
 SHIBBOLETH_STATE_EXPIRES = 300
 """Number of seconds after which the state token expires."""
+
+SHIBBOLETH_STATE_FORMAT = 'jws'
+"""Format of the state token."""
+
+SHIBBOLETH_STATE_KEYS = None
+"""Keys signing the state token, defaults to ``[SECRET_KEY]``."""
+
+SHIBBOLETH_STATE_STORE = None
+"""Backend of the server-side state store."""
+
+SHIBBOLETH_STATE_STORE_SIZE = 10000
+"""Number of states kept by the in-process state store."""
+
+SHIBBOLETH_STATE_REDIS_URL = None
+"""URL of the Redis database of the state store."""
+
+SHIBBOLETH_WARMUP = None
+"""Reaction to remote applications failing to load at startup."""
+
+SHIBBOLETH_WARMUP_THREADS = 4
+"""Number of remote applications loaded in parallel at startup."""
+
+SHIBBOLETH_PROXY_FIX = None
+"""Arguments of werkzeug's ``ProxyFix``."""
+
+SHIBBOLETH_METADATA_MAX_AGE = 3600
+"""Number of seconds the rendered SP metadata is cached."""
+
+SHIBBOLETH_DISCOVERY_PAGE_SIZE = 20
+"""Number of IdPs per page of the discovery view."""
+
+SHIBBOLETH_DISCOVERY_MAX_PAGE_SIZE = 100
+"""Maximum number of IdPs per page of the discovery view."""
+
+SHIBBOLETH_DISCOVERY_MAX_AGE = 300
+"""Number of seconds results of the discovery view may be cached."""
+
+SHIBBOLETH_FEDERATION_INDEX = None
+"""Path of the federation metadata index."""
+
+SHIBBOLETH_FEDERATION_URL = None
+"""URL the federation metadata is refreshed from."""
+
+SHIBBOLETH_FEDERATION_CERT = None
+"""Path of the certificate the federation metadata is signed with."""
+
+SHIBBOLETH_FEDERATION_REFRESH = None
+"""Number of seconds between two refreshes of the federation metadata."""
+
+SHIBBOLETH_FEDERATION_TIMEOUT = 30
+"""Timeout of the requests fetching the federation metadata."""
+
+SHIBBOLETH_KEY_CACHE_SIZE = 0
+"""Number of cached IdP verification keys."""
+
+SHIBBOLETH_REPLAY_CACHE = 'memory'
+"""Backend of the assertion replay cache."""
+
+SHIBBOLETH_REPLAY_CACHE_SIZE = 10000
+"""Number of assertion IDs kept by the in-process replay cache."""
+
+SHIBBOLETH_REPLAY_REDIS_URL = None
+"""URL of the Redis database of the replay cache."""
+
+SHIBBOLETH_REPLAY_TTL = None
+"""Lifetime of replay cache entries of assertions without expiry."""
+
+SHIBBOLETH_SESSION_INDEX = None
+"""Backend of the session index used by single logout."""
+
+SHIBBOLETH_SESSION_INDEX_REDIS_URL = None
+"""URL of the Redis database of the session index."""
+
+SHIBBOLETH_RESPONSE_MAX_SIZE = None
+"""Maximum length of the encoded SAML response."""
+
+SHIBBOLETH_RESPONSE_MAX_DEPTH = None
+"""Maximum nesting depth of the elements of a SAML response."""
+
+SHIBBOLETH_VERIFY_PROCESSES = 0
+"""Number of processes verifying SAML responses."""
+
+SHIBBOLETH_VERIFY_QUEUE_SIZE = None
+"""Maximum number of responses waiting for a verification process."""
+
+SHIBBOLETH_VERIFY_TIMEOUT = 5.0
+"""Number of seconds to wait for a verification process."""
+
+SHIBBOLETH_ASYNC_WORKERS = None
+"""Number of threads of the async views."""
+
+SHIBBOLETH_USER_CACHE = None
+"""Backend of the resolved user cache."""
+
+SHIBBOLETH_USER_CACHE_TTL = 300
+"""Number of seconds a resolved user is cached."""
+
+SHIBBOLETH_USER_CACHE_SIZE = 10000
+"""Number of users kept by the in-process user cache."""
+
+SHIBBOLETH_USER_CACHE_REDIS_URL = None
+"""URL of the Redis database of the user cache."""
+
+SHIBBOLETH_WRITE_QUEUE = None
+"""Backend of the deferred profile writes."""
+
+SHIBBOLETH_WRITE_BATCH_SIZE = 100
+"""Maximum number of deferred writes per transaction."""
+
+SHIBBOLETH_WRITE_INTERVAL = 1.0
+"""Maximum number of seconds a deferred write waits."""
+
+SHIBBOLETH_WRITE_QUEUE_SIZE = 10000
+"""Maximum number of queued deferred writes."""
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Searchable catalogue of the identity providers for the discovery view.
+
+The catalogue holds one :class:`IdP` per remote application. Display names
+and scopes are taken from the federation index for remote applications with
+an ``entity_id``, and from the ``title`` and ``scopes`` of the remote
+application otherwise.
+
+Names, scopes and entityIDs are folded to lowercase ASCII and split into
+tokens. Query terms are matched as prefixes of the tokens with a binary
+search over the sorted tokens, and terms of three or more characters also
+anywhere in the text with a trigram index. Entries are ranked by prefix
+matches first and then by name.
+"""
+
+from __future__ import absolute_import, print_function
+
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import namedtuple
+
+from ._compat import string_types
+
+IdP = namedtuple('IdP', 'remote_app entity_id display_names scopes')
+"""Identity provider listed by the discovery view."""
+
+_SEPARATORS = re.compile(r'[^a-z0-9]+')
+
+
+def fold(text):
+    """Fold a text for searching.
+
+    :param text: The text.
+    :returns: The text in lowercase without accents and punctuation.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _SEPARATORS.sub(' ', text.lower()).strip()
+
+
+def trigrams(text):
+    """Return the trigrams of a folded text."""
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def display_name(idp, languages=()):
+    """Return the display name of an IdP in the preferred language.
+
+    :param idp: The :class:`IdP`.
+    :param languages: Preferred languages in descending order.
+    :returns: The display name.
+    """
+    names = idp.display_names
+    for lang in tuple(languages) + ('en', ''):
+        if names.get(lang):
+            return names[lang]
+    for lang in sorted(names):
+        if names[lang]:
+            return names[lang]
+    return idp.remote_app
+
+
+def load_idps(remote_apps, index=None):
+    """Collect the IdPs of the remote applications.
+
+    Remote applications with ``discovery`` set to ``False`` are not listed.
+
+    :param remote_apps: The ``SHIBBOLETH_REMOTE_APPS`` configuration.
+    :param index: The
+        :class:`shibboleth_authenticator.federation.FederationIndex`.
+    :returns: List of :class:`IdP`.
+    """
+    idps = []
+    for remote_app in sorted(remote_apps):
+        conf = remote_apps[remote_app]
+        if not conf.get('discovery', True):
+            continue
+        entity_id = conf.get('entity_id')
+        display_names = {}
+        scopes = list(conf.get('scopes', ()))
+        data = None
+        if entity_id and index is not None:
+            try:
+                data = index.get(entity_id)
+            except Exception:
+                data = None
+        if data is not None:
+            display_names.update(data['display_names'])
+            scopes.extend(s for s in data['scopes'] if s not in scopes)
+        if conf.get('title'):
+            title = conf['title']
+            if isinstance(title, string_types):
+                display_names.setdefault('', title)
+            else:
+                display_names.update(title)
+        idps.append(IdP(remote_app, entity_id, display_names, scopes))
+    return idps
+
+
+class Catalogue(object):
+    """Prefix and trigram index over a list of IdPs."""
+
+    def __init__(self, idps):
+        """Build the index.
+
+        :param idps: List of :class:`IdP`.
+        """
+        self.idps = list(idps)
+        # Rank of every entry when ordered by name.
+        order = sorted(range(len(self.idps)), key=lambda i: (
+            fold(display_name(self.idps[i])), self.idps[i].remote_app
+        ))
+        self._order = [self.idps[i] for i in order]
+        self._rank = [0] * len(self.idps)
+        for rank, i in enumerate(order):
+            self._rank[i] = rank
+
+        tokens = {}
+        self._texts = []
+        self._trigrams = {}
+        for i, idp in enumerate(self.idps):
+            parts = list(idp.display_names.values()) + list(idp.scopes)
+            parts.append(idp.remote_app)
+            if idp.entity_id:
+                # The scheme of the entityID only adds noise.
+                parts.append(idp.entity_id.split('://', 1)[-1])
+            text = ' '.join(fold(p) for p in parts if p)
+            self._texts.append(text)
+            for token in set(text.split()):
+                tokens.setdefault(token, []).append(i)
+            for gram in trigrams(text):
+                self._trigrams.setdefault(gram, set()).add(i)
+        self._tokens = sorted(tokens)
+        self._postings = [tokens[t] for t in self._tokens]
+
+    def __len__(self):
+        """Return the number of IdPs."""
+        return len(self.idps)
+
+    def _prefix(self, term):
+        matches = set()
+        i = bisect_left(self._tokens, term)
+        while i < len(self._tokens) and self._tokens[i].startswith(term):
+            matches.update(self._postings[i])
+            i += 1
+        return matches
+
+    def _infix(self, term):
+        grams = sorted(trigrams(term),
+                       key=lambda g: len(self._trigrams.get(g, ())))
+        if not grams:
+            return set()
+        candidates = set(self._trigrams.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates &= self._trigrams.get(gram, set())
+        return set(i for i in candidates if term in self._texts[i])
+
+    def search(self, query):
+        """Find the IdPs matching all terms of a query.
+
+        :param query: The query. An empty query matches all IdPs.
+        :returns: List of :class:`IdP` ordered by relevance and name.
+        """
+        terms = fold(query or '').split()
+        if not terms:
+            return list(self._order)
+        matches = prefixed = None
+        for term in terms:
+            prefix = self._prefix(term)
+            found = prefix | self._infix(term) if len(term) >= 3 else prefix
+            matches = found if matches is None else matches & found
+            prefixed = prefix if prefixed is None else prefixed & prefix
+            if not matches:
+                return []
+        rank = self._rank
+        return [self.idps[i] for i in sorted(
+            matches, key=lambda i: (i not in prefixed, rank[i])
+        )]
+
+
+class Discovery(object):
+    """Catalogue of the IdPs of an application, rebuilt when it changes.
+
+    The catalogue is rebuilt when remote applications are added or removed,
+    when the configuration is replaced and when the federation index is
+    rebuilt.
+    """
+
+    def __init__(self):
+        """Initialize an empty discovery."""
+        self._entry = (None, None)
+        self._lock = threading.Lock()
+
+    def get(self, remote_apps, index=None):
+        """Return the catalogue.
+
+        :param remote_apps: The ``SHIBBOLETH_REMOTE_APPS`` configuration.
+        :param index: The
+            :class:`shibboleth_authenticator.federation.FederationIndex`.
+        :returns: A :class:`Catalogue`.
+        """
+        stamp = (id(remote_apps), len(remote_apps), id(index),
+                 index.stamp() if index is not None else None)
+        entry = self._entry
+        if entry[0] != stamp:
+            with self._lock:
+                entry = self._entry
+                if entry[0] != stamp:
+                    entry = (stamp, Catalogue(load_idps(remote_apps, index)))
+                    self._entry = entry
+        return entry[1]
+
+    def invalidate(self):
+        """Drop the catalogue."""
+        self._entry = (None, None)
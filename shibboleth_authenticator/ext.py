@@ -21,7 +21,26 @@
 
 from __future__ import absolute_import, print_function
 
+from flask import request_finished
+
 from . import config
+from ._compat import ProxyFix
+from .cache import MetadataCache, SettingsCache
+from .discovery import Discovery
+from .federation import FederationIndex
+from .keys import KeyCache
+from .mapping import MapperRegistry
+from .precheck import ResponseChecker
+from .refresh import create_metadata_refresher
+from .replay import create_replay_cache
+from .sessions import create_session_index
+from .state import create_state_serializer
+from .usercache import create_user_cache, register_listeners
+from .utils import AllowedHosts
+from .verify import create_verify_pool
+from .views import index_session
+from .warmup import warm_up
+from .writes import create_write_queue
 
 
 class ShibbolethAuthenticator(object):
@@ -35,7 +54,80 @@ class ShibbolethAuthenticator(object):
     def init_app(self, app):
         """Flask application initialization."""
         self.init_config(app)
+        self.init_proxy_fix(app)
+        self.settings_cache = SettingsCache()
+        self.key_cache = None
+        if app.config['SHIBBOLETH_KEY_CACHE_SIZE']:
+            self.key_cache = KeyCache(app.config['SHIBBOLETH_KEY_CACHE_SIZE'])
+            self.settings_cache.on_load = self.key_cache.on_settings_load
+        self.metadata_cache = MetadataCache()
+        self.allowed_hosts = AllowedHosts(
+            app.config.get('APP_ALLOWED_HOSTS')
+        )
+        # The warm-up compiles the mappings itself and reports failures.
+        self.mappers = MapperRegistry(
+            None if app.config['SHIBBOLETH_WARMUP'] else
+            app.config['SHIBBOLETH_REMOTE_APPS']
+        )
+        self.federation_index = None
+        if app.config['SHIBBOLETH_FEDERATION_INDEX']:
+            self.federation_index = FederationIndex(
+                app.config['SHIBBOLETH_FEDERATION_INDEX']
+            )
+        self.metadata_refresher = create_metadata_refresher(
+            app, self.federation_index
+        )
+        self.discovery = Discovery()
+        self.replay_cache = create_replay_cache(app)
+        self.session_index = create_session_index(app)
+        request_finished.connect(index_session, app)
+        self.user_cache = create_user_cache(app)
+        if self.user_cache is not None:
+            register_listeners()
+        self.write_queue = create_write_queue(app)
+        self.response_checker = ResponseChecker(
+            max_size=app.config['SHIBBOLETH_RESPONSE_MAX_SIZE'],
+            max_depth=app.config['SHIBBOLETH_RESPONSE_MAX_DEPTH'],
+        )
+        self.verify_pool = create_verify_pool(app)
+        self._state_serializer = None
+        self._executor = None
+        self._app = app
+        self.warmup_results = {}
+        if app.config['SHIBBOLETH_WARMUP']:
+            self.warmup_results = warm_up(app, self)
         app.extensions['shibboleth-authenticator'] = self
+        if self.metadata_refresher is not None and \
+                app.config['SHIBBOLETH_FEDERATION_REFRESH']:
+            self.metadata_refresher.start()
+
+    @property
+    def state_serializer(self):
+        """Return the state token serializer, created on first use."""
+        if self._state_serializer is None:
+            self._state_serializer = create_state_serializer(self._app)
+        return self._state_serializer
+
+    @property
+    def executor(self):
+        """Return the executor of the async views, created on first use."""
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(
+                self._app.config['SHIBBOLETH_ASYNC_WORKERS']
+            )
+        return self._executor
+
+    @staticmethod
+    def init_proxy_fix(app):
+        """Honour the ``X-Forwarded-*`` headers set by a reverse proxy."""
+        proxy_fix = app.config['SHIBBOLETH_PROXY_FIX']
+        if not proxy_fix or isinstance(app.wsgi_app, ProxyFix):
+            return
+        if proxy_fix is True:
+            proxy_fix = dict(x_for=1, x_proto=1, x_host=1, x_port=1,
+                             x_prefix=1)
+        app.wsgi_app = ProxyFix(app.wsgi_app, **proxy_fix)
 
     @staticmethod
     def init_config(app):
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Index of the identity providers found in federation metadata.
+
+Federation aggregates (e.g. eduGAIN) contain thousands of entities and can
+be several hundred megabytes large. :func:`build_index` parses such an
+aggregate incrementally and stores the data python3-saml needs for every
+IdP in a compact binary index file. Remote applications configured with an
+``entity_id`` look up their IdP in this index when their settings are
+loaded, so neither the application start nor the workers have to parse the
+aggregate.
+
+The index file is memory-mapped read-only by :class:`FederationIndex`, so
+all worker processes of a host share the same pages through the page cache.
+It has the following layout (all integers little-endian):
+
+- Header: magic ``SHIBIDX1``, number of entries (``uint32``), reserved
+  (``uint32``).
+- Table: one entry per IdP, sorted by entityID, holding the offset and length
+  of the entityID and of the record (``uint64``, ``uint32``, ``uint64``,
+  ``uint32``).
+- Data: the entityIDs and the records.
+
+A record is a sequence of fields. Each field consists of a tag (``uint8``),
+the length of the value (``uint32``) and the value. Certificates are stored
+as DER bytes, all other values as UTF-8 strings.
+"""
+
+from __future__ import absolute_import, print_function
+
+import base64
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+
+from onelogin.saml2.constants import OneLogin_Saml2_Constants
+from onelogin.saml2.errors import OneLogin_Saml2_Error
+
+NS_MD = OneLogin_Saml2_Constants.NS_MD
+NS_DS = OneLogin_Saml2_Constants.NS_DS
+NS_MDUI = 'urn:oasis:names:tc:SAML:metadata:ui'
+NS_SHIBMD = 'urn:mace:shibboleth:metadata:1.0'
+
+BINDINGS = (
+    OneLogin_Saml2_Constants.BINDING_HTTP_REDIRECT,
+    OneLogin_Saml2_Constants.BINDING_HTTP_POST,
+)
+"""Supported bindings of the IdP endpoints in order of preference."""
+
+
+def _text(elem):
+    return ''.join((elem.text or '').split())
+
+
+def _endpoints(descriptor, tag):
+    return [
+        [e.get('Binding'), e.get('Location')]
+        for e in descriptor.iterfind('{%s}%s' % (NS_MD, tag))
+        if e.get('Binding') in BINDINGS and e.get('Location')
+    ]
+
+
+def _certs(descriptor, exclude):
+    return [
+        _text(cert)
+        for key in descriptor.iterfind('{%s}KeyDescriptor' % NS_MD)
+        if key.get('use') != exclude
+        for cert in key.iterfind('.//{%s}X509Certificate' % NS_DS)
+    ]
+
+
+def parse_entity(entity):
+    """Extract the IdP data of an ``EntityDescriptor`` element.
+
+    :param entity: The ``md:EntityDescriptor`` element.
+    :returns: A dictionary with the IdP data or ``None`` if the entity is no
+        identity provider.
+    """
+    descriptor = entity.find('{%s}IDPSSODescriptor' % NS_MD)
+    if descriptor is None:
+        return None
+    sso = _endpoints(descriptor, 'SingleSignOnService')
+    if not sso:
+        return None
+
+    display_names = {}
+    for name in descriptor.iterfind('.//{%s}DisplayName' % NS_MDUI):
+        lang = name.get('{http://www.w3.org/XML/1998/namespace}lang', '')
+        display_names[lang] = (name.text or '').strip()
+
+    return dict(
+        entity_id=entity.get('entityID'),
+        sso=sso,
+        slo=_endpoints(descriptor, 'SingleLogoutService'),
+        signing=_certs(descriptor, 'encryption'),
+        encryption=_certs(descriptor, 'signing'),
+        nameid_formats=[
+            _text(f)
+            for f in descriptor.iterfind('{%s}NameIDFormat' % NS_MD)
+        ],
+        display_names=display_names,
+        scopes=[
+            (s.text or '').strip()
+            for s in descriptor.iterfind('.//{%s}Scope' % NS_SHIBMD)
+        ],
+    )
+
+
+def iter_idps(source):
+    """Iterate over the identity providers of a metadata document.
+
+    The document is parsed incrementally. Every ``EntityDescriptor`` is
+    dropped from the tree as soon as it is processed, so the memory usage
+    does not depend on the size of the document.
+
+    :param source: A filename or file object of the metadata document.
+    :returns: Iterator over the dictionaries returned by
+        :func:`parse_entity`.
+    """
+    from lxml import etree
+    context = etree.iterparse(
+        source,
+        events=('end',),
+        tag='{%s}EntityDescriptor' % NS_MD,
+        resolve_entities=False,
+        no_network=True,
+        huge_tree=True,
+    )
+    for _, entity in context:
+        idp = parse_entity(entity)
+        entity.clear()
+        parent = entity.getparent()
+        if parent is not None:
+            while entity.getprevious() is not None:
+                del parent[0]
+        if idp is not None and idp['entity_id']:
+            yield idp
+    del context
+
+
+MAGIC = b'SHIBIDX1'
+
+_HEADER = struct.Struct('<8sII')
+_ENTRY = struct.Struct('<QIQI')
+_FIELD = struct.Struct('<BI')
+
+_SSO, _SLO, _SIGNING, _ENCRYPTION, _NAMEID_FORMAT, _DISPLAY_NAME, _SCOPE = \
+    range(1, 8)
+
+
+def _field(tag, value):
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return _FIELD.pack(tag, len(value)) + value
+
+
+def encode_record(idp):
+    """Encode IdP data into a binary index record.
+
+    :param idp: The IdP data as returned by :func:`parse_entity`.
+    :returns: The record.
+    """
+    fields = []
+    for tag, endpoints in ((_SSO, idp['sso']), (_SLO, idp['slo'])):
+        fields.extend(_field(tag, u'{0}\0{1}'.format(*e)) for e in endpoints)
+    for tag, certs in ((_SIGNING, idp['signing']),
+                       (_ENCRYPTION, idp['encryption'])):
+        fields.extend(_field(tag, base64.b64decode(c)) for c in certs)
+    fields.extend(_field(_NAMEID_FORMAT, f) for f in idp['nameid_formats'])
+    fields.extend(
+        _field(_DISPLAY_NAME, u'{0}\0{1}'.format(lang, name))
+        for lang, name in sorted(idp['display_names'].items())
+    )
+    fields.extend(_field(_SCOPE, s) for s in idp['scopes'])
+    return b''.join(fields)
+
+
+def decode_record(entity_id, record):
+    """Decode a binary index record.
+
+    :param entity_id: The entityID of the identity provider.
+    :param record: The record as returned by :func:`encode_record`.
+    :returns: The IdP data as returned by :func:`parse_entity`.
+    """
+    idp = dict(entity_id=entity_id, sso=[], slo=[], signing=[],
+               encryption=[], nameid_formats=[], display_names={},
+               scopes=[])
+    keys = {_SSO: 'sso', _SLO: 'slo', _SIGNING: 'signing',
+            _ENCRYPTION: 'encryption', _NAMEID_FORMAT: 'nameid_formats',
+            _SCOPE: 'scopes'}
+    pos = 0
+    while pos < len(record):
+        tag, length = _FIELD.unpack_from(record, pos)
+        pos += _FIELD.size
+        value = bytes(record[pos:pos + length])
+        pos += length
+        if tag in (_SIGNING, _ENCRYPTION):
+            idp[keys[tag]].append(base64.b64encode(value).decode('ascii'))
+            continue
+        value = value.decode('utf-8')
+        if tag in (_SSO, _SLO):
+            idp[keys[tag]].append(value.split(u'\0', 1))
+        elif tag == _DISPLAY_NAME:
+            lang, name = value.split(u'\0', 1)
+            idp['display_names'][lang] = name
+        elif tag in keys:
+            idp[keys[tag]].append(value)
+    return idp
+
+
+def build_index(source, filename):
+    """Build an index of all identity providers in a metadata document.
+
+    Records are spooled to a temporary file while parsing, so only the
+    entityIDs are kept in memory. The index is written next to ``filename``
+    and moved into place afterwards, so a running application never sees a
+    partial index.
+
+    :param source: A filename or file object of the metadata document.
+    :param filename: The filename of the index.
+    :returns: The number of indexed identity providers.
+    """
+    entries = {}
+    with tempfile.TemporaryFile() as records:
+        for idp in iter_idps(source):
+            record = encode_record(idp)
+            entries[idp['entity_id'].encode('utf-8')] = \
+                (records.tell(), len(record))
+            records.write(record)
+
+        keys = sorted(entries)
+        keys_offset = _HEADER.size + _ENTRY.size * len(keys)
+        records_offset = keys_offset + sum(len(k) for k in keys)
+
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(filename)),
+            prefix=os.path.basename(filename),
+        )
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(MAGIC, len(keys), 0))
+                key_offset = keys_offset
+                for key in keys:
+                    offset, length = entries[key]
+                    f.write(_ENTRY.pack(key_offset, len(key),
+                                        records_offset + offset, length))
+                    key_offset += len(key)
+                for key in keys:
+                    f.write(key)
+                records.seek(0)
+                shutil.copyfileobj(records, f)
+            os.chmod(tmp_filename, 0o644)
+            os.rename(tmp_filename, filename)
+        except Exception:
+            os.remove(tmp_filename)
+            raise
+    return len(keys)
+
+
+def idp_settings(idp):
+    """Convert indexed IdP data into the ``idp`` section of python3-saml.
+
+    :param idp: The IdP data as returned by :func:`parse_entity`.
+    :returns: The ``idp`` settings dictionary.
+    """
+    settings = dict(entityId=idp['entity_id'])
+    for key, endpoints in (('singleSignOnService', idp['sso']),
+                           ('singleLogoutService', idp['slo'])):
+        for binding in BINDINGS:
+            urls = [url for b, url in endpoints if b == binding]
+            if urls:
+                settings[key] = dict(url=urls[0], binding=binding)
+                break
+
+    signing, encryption = idp['signing'], idp['encryption']
+    if len(signing) == 1 and (not encryption or encryption == signing):
+        settings['x509cert'] = signing[0]
+    elif not signing and len(encryption) == 1:
+        settings['x509cert'] = encryption[0]
+    elif signing or encryption:
+        settings['x509certMulti'] = dict(
+            (key, certs) for key, certs in (('signing', signing),
+                                            ('encryption', encryption))
+            if certs
+        )
+    return settings
+
+
+class FederationIndex(object):
+    """Read access to an index created by :func:`build_index`.
+
+    The index file is memory-mapped on first use. Every lookup checks if the
+    file was replaced on disk and maps the new file in that case, so a
+    rebuilt index is used without restarting the application.
+    """
+
+    def __init__(self, filename):
+        """Initialize the index.
+
+        :param filename: The filename of the index.
+        """
+        self.filename = filename
+        self._mapping = (None, None, 0)
+        self._lock = threading.Lock()
+
+    def stamp(self):
+        """Return a stamp identifying the current version of the index."""
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def _invalid(self, reason):
+        return OneLogin_Saml2_Error(
+            'Invalid federation index: %s',
+            OneLogin_Saml2_Error.SETTINGS_INVALID,
+            '{0} ({1})'.format(self.filename, reason)
+        )
+
+    def _open(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError) as e:
+            # mmap refuses empty files with a ValueError.
+            raise self._invalid(e)
+        try:
+            size = len(buf)
+            if size < _HEADER.size:
+                raise self._invalid('truncated header')
+            magic, count, _ = _HEADER.unpack_from(buf, 0)
+            if magic != MAGIC:
+                raise self._invalid('bad magic')
+            if _HEADER.size + count * _ENTRY.size > size:
+                raise self._invalid('truncated table')
+            # Check every entry once, so lookups never read past the end.
+            for i in range(count):
+                k_off, k_len, r_off, r_len = _ENTRY.unpack_from(
+                    buf, _HEADER.size + i * _ENTRY.size
+                )
+                if k_off + k_len > size or r_off + r_len > size:
+                    raise self._invalid('truncated data')
+        except OneLogin_Saml2_Error:
+            buf.close()
+            raise
+        return buf, count
+
+    def _map(self):
+        stamp = self.stamp()
+        if stamp is None:
+            raise OneLogin_Saml2_Error(
+                'Federation index not found: %s',
+                OneLogin_Saml2_Error.SETTINGS_FILE_NOT_FOUND,
+                self.filename
+            )
+        mapping = self._mapping
+        if mapping[0] != stamp:
+            with self._lock:
+                mapping = self._mapping
+                if mapping[0] != stamp:
+                    buf, count = self._open()
+                    # Mappings still in use by other threads are released
+                    # when the last reference is dropped.
+                    mapping = (stamp, buf, count)
+                    self._mapping = mapping
+        return mapping[1], mapping[2]
+
+    def __len__(self):
+        """Return the number of indexed identity providers."""
+        return self._map()[1]
+
+    def _entry(self, buf, i):
+        key_offset, key_len, rec_offset, rec_len = _ENTRY.unpack_from(
+            buf, _HEADER.size + i * _ENTRY.size
+        )
+        return buf[key_offset:key_offset + key_len], rec_offset, rec_len
+
+    def get(self, entity_id):
+        """Return the data of an identity provider.
+
+        The entity is found by a binary search over the sorted table of the
+        index.
+
+        :param entity_id: The entityID of the identity provider.
+        :returns: The IdP data as returned by :func:`parse_entity` or
+            ``None`` if the entity is not indexed.
+        """
+        buf, count = self._map()
+        key = entity_id.encode('utf-8')
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key, rec_offset, rec_len = self._entry(buf, mid)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return decode_record(
+                    entity_id,
+                    memoryview(buf)[rec_offset:rec_offset + rec_len]
+                )
+        return None
+
+    def entity_ids(self):
+        """Iterate over the entityIDs of all indexed identity providers."""
+        buf, count = self._map()
+        for i in range(count):
+            yield self._entry(buf, i)[0].decode('utf-8')
+
+    def idp_settings(self, entity_id):
+        """Return the python3-saml ``idp`` settings of an identity provider.
+
+        :param entity_id: The entityID of the identity provider.
+        :returns: The ``idp`` settings dictionary.
+        """
+        idp = self.get(entity_id)
+        if idp is None:
+            raise OneLogin_Saml2_Error(
+                'Identity provider not found in federation index: %s',
+                OneLogin_Saml2_Error.SETTINGS_INVALID,
+                entity_id
+            )
+        return idp_settings(idp)
@@ -22,23 +22,69 @@ from __future__ import absolute_import, print_function
 
 from flask import current_app, redirect, session
 from flask_login import current_user
+from invenio_accounts.models import User
 from invenio_db import db
 from invenio_oauthclient.errors import AlreadyLinkedError
 from invenio_oauthclient.handlers import (get_session_next_url,
                                           oauth_error_handler,
                                           token_session_key)
+from invenio_oauthclient.models import UserIdentity
 from invenio_oauthclient.utils import (create_csrf_disabled_registrationform,
                                        fill_form, oauth_authenticate,
                                        oauth_get_user, oauth_link_external_id,
                                        oauth_register)
 from werkzeug.local import LocalProxy
 
+from .instrumentation import timed
+from .mapping import AttributeMappingError
 from .utils import get_account_info
+from .writes import minimal_user_data, profile_write
 
 _security = LocalProxy(lambda: current_app.extensions['security'])
 
 _datastore = LocalProxy(lambda: _security.datastore)
 
+_ext = LocalProxy(
+    lambda: current_app.extensions['shibboleth-authenticator']
+)
+
+
+def get_linked_user(remote, external_id):
+    """Return the user linked to an external id.
+
+    The user is loaded together with the link in a single query.
+
+    :param remote: The remote application.
+    :param external_id: The external id of the user.
+    :returns: A :class:`invenio_accounts.models.User` instance or ``None``.
+    """
+    return User.query.join(
+        UserIdentity, UserIdentity.id_user == User.id
+    ).filter(
+        UserIdentity.id == external_id,
+        UserIdentity.method == remote,
+    ).one_or_none()
+
+
+def get_cached_user(remote, external_id):
+    """Return the user linked to an external id from the user cache.
+
+    :param remote: The remote application.
+    :param external_id: The external id of the user.
+    :returns: A :class:`invenio_accounts.models.User` instance or ``None``
+        if the user is not cached or the cache is disabled.
+    """
+    cache = _ext.user_cache
+    if cache is None:
+        return None
+    user_id = cache.get(remote, external_id)
+    if user_id is None:
+        return None
+    user = User.query.get(user_id)
+    if user is None:
+        cache.invalidate(remote, external_id)
+    return user
+
 
 #
 # Handlers
@@ -62,23 +108,42 @@ def authorized_signup_handler(auth, remote=None, *args, **kwargs):
 
     # Sign-in/up user
     # ---------------
+    resolved = write = None
     if not current_user.is_authenticated:
-        account_info = get_account_info(auth.get_attributes(), remote)
+        try:
+            with timed('account_info', remote):
+                account_info = get_account_info(auth.get_attributes(),
+                                                remote)
+        except AttributeMappingError as e:
+            current_app.logger.warning(str(e))
+            return current_app.login_manager.unauthorized()
 
-        user = oauth_get_user(
-            remote,
-            account_info=account_info
-        )
+        external_id = account_info['external_id']
+        with timed('user_lookup', remote):
+            user = get_cached_user(remote, external_id)
+            cached = linked = user is not None
+            if not linked:
+                user = get_linked_user(remote, external_id)
+                linked = user is not None
+            if not linked:
+                user = oauth_get_user(
+                    remote,
+                    account_info=account_info
+                )
         if user is None:
             # Auto sign-up if user not found
-            form = create_csrf_disabled_registrationform()
+            with timed('register', remote):
+                form = create_csrf_disabled_registrationform()
 
-            form = fill_form(
-                form,
-                account_info['user']
-            )
+                user_data = account_info['user']
+                if _ext.write_queue is not None:
+                    user_data = minimal_user_data(user_data)
+                form = fill_form(
+                    form,
+                    user_data
+                )
 
-            user = oauth_register(form)
+                user = oauth_register(form)
 
             # if registration fails ...
             if user is None:
@@ -89,18 +154,31 @@ def authorized_signup_handler(auth, remote=None, *args, **kwargs):
                                   require_existing_link=False):
             return current_app.login_manager.unauthorized()
 
-    db.session.commit()
-
-    # create external id link
-    try:
-        oauth_link_external_id(
-            user, dict(
-                id=account_info['external_id'],
-                method=remote)
-        )
+        # create external id link
+        if not linked:
+            try:
+                with timed('link', remote):
+                    oauth_link_external_id(
+                        user, dict(
+                            id=external_id,
+                            method=remote)
+                    )
+            except AlreadyLinkedError:
+                # Linked by a concurrent login.
+                pass
+        if not cached:
+            resolved = (external_id, user)
+        if _ext.write_queue is not None:
+            write = profile_write(user, remote, account_info)
+
+    with timed('commit', remote):
         db.session.commit()
-    except AlreadyLinkedError:
-        pass
+
+    if resolved is not None and _ext.user_cache is not None:
+        _ext.user_cache.set(remote, resolved[0], resolved[1].id)
+
+    if write is not None:
+        _ext.write_queue.put(write)
 
     # Redirect to next
     next_url = get_session_next_url(remote)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Timing of the stages of a login.
+
+:func:`timed` measures a stage and sends
+:data:`shibboleth_authenticator.signals.stage_timed`. Nothing is measured as
+long as no receiver is connected. The adapters below forward the timings to
+Prometheus and statsd:
+
+.. code-block:: python
+
+    from shibboleth_authenticator.instrumentation import PrometheusTimer
+
+    PrometheusTimer().connect(app)
+"""
+
+from __future__ import absolute_import, print_function
+
+from contextlib import contextmanager
+from timeit import default_timer
+
+from flask import current_app
+
+from .signals import stage_timed
+
+
+@contextmanager
+def timed(stage, remote_app):
+    """Measure the duration of a stage of a login.
+
+    :param stage: The name of the stage.
+    :param remote_app: The remote application key name.
+    """
+    if not stage_timed.receivers:
+        yield
+        return
+    start = default_timer()
+    try:
+        yield
+    finally:
+        stage_timed.send(
+            current_app._get_current_object(),
+            remote_app=remote_app,
+            stage=stage,
+            duration=default_timer() - start,
+        )
+
+
+class PrometheusTimer(object):
+    """Record stage timings in a Prometheus histogram.
+
+    Requires the ``prometheus_client`` package.
+    """
+
+    def __init__(self, name='shibboleth_login_stage_seconds',
+                 registry=None, buckets=None):
+        """Create the histogram.
+
+        :param name: Name of the histogram.
+        :param registry: Registry of the histogram. Defaults to the global
+            registry of ``prometheus_client``.
+        :param buckets: Optional upper bounds of the buckets.
+        """
+        from prometheus_client import REGISTRY, Histogram
+        kwargs = dict(
+            labelnames=('remote_app', 'stage'),
+            registry=REGISTRY if registry is None else registry,
+        )
+        if buckets is not None:
+            kwargs['buckets'] = buckets
+        self.histogram = Histogram(
+            name, 'Duration of the stages of a Shibboleth login.', **kwargs
+        )
+
+    def __call__(self, sender, remote_app=None, stage=None, duration=None):
+        """Observe a timing."""
+        self.histogram.labels(remote_app, stage).observe(duration)
+
+    def connect(self, app=None):
+        """Connect to :data:`~shibboleth_authenticator.signals.stage_timed`.
+
+        :param app: Only record timings of this application.
+        """
+        stage_timed.connect(self, sender=app or stage_timed.ANY, weak=False)
+        return self
+
+    def disconnect(self):
+        """Stop receiving timings."""
+        stage_timed.disconnect(self)
+
+
+class StatsdTimer(object):
+    """Send stage timings to statsd.
+
+    Timings are sent as ``<prefix>.<remote_app>.<stage>`` in milliseconds.
+    """
+
+    def __init__(self, client=None, prefix='shibboleth.login'):
+        """Initialize the adapter.
+
+        :param client: A ``statsd.StatsClient`` or any object with a
+            compatible ``timing`` method. Defaults to a client for
+            ``localhost:8125``.
+        :param prefix: Prefix of the metric names.
+        """
+        if client is None:
+            from statsd import StatsClient
+            client = StatsClient()
+        self.client = client
+        self.prefix = prefix
+
+    def __call__(self, sender, remote_app=None, stage=None, duration=None):
+        """Send a timing."""
+        self.client.timing(
+            '{0}.{1}.{2}'.format(self.prefix, remote_app, stage),
+            duration * 1000.0,
+        )
+
+    def connect(self, app=None):
+        """Connect to :data:`~shibboleth_authenticator.signals.stage_timed`.
+
+        :param app: Only send timings of this application.
+        """
+        stage_timed.connect(self, sender=app or stage_timed.ANY, weak=False)
+        return self
+
+    def disconnect(self):
+        """Stop receiving timings."""
+        stage_timed.disconnect(self)
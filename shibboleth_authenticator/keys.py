@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cache of the xmlsec keys used to verify signatures of the IdPs.
+
+python3-saml loads the PEM certificate of the IdP into a new xmlsec key for
+every signature it verifies. With ``SHIBBOLETH_KEY_CACHE_SIZE`` set, every
+application gets its own :class:`KeyCache` and :func:`install` wraps
+``OneLogin_Saml2_Utils.validate_node_sign`` so that, while it runs in such
+an application, python3-saml gets the key from the cache of the
+application. The validation itself is left to python3-saml, and all other
+calls, including those of other users of python3-saml in the same process,
+load their keys as before. Certificates that are no longer part of the
+settings of a remote application are evicted when its settings are reloaded.
+
+xmlsec and python3-saml are imported on first use, so that loading the
+extension does not pay for them.
+"""
+
+from __future__ import absolute_import, print_function
+
+import threading
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+
+def cert_fingerprint(cert):
+    """Return the SHA-256 fingerprint of a PEM certificate.
+
+    :param cert: The formatted certificate.
+    :returns: The fingerprint or ``None`` if ``cert`` is no certificate.
+    """
+    from onelogin.saml2.utils import OneLogin_Saml2_Utils
+    return OneLogin_Saml2_Utils.calculate_x509_fingerprint(cert, 'sha256')
+
+
+def idp_certs(settings):
+    """Return the signing certificates of the IdP.
+
+    :param settings: A :class:`onelogin.saml2.settings.OneLogin_Saml2_Settings`
+        instance.
+    :returns: List of formatted certificates.
+    """
+    idp = settings.get_idp_data()
+    certs = list(idp.get('x509certMulti', {}).get('signing', []))
+    if idp.get('x509cert'):
+        certs.append(idp['x509cert'])
+    return certs
+
+
+class KeyCache(object):
+    """LRU cache of xmlsec keys keyed by certificate fingerprint."""
+
+    def __init__(self, maxsize=64):
+        """Initialize an empty cache.
+
+        :param maxsize: Maximum number of cached keys.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._keys = OrderedDict()
+        self._owners = {}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+
+    def fingerprint(self, cert):
+        """Return the fingerprint of a certificate.
+
+        Fingerprints of the certificates of loaded settings are computed
+        once by :meth:`update`.
+
+        :param cert: The formatted PEM certificate.
+        :returns: The fingerprint.
+        """
+        fp = self._fingerprints.get(cert)
+        if fp is None:
+            fp = cert_fingerprint(cert)
+        return fp
+
+    def get(self, cert):
+        """Return the verification key of a certificate.
+
+        :param cert: The formatted PEM certificate.
+        :returns: A :class:`xmlsec.Key`.
+        """
+        fp = self.fingerprint(cert)
+        with self._lock:
+            key = self._keys.pop(fp, None)
+            if key is not None:
+                self._keys[fp] = key
+                self.hits += 1
+                return key
+            self.misses += 1
+
+        import xmlsec
+        key = xmlsec.Key.from_memory(cert, xmlsec.KeyFormat.CERT_PEM, None)
+        with self._lock:
+            self._keys[fp] = key
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+        return key
+
+    def update(self, remote_app, settings):
+        """Track the certificates of a remote application.
+
+        Keys of certificates that were used by the remote application before
+        and are not used by any remote application anymore are evicted.
+
+        :param remote_app: The remote application key name.
+        :param settings: The new settings of the remote application.
+        """
+        certs = dict((c, self.fingerprint(c)) for c in idp_certs(settings))
+        with self._lock:
+            old = self._owners.get(remote_app, {})
+            self._owners[remote_app] = certs
+            self._fingerprints = dict(
+                item for owned in self._owners.values()
+                for item in owned.items()
+            )
+            in_use = set(self._fingerprints.values())
+            for fp in set(old.values()) - in_use:
+                self._keys.pop(fp, None)
+
+    def on_settings_load(self, remote_app, settings):
+        """Install the key cache and track the certificates of new settings.
+
+        Used as ``on_load`` callback of the
+        :class:`shibboleth_authenticator.cache.SettingsCache`, so that
+        python3-saml is only patched once it is loaded anyway.
+
+        :param remote_app: The remote application key name.
+        :param settings: The new settings of the remote application.
+        """
+        install()
+        self.update(remote_app, settings)
+
+    def clear(self):
+        """Drop all keys and reset the counters."""
+        with self._lock:
+            self._keys.clear()
+            self._owners.clear()
+            self._fingerprints = {}
+            self.hits = self.misses = 0
+
+    def info(self):
+        """Return the cache statistics."""
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self._keys),
+            maxsize=self.maxsize,
+        )
+
+    def __contains__(self, cert):
+        """Check if the key of a certificate is cached."""
+        return self.fingerprint(cert) in self._keys
+
+
+worker_key_cache = None
+"""Key cache of a verification worker process, see
+:mod:`shibboleth_authenticator.verify`."""
+
+_validate_node_sign = None
+
+
+def current_key_cache():
+    """Return the key cache used by the current thread.
+
+    :returns: The :class:`KeyCache` of the current application, of the
+        verification worker or ``None``.
+    """
+    if has_app_context():
+        ext = current_app.extensions.get('shibboleth-authenticator')
+        return getattr(ext, 'key_cache', None)
+    return worker_key_cache
+
+
+class _Key(object):
+    """Stand-in for :class:`xmlsec.Key` that loads certificates from a cache.
+
+    Only used while :func:`validate_node_sign` runs in a thread with a key
+    cache, all other calls reach xmlsec unchanged.
+    """
+
+    def __getattr__(self, name):
+        import xmlsec
+        return getattr(xmlsec.Key, name)
+
+    def from_memory(self, data, format, password=None):
+        import xmlsec
+        cache = getattr(_local, 'key_cache', None)
+        if (cache is not None and format == xmlsec.KeyFormat.CERT_PEM and
+                password is None):
+            return cache.get(data)
+        return xmlsec.Key.from_memory(data, format, password)
+
+
+class _Xmlsec(object):
+    """Stand-in for the xmlsec module used by python3-saml."""
+
+    Key = _Key()
+
+    def __getattr__(self, name):
+        import xmlsec
+        return getattr(xmlsec, name)
+
+
+_local = threading.local()
+
+
+def validate_node_sign(*args, **kwargs):
+    """Validate a signature node using a cached key.
+
+    The validation is done by python3-saml, only loading the certificate
+    into an xmlsec key is served from the key cache of the current
+    application or verification worker.
+    """
+    cache = current_key_cache()
+    if cache is None:
+        return _validate_node_sign(*args, **kwargs)
+    _local.key_cache = cache
+    try:
+        return _validate_node_sign(*args, **kwargs)
+    finally:
+        _local.key_cache = None
+
+
+def install():
+    """Make python3-saml verify signatures with cached keys."""
+    global _validate_node_sign
+    from onelogin.saml2 import utils
+    if _validate_node_sign is None:
+        _validate_node_sign = utils.OneLogin_Saml2_Utils.validate_node_sign
+        utils.xmlsec = _Xmlsec()
+    utils.OneLogin_Saml2_Utils.validate_node_sign = staticmethod(
+        validate_node_sign
+    )
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Mapping of SAML attributes to the account information of a user.
+
+The ``mappings`` of a remote application map the fields of the account
+information to SAML attributes. A field is either given as the name of an
+attribute, as a list of attributes that are tried in order, or as a
+dictionary with the following keys:
+
+- ``attributes`` - Name or list of names of the attributes.
+- ``transforms`` - List of transforms applied to every value. A transform is
+  either a name or a tuple of a name and an argument: ``'lowercase'``,
+  ``'uppercase'``, ``'strip'``, ``'strip_scope'`` (removes ``@scope``) and
+  ``('regex', pattern)`` (extracts the first group or the whole match, values
+  that do not match are dropped).
+- ``multi`` - Return all values instead of the first one.
+- ``required`` - Raise an :class:`AttributeMappingError` if no value is
+  found. **Default:** ``True``.
+- ``default`` - Value of an optional field without values.
+
+The fields ``email``, ``full_name`` and ``user_unique_id`` are required.
+``username`` defaults to ``user_unique_id`` without its scope. All other
+fields are returned in the ``extra`` dictionary of the account information.
+
+.. code-block:: python
+
+    mappings=dict(
+        email=dict(attributes=['mail', 'email'], transforms=['lowercase']),
+        full_name=['displayName', 'cn'],
+        user_unique_id='eppn',
+        groups=dict(attributes='isMemberOf', multi=True, required=False,
+                    default=[]),
+    )
+
+Mappings are compiled once into an :class:`AccountInfoMapper`.
+"""
+
+from __future__ import absolute_import, print_function
+
+import re
+import threading
+
+from ._compat import string_types
+
+REQUIRED_FIELDS = ('email', 'full_name', 'user_unique_id')
+"""Fields every mapping has to define."""
+
+
+class AttributeMappingError(KeyError):
+    """No value was found for a required field."""
+
+    def __init__(self, remote_app, field, attributes):
+        """Initialize the error.
+
+        :param remote_app: The remote application key name.
+        :param field: The name of the field.
+        :param attributes: The attributes that were searched.
+        """
+        super(AttributeMappingError, self).__init__(remote_app, field,
+                                                    attributes)
+        self.remote_app = remote_app
+        self.field = field
+        self.attributes = attributes
+
+    def __str__(self):
+        """Return a readable message."""
+        return 'No value for {0} of {1} in attributes {2}'.format(
+            self.field, self.remote_app, ', '.join(self.attributes)
+        )
+
+
+def _regex(pattern):
+    regex = re.compile(pattern)
+
+    def extract(value):
+        match = regex.search(value)
+        if match is None:
+            return None
+        return match.group(1) if regex.groups else match.group(0)
+    return extract
+
+
+TRANSFORMS = dict(
+    lowercase=lambda: lambda value: value.lower(),
+    uppercase=lambda: lambda value: value.upper(),
+    strip=lambda: lambda value: value.strip(),
+    strip_scope=lambda: lambda value: value.split('@', 1)[0],
+    regex=_regex,
+)
+"""Factories of the available transforms."""
+
+
+def compile_transform(spec):
+    """Compile a transform.
+
+    :param spec: Name of the transform or tuple of a name and an argument.
+    :returns: A function transforming a single value.
+    """
+    if isinstance(spec, string_types):
+        name, args = spec, ()
+    else:
+        name, args = spec[0], tuple(spec[1:])
+    if name not in TRANSFORMS:
+        raise ValueError('Unknown transform: {0}'.format(name))
+    return TRANSFORMS[name](*args)
+
+
+class Field(object):
+    """Compiled extractor of a single field."""
+
+    __slots__ = ('name', 'attributes', 'transforms', 'multi', 'required',
+                 'default')
+
+    def __init__(self, name, spec):
+        """Compile the specification of a field.
+
+        :param name: The name of the field.
+        :param spec: The specification, see module documentation.
+        """
+        if isinstance(spec, (string_types, list, tuple)):
+            spec = dict(attributes=spec)
+        attributes = spec['attributes']
+        if isinstance(attributes, string_types):
+            attributes = [attributes]
+        self.name = name
+        self.attributes = tuple(attributes)
+        self.transforms = tuple(
+            compile_transform(t) for t in spec.get('transforms', ())
+        )
+        self.multi = spec.get('multi', False)
+        self.required = spec.get('required', True)
+        self.default = spec.get('default')
+
+    def extract(self, remote_app, attributes):
+        """Extract the value of the field.
+
+        :param remote_app: The remote application key name.
+        :param attributes: The SAML attributes.
+        :returns: The value or the list of values.
+        """
+        for attribute in self.attributes:
+            values = attributes.get(attribute)
+            if not values:
+                continue
+            for transform in self.transforms:
+                values = [transform(v) for v in values if v]
+            values = [v for v in values if v]
+            if values:
+                return values if self.multi else values[0]
+        if self.required:
+            raise AttributeMappingError(remote_app, self.name,
+                                        self.attributes)
+        return self.default
+
+
+class AccountInfoMapper(object):
+    """Compiled mapping of a remote application."""
+
+    def __init__(self, remote_app, mappings):
+        """Compile the mappings of a remote application.
+
+        :param remote_app: The remote application key name.
+        :param mappings: The ``mappings`` of the remote application.
+        """
+        missing = [f for f in REQUIRED_FIELDS if f not in mappings]
+        if missing:
+            raise ValueError('Missing mappings of {0}: {1}'.format(
+                remote_app, ', '.join(missing)
+            ))
+        self.remote_app = remote_app
+        self.email = Field('email', mappings['email'])
+        self.full_name = Field('full_name', mappings['full_name'])
+        self.external_id = Field('user_unique_id',
+                                 mappings['user_unique_id'])
+        self.username = None
+        if 'username' in mappings:
+            self.username = Field('username', mappings['username'])
+        self.extra = tuple(
+            Field(name, spec) for name, spec in sorted(mappings.items())
+            if name not in REQUIRED_FIELDS and name != 'username'
+        )
+
+    def __call__(self, attributes):
+        """Return the account information.
+
+        :param attributes: The SAML attributes.
+        :returns: The account information.
+        """
+        remote_app = self.remote_app
+        external_id = self.external_id.extract(remote_app, attributes)
+        if self.username is None:
+            username = external_id.split('@')[0]
+        else:
+            username = self.username.extract(remote_app, attributes)
+        account_info = dict(
+            user=dict(
+                email=self.email.extract(remote_app, attributes),
+                profile=dict(
+                    full_name=self.full_name.extract(remote_app, attributes),
+                    username=username,
+                ),
+            ),
+            external_id=external_id,
+            external_method=remote_app,
+        )
+        if self.extra:
+            account_info['extra'] = dict(
+                (f.name, f.extract(remote_app, attributes))
+                for f in self.extra
+            )
+        return account_info
+
+
+class MapperRegistry(object):
+    """Compiled mappings of all remote applications.
+
+    A mapper is compiled again if the ``mappings`` of its remote application
+    have been replaced in the configuration.
+    """
+
+    def __init__(self, remote_apps=None):
+        """Compile the mappings of the remote applications.
+
+        :param remote_apps: The ``SHIBBOLETH_REMOTE_APPS`` configuration.
+        """
+        self._mappers = {}
+        self._lock = threading.Lock()
+        for remote_app, conf in (remote_apps or {}).items():
+            if 'mappings' in conf:
+                self.get(remote_app, remote_apps)
+
+    def get(self, remote_app, remote_apps):
+        """Return the mapper of a remote application.
+
+        :param remote_app: The remote application key name.
+        :param remote_apps: The ``SHIBBOLETH_REMOTE_APPS`` configuration.
+        :returns: An :class:`AccountInfoMapper`.
+        """
+        mappings = remote_apps[remote_app]['mappings']
+        entry = self._mappers.get(remote_app)
+        if entry is None or entry[0] is not mappings:
+            with self._lock:
+                entry = (mappings, AccountInfoMapper(remote_app, mappings))
+                self._mappers[remote_app] = entry
+        return entry[1]
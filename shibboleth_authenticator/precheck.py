@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cheap checks of SAML responses before they are handed to python3-saml.
+
+python3-saml decodes and parses the whole document before it finds any
+problem with it. :class:`ResponseChecker` rejects payloads that cannot be a
+SAML response, or that would be expensive to parse, by looking at the raw
+bytes only.
+"""
+
+from __future__ import absolute_import, print_function
+
+import base64
+import binascii
+import re
+import sys
+import threading
+from collections import Counter
+
+TOO_LARGE = 'too_large'
+"""The encoded response exceeds the maximum size."""
+
+INVALID_BASE64 = 'invalid_base64'
+"""The response is not valid base64."""
+
+INVALID_ROOT = 'invalid_root'
+"""The root element of the document is not a ``Response``."""
+
+ENTITY = 'entity'
+"""The document contains a document type or entity declaration."""
+
+TOO_DEEP = 'too_deep'
+"""Elements of the document are nested deeper than allowed."""
+
+_WHITESPACE = re.compile(br'\s+')
+
+_BASE64 = re.compile(br'[A-Za-z0-9+/]*={0,2}\Z')
+
+_ROOT = re.compile(
+    br'(?:\xef\xbb\xbf)?\s*(?:<\?xml[^>]*\?>\s*)?'
+    br'<(?:[A-Za-z_][\w.-]*:)?Response[\s/>]'
+)
+
+_MARKUP = re.compile(br'<(/?)([!?]?)[^<>]*?(/?)>')
+
+_DECLARATION = re.compile(br'<!(?:DOCTYPE|ENTITY)')
+
+
+if sys.version_info[0] >= 3:
+    def _b64decode(encoded):
+        return base64.b64decode(encoded, validate=True)
+else:
+    def _b64decode(encoded):
+        if not _BASE64.match(encoded):
+            raise TypeError('Non-base64 digit found')
+        return base64.b64decode(encoded)
+
+
+def _depth(xml):
+    depth = max_depth = 0
+    for match in _MARKUP.finditer(xml):
+        closing, special, empty = match.groups()
+        if special or empty:
+            continue
+        if closing:
+            depth -= 1
+        else:
+            depth += 1
+            max_depth = max(max_depth, depth)
+    return max_depth
+
+
+class ResponseChecker(object):
+    """Pre-validation of encoded SAML responses with rejection counters."""
+
+    def __init__(self, max_size=None, max_depth=None):
+        """Initialize the checker.
+
+        :param max_size: Maximum length of the encoded response. ``None``
+            disables the check.
+        :param max_depth: Maximum nesting depth of elements. ``None``
+            disables the check.
+        """
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.rejections = Counter()
+        self._lock = threading.Lock()
+
+    def check(self, encoded):
+        """Check an encoded SAML response.
+
+        :param encoded: The value of the ``SAMLResponse`` parameter.
+        :returns: The reason of the rejection or ``None`` if the response
+            may be processed.
+        """
+        reason = self._check(encoded)
+        if reason is not None:
+            with self._lock:
+                self.rejections[reason] += 1
+        return reason
+
+    def _check(self, encoded):
+        if self.max_size and len(encoded) > self.max_size:
+            return TOO_LARGE
+        if not isinstance(encoded, bytes):
+            try:
+                encoded = encoded.encode('ascii')
+            except UnicodeError:
+                return INVALID_BASE64
+        encoded = _WHITESPACE.sub(b'', encoded)
+        if len(encoded) % 4:
+            return INVALID_BASE64
+        try:
+            xml = _b64decode(encoded)
+        except (binascii.Error, TypeError):
+            return INVALID_BASE64
+        if not _ROOT.match(xml):
+            return INVALID_ROOT
+        if _DECLARATION.search(xml):
+            return ENTITY
+        if self.max_depth and _depth(xml) > self.max_depth:
+            return TOO_DEEP
+        return None
+
+    def info(self):
+        """Return the number of rejections per reason."""
+        with self._lock:
+            return dict(self.rejections)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bulk provisioning of users from exported IdP attributes.
+
+Every record of an export is mapped with
+:func:`shibboleth_authenticator.utils.get_account_info`, just like the
+attributes of a login. Records are processed in chunks: external ids and
+users that are already linked to the remote application are skipped, users
+that exist with the same email address are linked, and all other users are
+created together with their profiles and links by bulk inserts. Email
+addresses are compared case-insensitively, and usernames that are not valid
+for user profiles are dropped.
+"""
+
+from __future__ import absolute_import, print_function
+
+import csv
+import json
+from collections import OrderedDict
+from itertools import islice
+
+from invenio_accounts.models import User
+from invenio_db import db
+from invenio_oauthclient.models import UserIdentity
+from sqlalchemy import func
+
+from .mapping import AttributeMappingError
+from .utils import get_account_info
+
+try:
+    from invenio_userprofiles.models import UserProfile
+    from invenio_userprofiles.validators import validate_username
+except ImportError:
+    UserProfile = None
+
+
+def read_csv(stream, separator=';'):
+    """Read attributes from a CSV export.
+
+    The first row contains the attribute names. Multiple values of an
+    attribute are joined by ``separator``.
+
+    :param stream: A text file.
+    :param separator: The separator of multiple values.
+    :returns: Iterator of attribute dictionaries.
+    """
+    for row in csv.DictReader(stream):
+        yield dict(
+            (name, [v for v in value.split(separator) if v]
+             if separator else [value])
+            for name, value in row.items() if name and value
+        )
+
+
+def read_jsonl(stream):
+    """Read attributes from a JSON lines export.
+
+    Every line is an object mapping attribute names to a value or a list of
+    values.
+
+    :param stream: A text file.
+    :returns: Iterator of attribute dictionaries.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        yield dict(
+            (name, value if isinstance(value, list) else [value])
+            for name, value in json.loads(line).items()
+        )
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def provision_chunk(records, remote_app, stats):
+    """Provision the users of a chunk of attribute records.
+
+    :param records: List of attribute dictionaries.
+    :param remote_app: The remote application key name.
+    :param stats: Dictionary of counters that is updated.
+    """
+    accounts = OrderedDict()
+    for attributes in records:
+        try:
+            account_info = get_account_info(attributes, remote_app)
+        except AttributeMappingError:
+            stats['invalid'] += 1
+            continue
+        if account_info['external_id'] in accounts:
+            stats['duplicate'] += 1
+            continue
+        accounts[account_info['external_id']] = account_info
+    if not accounts:
+        return
+
+    linked = set(i for i, in db.session.query(UserIdentity.id).filter(
+        UserIdentity.method == remote_app,
+        UserIdentity.id.in_(list(accounts)),
+    ))
+    stats['existing'] += len(linked)
+    for external_id in linked:
+        del accounts[external_id]
+
+    if not accounts:
+        return
+    emails = OrderedDict()
+    for external_id, account_info in accounts.items():
+        emails.setdefault(account_info['user']['email'].lower(), external_id)
+    stats['duplicate'] += len(accounts) - len(emails)
+    users = _user_ids(list(emails))
+    # Users may only be linked once per remote application.
+    taken = _linked_user_ids(list(users.values()), remote_app)
+    for email, user_id in list(users.items()):
+        if user_id in taken:
+            stats['existing'] += 1
+            del users[email]
+            del emails[email]
+    stats['linked'] += len(users)
+
+    new = [e for e in emails if e not in users]
+    if new:
+        db.session.execute(User.__table__.insert(), [
+            dict(email=accounts[emails[e]]['user']['email'], active=True)
+            for e in new
+        ])
+        created = _user_ids(new)
+        stats['created'] += len(created)
+        if UserProfile is not None:
+            _insert_profiles(
+                [(created[e], accounts[emails[e]]) for e in new]
+            )
+        users.update(created)
+
+    if emails:
+        db.session.execute(UserIdentity.__table__.insert(), [
+            dict(id=external_id, method=remote_app, id_user=users[email])
+            for email, external_id in emails.items()
+        ])
+    db.session.commit()
+
+
+def _user_ids(emails):
+    email = func.lower(User.email)
+    return dict(db.session.query(email, User.id).filter(email.in_(emails)))
+
+
+def _linked_user_ids(user_ids, remote_app):
+    if not user_ids:
+        return set()
+    return set(i for i, in db.session.query(UserIdentity.id_user).filter(
+        UserIdentity.method == remote_app,
+        UserIdentity.id_user.in_(user_ids),
+    ))
+
+
+def _username(profile):
+    username = profile.get('username') or None
+    if username is not None:
+        try:
+            validate_username(username)
+        except ValueError:
+            return None
+    return username
+
+
+def _insert_profiles(accounts):
+    usernames = set(
+        (_username(a['user'].get('profile', {})) or '').lower()
+        for _, a in accounts
+    )
+    taken = set(u for u, in db.session.query(UserProfile._username).filter(
+        UserProfile._username.in_(list(usernames))
+    ))
+    profiles = []
+    for user_id, account_info in accounts:
+        profile = account_info['user'].get('profile', {})
+        username = _username(profile)
+        if username is not None and username.lower() in taken:
+            username = None
+        if username is not None:
+            taken.add(username.lower())
+        profiles.append(dict(
+            user_id=user_id,
+            username=username.lower() if username else None,
+            displayname=username,
+            full_name=profile.get('full_name') or '',
+        ))
+    db.session.execute(UserProfile.__table__.insert(), profiles)
+
+
+def provision(records, remote_app, chunk_size=1000, progress=None):
+    """Provision users from attribute records.
+
+    :param records: Iterable of attribute dictionaries.
+    :param remote_app: The remote application key name.
+    :param chunk_size: Number of records written per transaction.
+    :param progress: Optional callable invoked with the number of processed
+        records and the counters after every chunk.
+    :returns: Dictionary with the number of ``created`` users, users that
+        existed and were ``linked``, ``existing`` links and ``duplicate``
+        and ``invalid`` records.
+    :raises ValueError: If ``chunk_size`` is not positive.
+    """
+    if chunk_size <= 0:
+        raise ValueError('chunk_size must be positive.')
+    stats = dict(created=0, linked=0, existing=0, duplicate=0, invalid=0)
+    processed = 0
+    for chunk in _chunks(records, chunk_size):
+        try:
+            provision_chunk(chunk, remote_app, stats)
+        except Exception:
+            db.session.rollback()
+            raise
+        processed += len(chunk)
+        if progress is not None:
+            progress(processed, stats)
+    return stats
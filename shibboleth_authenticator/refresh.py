@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Background refresh of the federation index.
+
+:class:`MetadataRefresher` fetches the metadata of a federation (or of a
+single IdP) from ``SHIBBOLETH_FEDERATION_URL`` with a conditional GET. New
+metadata is only accepted if it carries a valid signature of the
+``SHIBBOLETH_FEDERATION_CERT``, if it has a ``validUntil`` in the future and
+if it still contains the IdPs of all remote applications with an
+``entity_id``. It is then indexed into a temporary file that is renamed over
+``SHIBBOLETH_FEDERATION_INDEX``, and the settings of these remote
+applications are reloaded, so requests keep using the previous index until
+the new one is complete. If anything fails, the previous index stays in
+place. Processes sharing the index take turns through a lock file next to
+it; a process finding the lock taken skips its refresh.
+
+Checking the signature needs the whole document in memory, so run the
+refresh from the command line or cron, and only enable the background
+thread of ``SHIBBOLETH_FEDERATION_REFRESH`` where that memory is available.
+
+Every refresh sends
+:data:`~shibboleth_authenticator.signals.metadata_refreshed`.
+"""
+
+from __future__ import absolute_import, print_function
+
+import errno
+import os
+import tempfile
+import threading
+import time
+from contextlib import closing, contextmanager
+from timeit import default_timer
+
+from onelogin.saml2.errors import (OneLogin_Saml2_Error,
+                                   OneLogin_Saml2_ValidationError)
+
+from .federation import NS_DS, NS_MD, FederationIndex, build_index
+from .signals import metadata_refreshed
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+UPDATED = 'updated'
+NOT_MODIFIED = 'not_modified'
+BUSY = 'busy'
+FAILED = 'failed'
+
+
+@contextmanager
+def _file_lock(filename):
+    # Yields whether the lock was acquired, without waiting for it.
+    if fcntl is None:
+        yield True
+        return
+    with open(filename, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except EnvironmentError as e:
+            if e.errno not in (errno.EACCES, errno.EAGAIN):
+                raise
+            locked = False
+        else:
+            locked = True
+        yield locked
+
+
+def verify_metadata(source, cert, now=None):
+    """Verify the signature and the validity of a metadata document.
+
+    :param source: A filename or file object of the metadata document.
+    :param cert: The PEM certificate the document has to be signed with.
+    :param now: The current time as timestamp. Defaults to
+        :func:`time.time`.
+    :returns: The number of seconds the document is valid.
+    """
+    import xmlsec
+    from lxml import etree
+    from onelogin.saml2.utils import OneLogin_Saml2_Utils
+
+    parser = etree.XMLParser(resolve_entities=False, no_network=True)
+    try:
+        tree = etree.parse(source, parser)
+    except etree.XMLSyntaxError as e:
+        raise OneLogin_Saml2_ValidationError(
+            'Invalid metadata: %s',
+            OneLogin_Saml2_ValidationError.INVALID_XML_FORMAT,
+            e
+        )
+    root = tree.getroot()
+    if tree.docinfo.doctype or root.tag not in (
+            '{%s}EntitiesDescriptor' % NS_MD, '{%s}EntityDescriptor' % NS_MD):
+        raise OneLogin_Saml2_ValidationError(
+            'Invalid metadata root element: %s',
+            OneLogin_Saml2_ValidationError.INVALID_XML_FORMAT,
+            root.tag
+        )
+
+    # Without validUntil, a replayed old document would be accepted.
+    if not root.get('validUntil'):
+        raise OneLogin_Saml2_Error(
+            'Metadata has no validUntil',
+            OneLogin_Saml2_Error.SETTINGS_INVALID
+        )
+    valid_for = OneLogin_Saml2_Utils.parse_SAML_to_time(
+        root.get('validUntil')
+    ) - (time.time() if now is None else now)
+    if valid_for <= 0:
+        raise OneLogin_Saml2_Error(
+            'Metadata expired at %s',
+            OneLogin_Saml2_Error.SETTINGS_INVALID,
+            root.get('validUntil')
+        )
+
+    # Only a signature of the root element covers the whole document.
+    signature = root.find('{%s}Signature' % NS_DS)
+    references = [] if signature is None else signature.findall(
+        '{%s}SignedInfo/{%s}Reference' % (NS_DS, NS_DS)
+    )
+    if len(references) != 1:
+        raise OneLogin_Saml2_ValidationError(
+            'Metadata is not signed',
+            OneLogin_Saml2_ValidationError.NO_SIGNATURE_FOUND
+        )
+    if references[0].get('URI') not in ('', '#%s' % root.get('ID')):
+        raise OneLogin_Saml2_ValidationError(
+            'Metadata signature does not reference the root element',
+            OneLogin_Saml2_ValidationError.WRONG_SIGNED_ELEMENT
+        )
+    xmlsec.tree.add_ids(root, ['ID'])
+    dsig_ctx = xmlsec.SignatureContext()
+    dsig_ctx.key = xmlsec.Key.from_memory(cert, xmlsec.KeyFormat.CERT_PEM,
+                                          None)
+    dsig_ctx.set_enabled_key_data([xmlsec.KeyData.X509])
+    try:
+        dsig_ctx.verify(signature)
+    except xmlsec.Error as e:
+        raise OneLogin_Saml2_ValidationError(
+            'Invalid metadata signature: %s',
+            OneLogin_Saml2_ValidationError.INVALID_SIGNATURE,
+            e
+        )
+    return valid_for
+
+
+class MetadataRefresher(object):
+    """Periodic refresh of the federation index from a metadata URL."""
+
+    def __init__(self, app, index, url, cert, interval=3600, timeout=30):
+        """Initialize the refresher.
+
+        :param app: The Flask application.
+        :param index: The refreshed
+            :class:`shibboleth_authenticator.federation.FederationIndex`.
+        :param url: The URL of the metadata.
+        :param cert: Filename of the PEM certificate the metadata is signed
+            with. It is read on every refresh, so it can be rotated without
+            a restart.
+        :param interval: Number of seconds between two refreshes.
+        :param timeout: Timeout of the HTTP requests in seconds.
+        """
+        self.app = app
+        self.index = index
+        self.url = url
+        self.cert = cert
+        self.interval = interval
+        self.timeout = timeout
+        self.refreshes = 0
+        self.not_modified = 0
+        self.failures = 0
+        self.last_success = None
+        self.last_error = None
+        self._etag = None
+        self._last_modified = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Fetch the metadata and swap it into the federation index.
+
+        :returns: ``'updated'``, ``'not_modified'``, ``'busy'`` or
+            ``'failed'``.
+        """
+        start = default_timer()
+        count = error = None
+        # Refreshes of the threads and processes sharing the index do not
+        # overlap.
+        with self._lock, \
+                _file_lock(self.index.filename + '.lock') as locked:
+            if not locked:
+                status = BUSY
+            else:
+                status, count, error = self._locked_refresh()
+        metadata_refreshed.send(
+            self.app,
+            url=self.url,
+            status=status,
+            count=count,
+            error=error,
+            duration=default_timer() - start,
+        )
+        return status
+
+    def _locked_refresh(self):
+        try:
+            count = self._refresh()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = u'{0}'.format(e)
+            self.app.logger.warning(
+                'Failed to refresh federation metadata from %s, keeping '
+                'the previous index: %s', self.url, e
+            )
+            return FAILED, None, e
+        if count is None:
+            self.not_modified += 1
+        else:
+            self.refreshes += 1
+        self.last_success = time.time()
+        self.last_error = None
+        return NOT_MODIFIED if count is None else UPDATED, count, None
+
+    def _refresh(self):
+        import requests
+
+        index = self.index
+        headers = {}
+        if index.stamp() is not None:
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+        with open(self.cert, 'r') as f:
+            cert = f.read()
+
+        resp = requests.get(self.url, headers=headers, timeout=self.timeout,
+                            stream=True)
+        with closing(resp):
+            if resp.status_code == 304:
+                return None
+            resp.raise_for_status()
+            dirname = os.path.dirname(os.path.abspath(index.filename))
+            with tempfile.TemporaryFile(dir=dirname) as source:
+                for chunk in resp.iter_content(65536):
+                    source.write(chunk)
+                source.seek(0)
+                verify_metadata(source, cert)
+                source.seek(0)
+                count = self._swap(source, index.filename)
+        self._etag = resp.headers.get('ETag')
+        self._last_modified = resp.headers.get('Last-Modified')
+        self._reload()
+        return count
+
+    def _swap(self, source, filename):
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(filename)),
+            prefix=os.path.basename(filename),
+        )
+        os.close(fd)
+        try:
+            count = build_index(source, tmp_filename)
+            new_index = FederationIndex(tmp_filename)
+            missing = sorted(
+                conf['entity_id'] for conf in
+                self.app.config['SHIBBOLETH_REMOTE_APPS'].values()
+                if conf.get('entity_id') and
+                new_index.get(conf['entity_id']) is None
+            )
+            if missing:
+                raise OneLogin_Saml2_Error(
+                    'Identity providers missing from the metadata: %s',
+                    OneLogin_Saml2_Error.SETTINGS_INVALID,
+                    ', '.join(missing)
+                )
+            del new_index
+            os.rename(tmp_filename, filename)
+        except Exception:
+            os.remove(tmp_filename)
+            raise
+        return count
+
+    def _reload(self):
+        # Load the new settings here instead of in the next request.
+        ext = self.app.extensions['shibboleth-authenticator']
+        for remote_app, conf in \
+                self.app.config['SHIBBOLETH_REMOTE_APPS'].items():
+            if not conf.get('entity_id'):
+                continue
+            try:
+                ext.settings_cache.get(remote_app, conf['saml_path'],
+                                       conf['entity_id'], self.index)
+            except Exception:
+                self.app.logger.exception(
+                    'Failed to reload the settings of %s.', remote_app
+                )
+
+    def _delay(self):
+        stamp = self.index.stamp()
+        if stamp is None:
+            return 0
+        return max(0, self.interval - (time.time() - stamp[1]))
+
+    def _run(self):
+        while not self._stop.wait(self._delay()):
+            self.refresh()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        """Start refreshing in a background thread.
+
+        The first refresh happens once the index on disk is ``interval``
+        seconds old.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='shibboleth-refresh')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def info(self):
+        """Return the refresh statistics."""
+        return dict(
+            refreshes=self.refreshes,
+            not_modified=self.not_modified,
+            failures=self.failures,
+            last_success=self.last_success,
+            last_error=self.last_error,
+        )
+
+
+def create_metadata_refresher(app, index):
+    """Create the metadata refresher configured for an application.
+
+    :param app: The Flask application.
+    :param index: The federation index of the application.
+    :returns: A :class:`MetadataRefresher` or ``None`` if no metadata URL is
+        configured.
+    """
+    url = app.config['SHIBBOLETH_FEDERATION_URL']
+    if not url:
+        return None
+    if not app.config['SHIBBOLETH_FEDERATION_INDEX']:
+        raise ValueError('SHIBBOLETH_FEDERATION_URL requires '
+                         'SHIBBOLETH_FEDERATION_INDEX.')
+    if not app.config['SHIBBOLETH_FEDERATION_CERT']:
+        raise ValueError('SHIBBOLETH_FEDERATION_URL requires '
+                         'SHIBBOLETH_FEDERATION_CERT.')
+    return MetadataRefresher(
+        app,
+        index,
+        url,
+        app.config['SHIBBOLETH_FEDERATION_CERT'],
+        interval=app.config['SHIBBOLETH_FEDERATION_REFRESH'],
+        timeout=app.config['SHIBBOLETH_FEDERATION_TIMEOUT'],
+    )
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Caches of consumed assertion IDs to detect replayed SAML responses.
+
+Every backend implements :meth:`add`, which records an assertion ID for a
+number of seconds and tells whether it has been seen before. Assertion IDs
+only have to be kept until the ``NotOnOrAfter`` of the assertion, afterwards
+python3-saml rejects the response anyway.
+"""
+
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryReplayCache(object):
+    """Bounded in-process cache of assertion IDs.
+
+    Entries are kept in insertion order. Since the validity window of
+    assertions is short and about the same for all of them, expired entries
+    are found at the front and are dropped on insertion. If the cache is
+    full, the oldest entry is evicted even if it has not expired yet.
+
+    The cache is local to a process. Use :class:`RedisReplayCache` if the
+    application runs in more than one process.
+    """
+
+    def __init__(self, maxsize=10000):
+        """Initialize an empty cache.
+
+        :param maxsize: Maximum number of remembered assertion IDs.
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, remote_app, assertion_id, ttl):
+        """Record an assertion ID.
+
+        :param remote_app: The remote application key name.
+        :param assertion_id: The ID of the assertion.
+        :param ttl: Number of seconds the ID is remembered.
+        :returns: ``True`` if the ID was not seen before, ``False`` if the
+            assertion is replayed.
+        """
+        key = (remote_app, assertion_id)
+        now = time.time()
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is not None and expires > now:
+                return False
+            self._entries.pop(key, None)
+            while self._entries:
+                oldest = next(iter(self._entries))
+                if self._entries[oldest] > now and \
+                        len(self._entries) < self.maxsize:
+                    break
+                del self._entries[oldest]
+            self._entries[key] = now + ttl
+        return True
+
+    def clear(self):
+        """Forget all assertion IDs."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        """Return the number of remembered assertion IDs."""
+        return len(self._entries)
+
+
+class RedisReplayCache(object):
+    """Cache of assertion IDs shared by all processes through Redis.
+
+    Every ID is stored with ``SET NX EX``, so checking and recording is a
+    single atomic round trip and Redis expires the keys on its own.
+    """
+
+    def __init__(self, url, prefix='shibboleth:replay:'):
+        """Connect to Redis.
+
+        :param url: The URL of the Redis database.
+        :param prefix: Prefix of the keys.
+        """
+        import redis
+        self.prefix = prefix
+        self.client = redis.StrictRedis.from_url(url)
+
+    def _key(self, remote_app, assertion_id):
+        return '{0}{1}:{2}'.format(self.prefix, remote_app, assertion_id)
+
+    def add(self, remote_app, assertion_id, ttl):
+        """Record an assertion ID.
+
+        :param remote_app: The remote application key name.
+        :param assertion_id: The ID of the assertion.
+        :param ttl: Number of seconds the ID is remembered.
+        :returns: ``True`` if the ID was not seen before, ``False`` if the
+            assertion is replayed.
+        """
+        return bool(self.client.set(
+            self._key(remote_app, assertion_id), b'1',
+            nx=True, ex=max(1, int(ttl + 0.5)),
+        ))
+
+    def clear(self):
+        """Forget all assertion IDs."""
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_replay_cache(app):
+    """Create the replay cache configured for an application.
+
+    :param app: The Flask application.
+    :returns: A replay cache or ``None`` if replay detection is disabled.
+    """
+    backend = app.config['SHIBBOLETH_REPLAY_CACHE']
+    if not backend:
+        return None
+    if backend == 'redis':
+        return RedisReplayCache(
+            app.config['SHIBBOLETH_REPLAY_REDIS_URL'] or
+            app.config.get('ACCOUNTS_SESSION_REDIS_URL')
+        )
+    if backend == 'memory':
+        return MemoryReplayCache(app.config['SHIBBOLETH_REPLAY_CACHE_SIZE'])
+    raise ValueError('Unknown replay cache backend: {0}'.format(backend))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Index of the sessions of SAML subjects for single logout.
+
+A ``LogoutRequest`` of the IdP names the subject by its ``NameID`` and
+usually the ``SessionIndex`` of the IdP session. At login, the id of the
+Flask session is recorded under both, so that a logout request finds the
+sessions to end without scanning the session store. Entries are renewed
+whenever their session is saved and expire together with it.
+
+The index is kept in Redis, so that a logout request received by any process
+finds the sessions created by all of them.
+"""
+
+from __future__ import absolute_import, print_function
+
+import time
+
+
+class RedisSessionIndex(object):
+    """Index of sessions shared by all processes through Redis.
+
+    The sessions of a subject are kept in one hash, which maps the session
+    ids to their expiry time and ``SessionIndex``. The hash expires with the
+    youngest of its sessions, expired fields are skipped when it is read.
+    """
+
+    def __init__(self, url, prefix='shibboleth:sessions:'):
+        """Connect to Redis.
+
+        :param url: The URL of the Redis database.
+        :param prefix: Prefix of the keys.
+        """
+        import redis
+        self.prefix = prefix
+        self.client = redis.StrictRedis.from_url(url)
+
+    def _key(self, remote_app, nameid):
+        return u'{0}{1}:{2}'.format(self.prefix, remote_app, nameid)
+
+    def add(self, remote_app, nameid, session_index, sid, ttl):
+        """Index a session.
+
+        :param remote_app: The remote application key name.
+        :param nameid: The ``NameID`` of the subject.
+        :param session_index: The ``SessionIndex`` of the IdP session.
+        :param sid: The id of the Flask session.
+        :param ttl: Number of seconds the session lives.
+        """
+        key = self._key(remote_app, nameid)
+        ttl = max(1, int(ttl + 0.5))
+        value = u'{0} {1}'.format(int(time.time()) + ttl, session_index or '')
+        pipe = self.client.pipeline()
+        pipe.hset(key, sid, value.encode('utf-8'))
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def pop(self, remote_app, nameid, session_indexes=None):
+        """Remove the sessions of a subject from the index.
+
+        :param remote_app: The remote application key name.
+        :param nameid: The ``NameID`` of the subject.
+        :param session_indexes: Only remove sessions with one of these
+            ``SessionIndex`` values. ``None`` removes all sessions of the
+            subject.
+        :returns: The ids of the removed sessions that are still alive.
+        """
+        key = self._key(remote_app, nameid)
+        if session_indexes is None:
+            pipe = self.client.pipeline()
+            pipe.hgetall(key)
+            pipe.delete(key)
+            entries = pipe.execute()[0]
+        else:
+            entries = self.client.hgetall(key)
+        now = time.time()
+        sids, fields = [], []
+        for sid, value in entries.items():
+            expires, _, session_index = value.decode('utf-8').partition(' ')
+            if session_indexes is not None and \
+                    (session_index or None) not in session_indexes:
+                continue
+            fields.append(sid)
+            if int(expires) > now:
+                sids.append(sid.decode('utf-8'))
+        if session_indexes is not None and fields:
+            self.client.hdel(key, *fields)
+        return sids
+
+    def clear(self):
+        """Forget all sessions."""
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_session_index(app):
+    """Create the session index configured for an application.
+
+    :param app: The Flask application.
+    :returns: A session index or ``None`` if sessions are not indexed.
+    """
+    backend = app.config['SHIBBOLETH_SESSION_INDEX']
+    if not backend:
+        return None
+    if backend == 'redis':
+        return RedisSessionIndex(
+            app.config['SHIBBOLETH_SESSION_INDEX_REDIS_URL'] or
+            app.config.get('ACCOUNTS_SESSION_REDIS_URL')
+        )
+    raise ValueError('Unknown session index backend: {0}. Only \'redis\' '
+                     'reaches the sessions of all processes.'.format(backend))
+
+
+def delete_sessions(sids):
+    """Delete sessions from the session store.
+
+    :param sids: The ids of the sessions.
+    """
+    from invenio_accounts.sessions import delete_session
+    from invenio_db import db
+    for sid in sids:
+        delete_session(sid)
+    db.session.commit()
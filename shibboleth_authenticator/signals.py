@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Signals sent by shibboleth-authenticator."""
+
+from __future__ import absolute_import, print_function
+
+from blinker import Namespace
+
+_signals = Namespace()
+
+stage_timed = _signals.signal('shibboleth-stage-timed')
+"""Signal is sent after a stage of a login has been timed.
+
+The sender is the current application. Stages are ``init_saml_auth``,
+``process_response``, ``state``, ``account_info``, ``user_lookup``,
+``register``, ``commit`` and ``link``. The time it took to load a remote
+application at startup is sent as stage ``warmup``. The duration is given in
+seconds.
+
+Example subscriber:
+
+.. code-block:: python
+
+    from shibboleth_authenticator.signals import stage_timed
+
+    @stage_timed.connect
+    def log_stage(app, remote_app=None, stage=None, duration=None):
+        app.logger.debug('%s %s %.3f', remote_app, stage, duration)
+
+"""
+
+metadata_refreshed = _signals.signal('shibboleth-metadata-refreshed')
+"""Signal is sent after the federation metadata has been refreshed.
+
+The sender is the current application. ``status`` is ``'updated'``,
+``'not_modified'``, ``'busy'`` if another process is refreshing the index,
+or ``'failed'``, ``count`` the number of indexed IdPs of
+an update and ``error`` the exception of a failure. The duration is given in
+seconds.
+
+Example subscriber counting failures:
+
+.. code-block:: python
+
+    from shibboleth_authenticator.signals import metadata_refreshed
+
+    @metadata_refreshed.connect
+    def count_refresh(app, url=None, status=None, count=None, error=None,
+                      duration=None):
+        statsd.incr('shibboleth.metadata.{0}'.format(status))
+
+"""
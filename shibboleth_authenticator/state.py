@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Serializers of the state token passed to the IdP as ``RelayState``.
+
+The state binds a login to the remote application, the session and the URL
+to return to. Two formats are available:
+
+- ``jws`` - A JSON web signature, as created by
+  :class:`itsdangerous.TimedJSONWebSignatureSerializer`.
+- ``compact`` - A packed binary of the issue time, the remote application,
+  the next URL and a digest of the session identifier, followed by a
+  truncated HMAC-SHA256. The token is a fraction of the size of a JWS and
+  usually fits into the 80 bytes SAML allows for ``RelayState``.
+
+Both sign with the first of the configured keys and accept tokens signed
+with any of them, so that keys can be rotated without breaking logins in
+progress.
+
+Alternatively the state is kept in a server-side store, see
+:class:`StoredStateSerializer`, and ``RelayState`` only carries a random
+handle.
+"""
+
+from __future__ import absolute_import, print_function
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from itsdangerous import (BadPayload, BadSignature, SignatureExpired,
+                          TimedJSONWebSignatureSerializer)
+
+
+class JSONWebStateSerializer(object):
+    """State serializer using JSON web signatures."""
+
+    def __init__(self, secret_keys, expires_in):
+        """Initialize the serializer.
+
+        :param secret_keys: List of keys, the first one is used to sign.
+        :param expires_in: Number of seconds after which tokens expire.
+        """
+        self._serializers = [
+            TimedJSONWebSignatureSerializer(key, expires_in=expires_in)
+            for key in secret_keys
+        ]
+
+    def dumps(self, state):
+        """Serialize a state.
+
+        :param state: Dictionary with ``app``, ``next`` and ``sid``.
+        :returns: The token.
+        """
+        return self._serializers[0].dumps(state).decode('ascii')
+
+    def loads(self, token):
+        """Verify and deserialize a token.
+
+        :param token: The token.
+        :returns: The state.
+        :raises itsdangerous.BadData: If the token is invalid or expired.
+        """
+        for serializer in self._serializers[:-1]:
+            try:
+                return serializer.loads(token)
+            except SignatureExpired:
+                raise
+            except BadSignature:
+                pass
+        return self._serializers[-1].loads(token)
+
+    def sid(self, identifier):
+        """Return the ``sid`` a state of a session carries.
+
+        :param identifier: The session identifier.
+        """
+        return identifier
+
+
+class CompactStateSerializer(object):
+    """State serializer using a packed binary and a truncated HMAC."""
+
+    VERSION = 1
+    """Version of the format."""
+
+    MAC_SIZE = 16
+    """Number of bytes of the HMAC."""
+
+    SID_SIZE = 12
+    """Number of bytes of the session identifier digest."""
+
+    _HEADER = struct.Struct('!BI')
+    _LENGTH = struct.Struct('!H')
+
+    def __init__(self, secret_keys, expires_in):
+        """Initialize the serializer.
+
+        :param secret_keys: List of keys, the first one is used to sign.
+        :param expires_in: Number of seconds after which tokens expire.
+        """
+        self.expires_in = expires_in
+        self._keys = [
+            hmac.new(_bytes(key), b'shibboleth-authenticator.state',
+                     hashlib.sha256).digest()
+            for key in secret_keys
+        ]
+
+    def _mac(self, key, payload):
+        return hmac.new(key, payload, hashlib.sha256).digest()[
+            :self.MAC_SIZE]
+
+    def sid(self, identifier):
+        """Return the ``sid`` a state of a session carries.
+
+        :param identifier: The session identifier.
+        """
+        return binascii.hexlify(
+            hashlib.sha256(_bytes(identifier)).digest()[:self.SID_SIZE]
+        ).decode('ascii')
+
+    def dumps(self, state):
+        """Serialize a state.
+
+        :param state: Dictionary with ``app``, ``next`` and ``sid``.
+        :returns: The token.
+        """
+        payload = [self._HEADER.pack(self.VERSION, int(time.time()))]
+        for value in (state['app'], state['next']):
+            value = _bytes(value)
+            payload.append(self._LENGTH.pack(len(value)))
+            payload.append(value)
+        payload.append(binascii.unhexlify(self.sid(state['sid'])))
+        payload = b''.join(payload)
+        token = payload + self._mac(self._keys[0], payload)
+        return base64.urlsafe_b64encode(token).rstrip(b'=').decode('ascii')
+
+    def loads(self, token):
+        """Verify and deserialize a token.
+
+        :param token: The token.
+        :returns: The state.
+        :raises itsdangerous.BadData: If the token is invalid or expired.
+        """
+        try:
+            token = _bytes(token)
+            data = base64.urlsafe_b64decode(token + b'=' * (-len(token) % 4))
+        except (TypeError, ValueError, binascii.Error):
+            raise BadSignature('Invalid state token.')
+        payload, mac = data[:-self.MAC_SIZE], data[-self.MAC_SIZE:]
+        if len(payload) < self._HEADER.size or not any(
+                hmac.compare_digest(mac, self._mac(key, payload))
+                for key in self._keys):
+            raise BadSignature('Invalid state token.')
+
+        version, issued = self._HEADER.unpack_from(payload)
+        if version != self.VERSION:
+            raise BadPayload('Unknown state token version.')
+        if issued + self.expires_in < time.time():
+            raise SignatureExpired('State token expired.')
+        try:
+            offset = self._HEADER.size
+            values = []
+            for _ in range(2):
+                length, = self._LENGTH.unpack_from(payload, offset)
+                offset += self._LENGTH.size
+                values.append(payload[offset:offset + length].decode('utf-8'))
+                offset += length
+            sid = payload[offset:]
+            if len(sid) != self.SID_SIZE:
+                raise ValueError
+        except (struct.error, ValueError):
+            raise BadPayload('Invalid state token payload.')
+        return dict(
+            app=values[0],
+            next=values[1],
+            sid=binascii.hexlify(sid).decode('ascii'),
+        )
+
+
+class MemoryStateStore(object):
+    """Bounded in-process store of login states.
+
+    The store is local to a process. Use :class:`RedisStateStore` if the
+    application runs in more than one process.
+    """
+
+    def __init__(self, ttl, maxsize=10000):
+        """Initialize an empty store.
+
+        :param ttl: Number of seconds a state is kept.
+        :param maxsize: Maximum number of states. If the store is full, the
+            oldest state is dropped.
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, handle, state):
+        """Store a state.
+
+        :param handle: The handle of the state.
+        :param state: The state dictionary.
+        """
+        now = time.time()
+        with self._lock:
+            while self._entries:
+                oldest = next(iter(self._entries))
+                if self._entries[oldest][1] > now and \
+                        len(self._entries) < self.maxsize:
+                    break
+                del self._entries[oldest]
+            self._entries[handle] = (state, now + self.ttl)
+
+    def pop(self, handle):
+        """Fetch and delete a state.
+
+        :param handle: The handle of the state.
+        :returns: The state or ``None`` if it does not exist or expired.
+        """
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def __len__(self):
+        """Return the number of stored states."""
+        return len(self._entries)
+
+
+class RedisStateStore(object):
+    """Store of login states shared by all processes through Redis."""
+
+    def __init__(self, url, ttl, prefix='shibboleth:state:'):
+        """Connect to Redis.
+
+        :param url: The URL of the Redis database.
+        :param ttl: Number of seconds a state is kept.
+        :param prefix: Prefix of the keys.
+        """
+        import redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self.client = redis.StrictRedis.from_url(url)
+
+    def put(self, handle, state):
+        """Store a state.
+
+        :param handle: The handle of the state.
+        :param state: The state dictionary.
+        """
+        self.client.set(self.prefix + handle, json.dumps(state),
+                        ex=max(1, int(self.ttl)))
+
+    def pop(self, handle):
+        """Fetch and delete a state.
+
+        :param handle: The handle of the state.
+        :returns: The state or ``None`` if it does not exist or expired.
+        """
+        pipe = self.client.pipeline()
+        pipe.get(self.prefix + handle)
+        pipe.delete(self.prefix + handle)
+        value, _ = pipe.execute()
+        if value is None:
+            return None
+        return json.loads(value.decode('utf-8'))
+
+
+class StoredStateSerializer(object):
+    """State serializer keeping the state in a server-side store.
+
+    The token is a random handle of 22 characters. Every token can be
+    loaded only once.
+    """
+
+    def __init__(self, store):
+        """Initialize the serializer.
+
+        :param store: A :class:`MemoryStateStore` or
+            :class:`RedisStateStore`.
+        """
+        self.store = store
+
+    def dumps(self, state):
+        """Store a state.
+
+        :param state: Dictionary with ``app``, ``next`` and ``sid``.
+        :returns: The handle of the state.
+        """
+        handle = base64.urlsafe_b64encode(os.urandom(16)).rstrip(b'=')
+        handle = handle.decode('ascii')
+        self.store.put(handle, state)
+        return handle
+
+    def loads(self, token):
+        """Fetch and delete a state.
+
+        :param token: The handle of the state.
+        :returns: The state.
+        :raises itsdangerous.BadData: If the state does not exist, has
+            expired or has already been used.
+        """
+        state = self.store.pop(token) if token else None
+        if state is None:
+            raise BadSignature('Unknown state token.')
+        return state
+
+    def sid(self, identifier):
+        """Return the ``sid`` a state of a session carries.
+
+        :param identifier: The session identifier.
+        """
+        return identifier
+
+
+def _bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+STATE_SERIALIZERS = dict(
+    jws=JSONWebStateSerializer,
+    compact=CompactStateSerializer,
+)
+"""Available state token formats."""
+
+
+def create_state_serializer(app):
+    """Create the state serializer configured for an application.
+
+    :param app: The Flask application.
+    :returns: A state serializer.
+    """
+    store = app.config['SHIBBOLETH_STATE_STORE']
+    expires = app.config['SHIBBOLETH_STATE_EXPIRES']
+    if store == 'memory':
+        return StoredStateSerializer(MemoryStateStore(
+            expires, maxsize=app.config['SHIBBOLETH_STATE_STORE_SIZE']
+        ))
+    if store == 'redis':
+        return StoredStateSerializer(RedisStateStore(
+            app.config['SHIBBOLETH_STATE_REDIS_URL'] or
+            app.config.get('ACCOUNTS_SESSION_REDIS_URL'), expires
+        ))
+    if store:
+        raise ValueError('Unknown state store backend: {0}'.format(store))
+
+    fmt = app.config['SHIBBOLETH_STATE_FORMAT']
+    if fmt not in STATE_SERIALIZERS:
+        raise ValueError('Unknown state token format: {0}'.format(fmt))
+    keys = app.config['SHIBBOLETH_STATE_KEYS'] or [app.config['SECRET_KEY']]
+    return STATE_SERIALIZERS[fmt](keys, expires)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Caches of the users resolved from external ids.
+
+A cache maps ``(remote_app, external_id)`` to the id of the linked user, so
+that returning users are loaded by primary key instead of being searched by
+their external id and email address. Entries are dropped whenever a commit
+links, relinks or unlinks an external id through the ORM, and on lookups of
+users that no longer exist. Bulk queries bypass the ORM events; entries
+affected by them expire after the configured time to live.
+
+The ORM events only reach the process that made the change. The in-process
+:class:`MemoryUserCache` is therefore only suitable for deployments running
+a single process; use :class:`RedisUserCache` with several workers.
+"""
+
+from __future__ import absolute_import, print_function
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+
+class MemoryUserCache(object):
+    """Bounded in-process cache of resolved users.
+
+    Changes made by other processes are not seen until the entries expire,
+    so the cache must only be used by single-process deployments.
+    """
+
+    def __init__(self, ttl=300, maxsize=10000):
+        """Initialize an empty cache.
+
+        :param ttl: Number of seconds an entry is valid.
+        :param maxsize: Maximum number of entries.
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, remote_app, external_id):
+        """Return the id of the user linked to an external id.
+
+        :param remote_app: The remote application key name.
+        :param external_id: The external id of the user.
+        :returns: The user id or ``None``.
+        """
+        key = (remote_app, external_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def set(self, remote_app, external_id, user_id):
+        """Remember the user linked to an external id.
+
+        :param remote_app: The remote application key name.
+        :param external_id: The external id of the user.
+        :param user_id: The id of the user.
+        """
+        key = (remote_app, external_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (user_id, time.time() + self.ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, remote_app, external_id):
+        """Forget the user linked to an external id.
+
+        :param remote_app: The remote application key name.
+        :param external_id: The external id of the user.
+        """
+        with self._lock:
+            self._entries.pop((remote_app, external_id), None)
+
+    def clear(self):
+        """Forget all users."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        """Return the number of entries."""
+        return len(self._entries)
+
+
+class RedisUserCache(object):
+    """Cache of resolved users shared by all processes through Redis."""
+
+    def __init__(self, url, ttl=300, prefix='shibboleth:user:'):
+        """Connect to Redis.
+
+        :param url: The URL of the Redis database.
+        :param ttl: Number of seconds an entry is valid.
+        :param prefix: Prefix of the keys.
+        """
+        import redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self.client = redis.StrictRedis.from_url(url)
+
+    def _key(self, remote_app, external_id):
+        return u'{0}{1}:{2}'.format(self.prefix, remote_app, external_id)
+
+    def get(self, remote_app, external_id):
+        """Return the id of the user linked to an external id.
+
+        :param remote_app: The remote application key name.
+        :param external_id: The external id of the user.
+        :returns: The user id or ``None``.
+        """
+        value = self.client.get(self._key(remote_app, external_id))
+        return int(value) if value is not None else None
+
+    def set(self, remote_app, external_id, user_id):
+        """Remember the user linked to an external id.
+
+        :param remote_app: The remote application key name.
+        :param external_id: The external id of the user.
+        :param user_id: The id of the user.
+        """
+        self.client.set(self._key(remote_app, external_id), user_id,
+                        ex=self.ttl)
+
+    def invalidate(self, remote_app, external_id):
+        """Forget the user linked to an external id.
+
+        :param remote_app: The remote application key name.
+        :param external_id: The external id of the user.
+        """
+        self.client.delete(self._key(remote_app, external_id))
+
+    def clear(self):
+        """Forget all users."""
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_user_cache(app):
+    """Create the user cache configured for an application.
+
+    :param app: The Flask application.
+    :returns: A user cache or ``None`` if the cache is disabled.
+    """
+    backend = app.config['SHIBBOLETH_USER_CACHE']
+    if not backend:
+        return None
+    ttl = app.config['SHIBBOLETH_USER_CACHE_TTL']
+    if backend == 'redis':
+        return RedisUserCache(
+            app.config['SHIBBOLETH_USER_CACHE_REDIS_URL'] or
+            app.config.get('ACCOUNTS_SESSION_REDIS_URL'),
+            ttl=ttl,
+        )
+    if backend == 'memory':
+        return MemoryUserCache(
+            ttl=ttl, maxsize=app.config['SHIBBOLETH_USER_CACHE_SIZE']
+        )
+    raise ValueError('Unknown user cache backend: {0}'.format(backend))
+
+
+_PENDING_KEY = 'shibboleth_authenticator.user_cache'
+
+
+def _invalidate_identity(mapper, connection, target):
+    if not has_app_context():
+        return
+    ext = current_app.extensions.get('shibboleth-authenticator')
+    cache = getattr(ext, 'user_cache', None)
+    if cache is None:
+        return
+    from sqlalchemy import inspect
+
+    # Relinking may change the primary key of the identity.
+    state = inspect(target)
+    methods = state.attrs.method.history.deleted or [target.method]
+    ids = state.attrs.id.history.deleted or [target.id]
+    # Entries are dropped once the change is committed, so that other
+    # workers cannot cache the old link again in between.
+    pending = state.session.info.setdefault(_PENDING_KEY, set())
+    for method in methods:
+        for id_ in ids:
+            pending.add((cache, method, id_))
+
+
+def _invalidate_committed(session):
+    for cache, method, id_ in session.info.pop(_PENDING_KEY, ()):
+        cache.invalidate(method, id_)
+
+
+def _discard_rolled_back(session, previous_transaction):
+    # Changes of an outer transaction survive the rollback of a savepoint.
+    if previous_transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
+
+
+def register_listeners():
+    """Drop cached users when external ids are changed through the ORM.
+
+    The entries are dropped after the changes are committed.
+    """
+    from invenio_oauthclient.models import UserIdentity
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    for identifier in ('after_insert', 'after_update', 'after_delete'):
+        if not event.contains(UserIdentity, identifier,
+                              _invalidate_identity):
+            event.listen(UserIdentity, identifier, _invalidate_identity)
+    if not event.contains(Session, 'after_commit', _invalidate_committed):
+        event.listen(Session, 'after_commit', _invalidate_committed)
+    if not event.contains(Session, 'after_soft_rollback',
+                          _discard_rolled_back):
+        event.listen(Session, 'after_soft_rollback', _discard_rolled_back)
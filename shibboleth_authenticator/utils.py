@@ -20,6 +20,8 @@
 
 from __future__ import absolute_import, print_function
 
+import re
+
 import uritools
 from flask import current_app, request
 from werkzeug.local import LocalProxy
@@ -29,43 +31,130 @@ _security = LocalProxy(lambda: current_app.extensions['security'])
 
 _datastore = LocalProxy(lambda: _security.datastore)
 
+_ext = LocalProxy(
+    lambda: current_app.extensions['shibboleth-authenticator']
+)
+
 
 def get_account_info(attributes, remote_app):
-    """Return account info for remote user."""
-    mappings = current_app.config['SHIBBOLETH_REMOTE_APPS'][
-        remote_app]['mappings']
-    email = attributes[mappings['email']][0]
-    external_id = attributes[mappings['user_unique_id']][0]
-    full_name = attributes[mappings['full_name']][0]
-
-    return dict(
-        user=dict(
-            email=email,
-            profile=dict(
-                full_name=full_name,
-                username=external_id.split('@')[0],
-            ),
+    """Return account info for remote user.
+
+    :param attributes: The SAML attributes of the user.
+    :param remote_app: The remote application key name.
+    :returns: The account information.
+    :raises shibboleth_authenticator.mapping.AttributeMappingError: If a
+        required attribute is missing.
+    """
+    return _ext.mappers.get(
+        remote_app, current_app.config['SHIBBOLETH_REMOTE_APPS']
+    )(attributes)
+
+
+_LOCAL_PATH = re.compile(
+    r"^/(?![/\\])(?:[A-Za-z0-9\-._~!$&'()*+,;=:@/?]|%[0-9A-Fa-f]{2})*\Z"
+)
+"""Relative targets that are returned unchanged without parsing."""
+
+_UNSAFE = re.compile(r"%(?![0-9A-Fa-f]{2})|[^A-Za-z0-9\-._~!$&'()*+,;=:@/?%]")
+"""Characters of a path or query that have to be percent-encoded."""
+
+
+def _quote(value):
+    # Existing percent-encodings are kept, so they are not encoded twice.
+    return _UNSAFE.sub(
+        lambda match: ''.join(
+            '%{0:02X}'.format(c)
+            for c in bytearray(match.group().encode('utf-8'))
         ),
-        external_id=external_id,
-        external_method=remote_app,
+        value
     )
 
 
+class AllowedHosts(object):
+    """Compiled ``APP_ALLOWED_HOSTS`` policy.
+
+    Entries are matched case-insensitively. An entry ``*.example.org``
+    matches all subdomains of ``example.org``, an entry ``.example.org``
+    additionally ``example.org`` itself and ``*`` matches every host.
+    """
+
+    def __init__(self, hosts):
+        """Compile the allowed hosts.
+
+        :param hosts: The list of allowed hosts or ``None``.
+        """
+        self.hosts = hosts
+        self.any = False
+        self.exact = set()
+        self.suffixes = set()
+        for host in hosts or ():
+            host = host.lower().rstrip('.')
+            if host == '*':
+                self.any = True
+            elif host.startswith('*.'):
+                self.suffixes.add(host[1:])
+            elif host.startswith('.'):
+                self.exact.add(host[1:])
+                self.suffixes.add(host)
+            else:
+                self.exact.add(host)
+
+    def __contains__(self, host):
+        """Check if a host is allowed."""
+        if not host:
+            return False
+        if self.any:
+            return True
+        host = host.lower().rstrip('.')
+        if host in self.exact:
+            return True
+        if self.suffixes:
+            index = host.find('.')
+            while index != -1:
+                if host[index:] in self.suffixes:
+                    return True
+                index = host.find('.', index + 1)
+        return False
+
+
+def get_allowed_hosts():
+    """Return the compiled ``APP_ALLOWED_HOSTS`` of the current application.
+
+    The policy is compiled again when the configured list is replaced.
+
+    :returns: An :class:`AllowedHosts` instance.
+    """
+    hosts = current_app.config.get('APP_ALLOWED_HOSTS')
+    allowed_hosts = _ext.allowed_hosts
+    if allowed_hosts.hosts is not hosts:
+        allowed_hosts = _ext.allowed_hosts = AllowedHosts(hosts)
+    return allowed_hosts
+
+
 def get_safe_redirect_target(arg='next'):
     """Get URL to redirect to and ensure that it is local.
 
+    Paths without special characters are returned as they are. Other
+    targets are parsed and kept if their host is allowed by
+    ``APP_ALLOWED_HOSTS``, otherwise only their path and query are kept.
+    Percent-encodings of the target are never encoded again.
+
     :param arg: URL argument.
     :returns: The redirect target or ``None``.
     """
     for target in request.args.get(arg), request.referrer:
         if target:
+            if _LOCAL_PATH.match(target):
+                return target
             redirect_uri = uritools.urisplit(target)
-            allowed_hosts = current_app.config.get('APP_ALLOWED_HOSTS', [])
-            if redirect_uri.host in allowed_hosts:
+            if redirect_uri.host in get_allowed_hosts():
                 return target
             elif redirect_uri.path:
-                return uritools.uricompose(
-                    path=redirect_uri.path,
-                    query=redirect_uri.query
-                )
+                path = _quote(redirect_uri.path)
+                # A path starting with "//" would be taken for a host.
+                if path.startswith('//'):
+                    path = '/' + path.lstrip('/')
+                if redirect_uri.query is not None:
+                    path += '?' + _quote(redirect_uri.query)
+                return path
     return None
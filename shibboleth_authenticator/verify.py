@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Verification of SAML responses in a pool of worker processes.
+
+Checking the signatures and decrypting the assertions of a SAML response is
+CPU-bound. With ``SHIBBOLETH_VERIFY_PROCESSES`` set, the authorized view
+sends the encoded ``SAMLResponse`` to a :class:`VerifyPool` instead of
+processing it in the request thread. The workers keep their own settings and
+key caches, warmed up with the remote applications known when the pool is
+started, and only send back a :class:`VerifiedResponse`.
+
+The number of responses waiting for a worker is bounded. If the pool is
+saturated or does not answer in time, the response is processed inline. A
+worker that does not answer in time keeps running and keeps its slot until
+it has finished, so every timeout costs the CPU time of two verifications
+while the pool is already busy. ``SHIBBOLETH_VERIFY_TIMEOUT`` should thus
+be well above the usual verification time.
+"""
+
+from __future__ import absolute_import, print_function
+
+import multiprocessing
+import os
+import sys
+import threading
+
+from onelogin.saml2.errors import OneLogin_Saml2_Error
+
+from . import keys
+from .cache import SettingsCache
+from .federation import FederationIndex
+
+VERIFIED = 'verified'
+"""Status of a processed response."""
+
+INVALID = 'invalid'
+"""Status of a response rejected by python3-saml."""
+
+FAILED = 'failed'
+"""Status of a response the worker could not process."""
+
+
+class VerifiedResponse(object):
+    """Outcome of a processed SAML response.
+
+    Provides the parts of :class:`onelogin.saml2.auth.OneLogin_Saml2_Auth`
+    used after ``process_response()``.
+    """
+
+    def __init__(self, errors, error_reason, authenticated, attributes,
+                 nameid, nameid_format, session_index, assertion_id,
+                 not_on_or_after):
+        """Initialize the response."""
+        self.errors = errors
+        self.error_reason = error_reason
+        self.authenticated = authenticated
+        self.attributes = attributes
+        self.nameid = nameid
+        self.nameid_format = nameid_format
+        self.session_index = session_index
+        self.assertion_id = assertion_id
+        self.not_on_or_after = not_on_or_after
+
+    @classmethod
+    def from_auth(cls, auth):
+        """Take the outcome from a SAML SP instance.
+
+        :param auth: The :class:`onelogin.saml2.auth.OneLogin_Saml2_Auth`
+            after processing the response.
+        :returns: A :class:`VerifiedResponse`.
+        """
+        return cls(
+            errors=auth.get_errors(),
+            error_reason=auth.get_last_error_reason(),
+            authenticated=auth.is_authenticated(),
+            attributes=auth.get_attributes(),
+            nameid=auth.get_nameid(),
+            nameid_format=auth.get_nameid_format(),
+            session_index=auth.get_session_index(),
+            assertion_id=auth.get_last_assertion_id(),
+            not_on_or_after=auth.get_last_assertion_not_on_or_after(),
+        )
+
+    def get_errors(self):
+        """Return the errors of the response."""
+        return self.errors
+
+    def get_last_error_reason(self):
+        """Return the reason of the last error."""
+        return self.error_reason
+
+    def is_authenticated(self):
+        """Check if the user is authenticated."""
+        return self.authenticated
+
+    def get_attributes(self):
+        """Return the attributes of the assertion."""
+        return self.attributes
+
+    def get_nameid(self):
+        """Return the NameID of the assertion."""
+        return self.nameid
+
+    def get_nameid_format(self):
+        """Return the format of the NameID."""
+        return self.nameid_format
+
+    def get_session_index(self):
+        """Return the SessionIndex of the assertion."""
+        return self.session_index
+
+    def get_last_assertion_id(self):
+        """Return the ID of the assertion."""
+        return self.assertion_id
+
+    def get_last_assertion_not_on_or_after(self):
+        """Return the ``NotOnOrAfter`` of the assertion."""
+        return self.not_on_or_after
+
+
+_settings_cache = None
+_federation_index = None
+
+
+def init_worker(remote_apps, federation_index=None, key_cache_size=0):
+    """Prepare a worker process.
+
+    :param remote_apps: Dictionary mapping remote applications to their
+        ``saml_path`` and ``entity_id``, whose settings are loaded up front.
+    :param federation_index: Path of the federation metadata index.
+    :param key_cache_size: Number of cached verification keys.
+    """
+    global _settings_cache, _federation_index
+    _settings_cache = SettingsCache()
+    _federation_index = None
+    if federation_index:
+        _federation_index = FederationIndex(federation_index)
+    keys.worker_key_cache = None
+    if key_cache_size:
+        keys.worker_key_cache = keys.KeyCache(key_cache_size)
+        _settings_cache.on_load = keys.worker_key_cache.on_settings_load
+    for remote_app, (saml_path, entity_id) in remote_apps.items():
+        try:
+            _settings_cache.get(remote_app, saml_path, entity_id=entity_id,
+                                index=_federation_index)
+        except Exception:
+            # Reported by the request that uses the remote application.
+            pass
+
+
+def verify_response(remote_app, saml_path, entity_id, req):
+    """Process a SAML response in a worker process.
+
+    :param remote_app: The remote application key name.
+    :param saml_path: The path to the configuration files for python3-saml.
+    :param entity_id: The entityID of the IdP or ``None``.
+    :param req: The request dictionary of python3-saml.
+    :returns: Tuple of the status and a :class:`VerifiedResponse` or an error
+        message.
+    """
+    from onelogin.saml2.auth import OneLogin_Saml2_Auth
+    try:
+        auth = OneLogin_Saml2_Auth(
+            req,
+            old_settings=_settings_cache.get(
+                remote_app, saml_path, entity_id=entity_id,
+                index=_federation_index,
+            )
+        )
+        try:
+            auth.process_response()
+        except OneLogin_Saml2_Error as e:
+            return INVALID, str(e)
+        return VERIFIED, VerifiedResponse.from_auth(auth)
+    except Exception as e:
+        return FAILED, str(e)
+
+
+class VerifyPool(object):
+    """Bounded pool of processes verifying SAML responses."""
+
+    def __init__(self, processes, maxsize, timeout, remote_apps=None,
+                 federation_index=None, key_cache_size=0):
+        """Initialize the pool.
+
+        The worker processes are started on first use, so that they are
+        created in the process serving the requests.
+
+        :param processes: Number of worker processes.
+        :param maxsize: Maximum number of responses sent to the pool at the
+            same time.
+        :param timeout: Number of seconds to wait for a worker.
+        :param remote_apps: The ``SHIBBOLETH_REMOTE_APPS`` loaded up front.
+        :param federation_index: Path of the federation metadata index.
+        :param key_cache_size: Number of cached verification keys per worker.
+        """
+        self.processes = processes
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.remote_apps = dict(
+            (name, (conf['saml_path'], conf.get('entity_id')))
+            for name, conf in (remote_apps or {}).items()
+            if 'saml_path' in conf
+        )
+        self.federation_index = federation_index
+        self.key_cache_size = key_cache_size
+        self.verified = 0
+        self.saturated = 0
+        self.timeouts = 0
+        self.failed = 0
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _ensure_pool(self):
+        # The pool does not survive a fork of the process.
+        if self._pool is not None and self._pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = multiprocessing.Pool(
+                    self.processes,
+                    initializer=init_worker,
+                    initargs=(self.remote_apps, self.federation_index,
+                              self.key_cache_size),
+                )
+        return self._pool
+
+    def _release(self, result=None):
+        self._slots.release()
+
+    def _count(self, name):
+        with self._counters_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def verify(self, remote_app, conf, req):
+        """Process a SAML response in the pool.
+
+        :param remote_app: The remote application key name.
+        :param conf: The configuration of the remote application.
+        :param req: The request dictionary of python3-saml, see
+            :func:`shibboleth_authenticator.views.prepare_flask_request`.
+        :returns: A :class:`VerifiedResponse` or ``None`` if the response has
+            to be processed inline.
+        :raises onelogin.saml2.utils.OneLogin_Saml2_Error: If python3-saml
+            rejects the response.
+        """
+        if not self._slots.acquire(False):
+            self._count('saturated')
+            return None
+        req = dict(
+            req,
+            get_data={},
+            post_data={'SAMLResponse': req['post_data']['SAMLResponse']},
+        )
+        callbacks = dict(callback=self._release)
+        if sys.version_info[0] >= 3:
+            # Release the slot if the result cannot be returned.
+            callbacks['error_callback'] = self._release
+        try:
+            result = self._ensure_pool().apply_async(
+                verify_response,
+                (remote_app, conf['saml_path'], conf.get('entity_id'), req),
+                **callbacks
+            )
+        except Exception:
+            self._release()
+            self._count('failed')
+            return None
+        try:
+            status, value = result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            # The worker keeps running and keeps its slot, the response is
+            # verified a second time inline.
+            self._count('timeouts')
+            return None
+        except Exception:
+            self._count('failed')
+            return None
+        if status == INVALID:
+            raise OneLogin_Saml2_Error(value)
+        if status != VERIFIED:
+            self._count('failed')
+            return None
+        self._count('verified')
+        return value
+
+    def close(self):
+        """Stop the worker processes."""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.terminate()
+                self._pool.join()
+            self._pool = None
+
+    def info(self):
+        """Return the pool statistics."""
+        with self._counters_lock:
+            return dict(
+                verified=self.verified,
+                saturated=self.saturated,
+                timeouts=self.timeouts,
+                failed=self.failed,
+                processes=self.processes,
+                maxsize=self.maxsize,
+            )
+
+
+def create_verify_pool(app):
+    """Create the verification pool configured for an application.
+
+    :param app: The Flask application.
+    :returns: A :class:`VerifyPool` or ``None`` if responses are processed
+        inline.
+    """
+    processes = app.config['SHIBBOLETH_VERIFY_PROCESSES']
+    if not processes:
+        return None
+    return VerifyPool(
+        processes,
+        maxsize=app.config['SHIBBOLETH_VERIFY_QUEUE_SIZE'] or 2 * processes,
+        timeout=app.config['SHIBBOLETH_VERIFY_TIMEOUT'],
+        remote_apps=app.config['SHIBBOLETH_REMOTE_APPS'],
+        federation_index=app.config['SHIBBOLETH_FEDERATION_INDEX'],
+        key_cache_size=app.config['SHIBBOLETH_KEY_CACHE_SIZE'],
+    )
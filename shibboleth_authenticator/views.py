@@ -16,20 +16,32 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Blueprint for handling Shibboleth callbacks."""
+"""Blueprint for handling Shibboleth callbacks.
+
+python3-saml and the signup handlers are imported when they are first
+needed, so that loading the blueprint does not pay for them.
+"""
 
 from __future__ import absolute_import, print_function
 
-from flask import (Blueprint, abort, current_app, make_response, redirect,
-                   request)
+import binascii
+import time
+import zlib
+
+from flask import (Blueprint, abort, current_app, jsonify, make_response,
+                   redirect, request, session, url_for)
 from flask_login import current_user, logout_user
-from invenio_oauthclient.handlers import set_session_next_url
-from itsdangerous import BadData, TimedJSONWebSignatureSerializer
-from onelogin.saml2.auth import OneLogin_Saml2_Auth, OneLogin_Saml2_Error
+from itsdangerous import BadData
+from onelogin.saml2.constants import OneLogin_Saml2_Constants
+from onelogin.saml2.errors import (OneLogin_Saml2_Error,
+                                   OneLogin_Saml2_ValidationError)
 from werkzeug.local import LocalProxy
 
-from ._compat import _create_identifier, urlparse
-from .handlers import authorized_signup_handler
+from ._compat import _create_identifier
+from .cache import SPMetadata, settings_stamp
+from .discovery import display_name
+from .instrumentation import timed
+from .sessions import delete_sessions
 from .utils import get_safe_redirect_target
 
 blueprint = Blueprint(
@@ -39,26 +51,48 @@ blueprint = Blueprint(
 )
 
 
-serializer = LocalProxy(
-    lambda: TimedJSONWebSignatureSerializer(
-        current_app.config['SECRET_KEY'],
-        expires_in=current_app.config['SHIBBOLETH_STATE_EXPIRES'],
-    )
+SESSION_KEY = 'shibboleth_session'
+"""Session key of the SAML session of the logged in user."""
+
+LOGOUT_REQUEST_KEY = 'shibboleth_logout_request'
+"""Session key of the ID of a pending ``LogoutRequest``."""
+
+
+_ext = LocalProxy(
+    lambda: current_app.extensions['shibboleth-authenticator']
 )
 
 
-def init_saml_auth(req, saml_path):
+serializer = LocalProxy(lambda: _ext.state_serializer)
+
+
+def init_saml_auth(req, saml_path, remote_app=None):
     """
     Init SAML authentication for remote application.
 
+    If a remote application is given, the parsed settings are taken from the
+    extension's settings cache instead of being read from ``saml_path``.
+
     Args:
         req(dict):
         saml_path(str): The path to the configuration files for python3-saml.
+        remote_app(str): The remote application key name.
 
     Returns:
         The SAML SP instance.
 
     """
+    from onelogin.saml2.auth import OneLogin_Saml2_Auth
+    if remote_app is not None:
+        conf = current_app.config['SHIBBOLETH_REMOTE_APPS'][remote_app]
+        return OneLogin_Saml2_Auth(
+            req,
+            old_settings=_ext.settings_cache.get(
+                remote_app, saml_path,
+                entity_id=conf.get('entity_id'),
+                index=_ext.federation_index,
+            )
+        )
     auth = OneLogin_Saml2_Auth(
         req,
         custom_base_path=saml_path
@@ -66,44 +100,85 @@ def init_saml_auth(req, saml_path):
     return auth
 
 
+def _port(host):
+    """Return the explicit port of a ``Host`` header or ``None``."""
+    _, sep, port = host.rpartition(':')
+    if sep and port.isdigit():
+        return int(port)
+    return None
+
+
 def prepare_flask_request(request):
     """
     Prepare flask request.
 
+    The query and form data are passed as werkzeug's immutable multi dicts
+    instead of copies. If the server is behind a proxy, configure
+    ``SHIBBOLETH_PROXY_FIX`` so that the scheme, host and path reflect the
+    ``X-Forwarded-*`` headers.
+
     Args:
         request(flask.Request): The Flask request.
     Returns:
         dict: Returns dictionary used in :func:`init_saml_auth`.
 
     """
-    url_data = urlparse(request.url)
-    # If server is behind proxys or balancers use the HTTP_X_FORWARDED fields.
+    host = request.host
     return {
         'https': 'on' if request.scheme == 'https' else 'off',
-        'http_host': request.host,
-        'server_port': url_data.port,
-        'script_name': request.path,
-        'get_data': request.args.copy(),
-        'X-Forwarded-for': '',
-        'post_data': request.form.copy()
+        'http_host': host,
+        'server_port': _port(host),
+        'script_name': request.script_root + request.path,
+        'get_data': request.args,
+        'post_data': request.form,
     }
 
 
-@blueprint.route('/login/<remote_app>/', methods=['GET', 'POST'])
-def login(remote_app):
+def is_replayed(auth, remote_app):
     """
-    Redirect user to remote application for authentication.
+    Check if the assertion of a processed response has been consumed before.
 
-    This function redirects the user to the IdP for authorization. After having
-    authorized the IdP redirects the user back to this web application as
-    configured in your ``saml_path``.
+    The assertion ID is recorded in the replay cache until the assertion
+    expires. Assertions without ``NotOnOrAfter`` are recorded for
+    ``SHIBBOLETH_REPLAY_TTL`` seconds, or for the session lifetime.
 
     Args:
-        remote_app (str): The remote application key name.
+        auth(OneLogin_Saml2_Auth): The SAML SP instance after processing the
+            response.
+        remote_app(str): The remote application key name.
 
     Returns:
-        flask.Response: Return redirect response to IdP or abort in case
-                        of failure.
+        bool: ``True`` if the assertion is replayed.
+
+    """
+    if _ext.replay_cache is None:
+        return False
+    assertion_id = auth.get_last_assertion_id()
+    if not assertion_id:
+        return False
+    not_on_or_after = auth.get_last_assertion_not_on_or_after()
+    if not_on_or_after is None:
+        ttl = current_app.config['SHIBBOLETH_REPLAY_TTL']
+        if ttl is None:
+            ttl = current_app.permanent_session_lifetime.total_seconds()
+    else:
+        ttl = not_on_or_after + \
+            OneLogin_Saml2_Constants.ALLOWED_CLOCK_DRIFT - time.time()
+    if ttl <= 0:
+        return False
+    return not _ext.replay_cache.add(remote_app, assertion_id, ttl)
+
+
+def get_remote_app_config(remote_app):
+    """
+    Return the configuration of a remote application.
+
+    Args:
+        remote_app(str): The remote application key name.
+
+    Returns:
+        dict: The configuration, abort with ``404`` for unknown and ``500``
+            for misconfigured remote applications.
 
     """
     if remote_app not in current_app.config['SHIBBOLETH_REMOTE_APPS']:
@@ -111,21 +186,386 @@ def login(remote_app):
     conf = current_app.config['SHIBBOLETH_REMOTE_APPS'][remote_app]
     if 'saml_path' not in conf:
         return abort(500, 'Bad server configuration.')
+    return conf
+
 
-    # Store next parameter in state token
+def create_state_token(remote_app):
+    """
+    Create the state token passed to the IdP as ``RelayState``.
+
+    Args:
+        remote_app(str): The remote application key name.
+
+    Returns:
+        str: The state token binding the ``next`` parameter to the session.
+
+    """
     next_param = get_safe_redirect_target(arg='next')
     if not next_param:
         next_param = '/'
-    state_token = serializer.dumps({
+    return serializer.dumps({
         'app': remote_app,
         'next': next_param,
         'sid': _create_identifier(),
     })
 
-    saml_path = conf['saml_path']
+
+def check_state(remote_app):
+    """
+    Check the state token returned by the IdP and store the next url.
+
+    Args:
+        remote_app(str): The remote application key name.
+
+    Returns:
+        None: Abort with ``400`` if the state token is invalid.
+
+    """
+    if 'RelayState' not in request.form:
+        return
+    from invenio_oauthclient.handlers import set_session_next_url
+    # Get state token stored in RelayState
+    state_token = request.form['RelayState']
+    try:
+        if not state_token:
+            raise ValueError
+        # Check authenticity and integrity of state and decode the values.
+        with timed('state', remote_app):
+            state = serializer.loads(state_token)
+        # Verify that state is for this session, app and that next
+        # parameter have not been modified.
+        if (state['sid'] != serializer.sid(_create_identifier()) or
+                state['app'] != remote_app):
+            raise ValueError
+        # Store next url
+        set_session_next_url(remote_app, state['next'])
+    except (ValueError, BadData):
+        if current_app.config.get('OAUTHCLIENT_STATE_ENABLED', True) \
+           or (not(current_app.debug or current_app.testing)):
+            return abort(400)
+
+
+def get_metadata(remote_app, conf):
+    """
+    Return the SP metadata of a remote application.
+
+    The validated document is kept in memory until the files in
+    ``saml_path`` change or ``SHIBBOLETH_METADATA_MAX_AGE`` is exceeded.
+
+    Args:
+        remote_app(str): The remote application key name.
+        conf(dict): The configuration of the remote application.
+
+    Returns:
+        The :class:`shibboleth_authenticator.cache.SPMetadata` or an error
+        response if the metadata is invalid.
+
+    """
+    stamp = settings_stamp(conf['saml_path'])
+    entry = _ext.metadata_cache.get(remote_app, stamp)
+    if entry is None:
+        req = prepare_flask_request(request)
+        try:
+            auth = init_saml_auth(req, conf['saml_path'],
+                                  remote_app=remote_app)
+        except OneLogin_Saml2_Error:
+            return abort(500)
+
+        settings = auth.get_settings()
+        metadata = settings.get_sp_metadata()
+        errors = settings.validate_metadata(metadata)
+
+        if len(errors) != 0:
+            return make_response(', '.join(errors), 500)
+        entry = _ext.metadata_cache.set(
+            remote_app, stamp, metadata,
+            current_app.config['SHIBBOLETH_METADATA_MAX_AGE'],
+        )
+    return entry
+
+
+def remember_session(auth, remote_app):
+    """
+    Remember the SAML session of a user that has just logged in.
+
+    The ``NameID`` and ``SessionIndex`` are stored in the session for a
+    logout started by the user. With a session index configured, the session
+    is also indexed under them by :func:`index_session` once the session has
+    been saved.
+
+    Args:
+        auth(OneLogin_Saml2_Auth): The SAML SP instance after processing the
+            response.
+        remote_app(str): The remote application key name.
+
+    """
+    nameid = auth.get_nameid()
+    if not current_user.is_authenticated or not nameid:
+        return
+    session_index = auth.get_session_index()
+    session[SESSION_KEY] = dict(
+        remote_app=remote_app,
+        nameid=nameid,
+        nameid_format=auth.get_nameid_format(),
+        session_index=session_index,
+    )
+
+
+def index_session(app, response, **extra):
+    """
+    Index a SAML session whenever the session store has saved it.
+
+    Connected to :data:`flask.request_finished`, because the session store
+    only assigns the id of a new session when the session is saved. The
+    entry is added at login and renewed together with the session, which
+    is saved with a new lifetime and sets the session cookie again.
+
+    Args:
+        app(flask.Flask): The application sending the signal.
+        response(flask.Response): The response of the request.
+
+    """
+    index = app.extensions['shibboleth-authenticator'].session_index
+    saml_session = session.get(SESSION_KEY)
+    sid = getattr(session, 'sid_s', None)
+    if index is None or saml_session is None or not sid:
+        return
+    cookie = app.config['SESSION_COOKIE_NAME'] + '='
+    if not any(header.startswith(cookie)
+               for header in response.headers.getlist('Set-Cookie')):
+        return
+    index.add(saml_session['remote_app'], saml_session['nameid'],
+              saml_session['session_index'], sid,
+              app.permanent_session_lifetime.total_seconds())
+
+
+def logout_sessions(remote_app, nameid, session_indexes=None):
+    """
+    Log a subject out of all its sessions.
+
+    The sessions are looked up in the session index and deleted from the
+    session store. The current session is logged out if it belongs to the
+    subject.
+
+    Args:
+        remote_app(str): The remote application key name.
+        nameid(str): The ``NameID`` of the subject.
+        session_indexes(list): Only log out of sessions with one of these
+            ``SessionIndex`` values. ``None`` logs out of all sessions.
+
+    Returns:
+        int: The number of deleted sessions.
+
+    """
+    sids = []
+    if _ext.session_index is not None:
+        sids = _ext.session_index.pop(remote_app, nameid, session_indexes)
+    current_sid = getattr(session, 'sid_s', None)
+    saml_session = session.get(SESSION_KEY)
+    if current_sid in sids or (
+            saml_session is not None and
+            saml_session['remote_app'] == remote_app and
+            saml_session['nameid'] == nameid and
+            (session_indexes is None or
+             saml_session['session_index'] in session_indexes)):
+        session.pop(SESSION_KEY, None)
+        logout_user()
+    # The current session is regenerated by the logout instead.
+    sids = [sid for sid in sids if sid != current_sid]
+    if sids:
+        delete_sessions(sids)
+    return len(sids)
+
+
+def logout_response(remote_app):
+    """
+    Log the user out and send a ``LogoutRequest`` to the IdP.
+
+    Users without a SAML session of the remote application and users of
+    IdPs without single logout are only logged out locally.
+
+    Args:
+        remote_app(str): The remote application key name.
+
+    Returns:
+        flask.Response: Redirect response to the IdP or to the ``next``
+            parameter.
+
+    """
+    conf = get_remote_app_config(remote_app)
+    next_url = get_safe_redirect_target(arg='next') or \
+        current_app.config.get('SECURITY_POST_LOGOUT_VIEW', '/')
+    saml_session = session.get(SESSION_KEY)
+    if saml_session is None or saml_session['remote_app'] != remote_app:
+        if current_user.is_authenticated:
+            logout_user()
+        return redirect(next_url)
+
+    logout_sessions(remote_app, saml_session['nameid'],
+                    [saml_session['session_index']])
+    req = prepare_flask_request(request)
+    try:
+        auth = init_saml_auth(req, conf['saml_path'], remote_app=remote_app)
+        url = auth.logout(
+            return_to=next_url,
+            name_id=saml_session['nameid'],
+            session_index=saml_session['session_index'],
+            name_id_format=saml_session['nameid_format'],
+        )
+    except OneLogin_Saml2_Error:
+        return redirect(next_url)
+    session[LOGOUT_REQUEST_KEY] = auth.get_last_request_id()
+    return redirect(url)
+
+
+def sls_response(remote_app):
+    """
+    Process a ``LogoutRequest`` or ``LogoutResponse`` of the IdP.
+
+    A ``LogoutRequest`` logs the subject out of all its sessions and is
+    answered with a ``LogoutResponse``. A ``LogoutResponse`` completes a
+    logout started by :func:`logout_response`.
+
+    Args:
+        remote_app(str): The remote application key name.
+
+    Returns:
+        flask.Response: Redirect response to the IdP or to the
+            ``RelayState``, ``400`` for invalid messages.
+
+    """
+    from lxml import etree
+    from onelogin.saml2.logout_request import OneLogin_Saml2_Logout_Request
+    conf = get_remote_app_config(remote_app)
+    req = prepare_flask_request(request)
+    try:
+        auth = init_saml_auth(req, conf['saml_path'], remote_app=remote_app)
+    except OneLogin_Saml2_Error:
+        return abort(500)
+    try:
+        url = auth.process_slo(
+            keep_local_session=True,
+            request_id=session.pop(LOGOUT_REQUEST_KEY, None),
+        )
+    except (OneLogin_Saml2_Error, OneLogin_Saml2_ValidationError,
+            binascii.Error, ValueError, zlib.error, etree.XMLSyntaxError):
+        # Malformed messages fail to decode, inflate or parse.
+        return abort(400)
+    if auth.get_errors():
+        return abort(400)
+
+    if 'SAMLRequest' in request.args:
+        xml = auth.get_last_request_xml()
+        logout_sessions(
+            remote_app,
+            OneLogin_Saml2_Logout_Request.get_nameid(
+                xml, auth.get_settings().get_sp_key()
+            ),
+            OneLogin_Saml2_Logout_Request.get_session_indexes(xml) or None,
+        )
+        return redirect(url)
+    return redirect(
+        get_safe_redirect_target(arg='RelayState') or
+        current_app.config.get('SECURITY_POST_LOGOUT_VIEW', '/')
+    )
+
+
+def metadata_response(entry):
+    """
+    Create the response serving SP metadata.
+
+    Args:
+        entry(SPMetadata): The cached metadata.
+
+    Returns:
+        flask.Response: The metadata, or ``304`` if the client's copy is
+            still valid.
+
+    """
+    resp = make_response(entry.xml, 200)
+    resp.headers['Content-Type'] = 'text/xml'
+    resp.set_etag(entry.etag)
+    resp.last_modified = entry.last_modified
+    resp.cache_control.public = True
+    resp.cache_control.max_age = max(0, int(entry.expires - time.time()))
+    return resp.make_conditional(request)
+
+
+def discovery_response():
+    """
+    Search the IdPs of the configured remote applications.
+
+    The query parameters are ``q`` (the search terms), ``page``, ``size``
+    and ``next``, which is passed on to the login URLs of the results.
+
+    Returns:
+        flask.Response: JSON document with the total number of matches and
+            the IdPs of the requested page.
+
+    """
+    try:
+        page = int(request.args.get('page', 1))
+        size = int(request.args.get(
+            'size', current_app.config['SHIBBOLETH_DISCOVERY_PAGE_SIZE']
+        ))
+    except ValueError:
+        return abort(400)
+    if page < 1 or size < 1:
+        return abort(400)
+    size = min(size, current_app.config['SHIBBOLETH_DISCOVERY_MAX_PAGE_SIZE'])
+
+    catalogue = _ext.discovery.get(
+        current_app.config['SHIBBOLETH_REMOTE_APPS'], _ext.federation_index
+    )
+    query = request.args.get('q', '')
+    matches = catalogue.search(query)
+    languages = list(request.accept_languages.values())
+    next_param = request.args.get('next')
+    results = []
+    for idp in matches[(page - 1) * size:page * size]:
+        results.append(dict(
+            remote_app=idp.remote_app,
+            entity_id=idp.entity_id,
+            name=display_name(idp, languages),
+            scopes=idp.scopes,
+            login_url=url_for('.login', remote_app=idp.remote_app,
+                              next=next_param),
+        ))
+
+    resp = jsonify(
+        query=query, total=len(matches), page=page, size=size,
+        results=results,
+    )
+    resp.add_etag()
+    resp.vary.add('Accept-Language')
+    resp.cache_control.public = True
+    resp.cache_control.max_age = \
+        current_app.config['SHIBBOLETH_DISCOVERY_MAX_AGE']
+    return resp.make_conditional(request)
+
+
+@blueprint.route('/login/<remote_app>/', methods=['GET', 'POST'])
+def login(remote_app):
+    """
+    Redirect user to remote application for authentication.
+
+    This function redirects the user to the IdP for authorization. After having
+    authorized the IdP redirects the user back to this web application as
+    configured in your ``saml_path``.
+
+    Args:
+        remote_app (str): The remote application key name.
+
+    Returns:
+        flask.Response: Return redirect response to IdP or abort in case
+                        of failure.
+
+    """
+    conf = get_remote_app_config(remote_app)
+    state_token = create_state_token(remote_app)
     req = prepare_flask_request(request)
     try:
-        auth = init_saml_auth(req, saml_path)
+        auth = init_saml_auth(req, conf['saml_path'], remote_app=remote_app)
     except OneLogin_Saml2_Error:
         return abort(500)
 
@@ -138,7 +578,9 @@ def authorized(remote_app=None):
     Authorize handler callback.
 
     This function is called when the user is redirected from the IdP to the
-    web application. It handles the authorization.
+    web application. It handles the authorization. With a verification pool
+    configured, the response is processed by a worker process unless the
+    pool is saturated.
 
     Args:
         remote_app (str): The remote application key name.
@@ -149,54 +591,88 @@ def authorized(remote_app=None):
     """
     if current_user.is_authenticated:
         logout_user()
-    if remote_app not in current_app.config['SHIBBOLETH_REMOTE_APPS']:
-        return abort(404)
-    conf = current_app.config['SHIBBOLETH_REMOTE_APPS'][remote_app]
-    if 'saml_path' not in conf:
-        return abort(500, 'Bad server configuration.')
-    req = prepare_flask_request(request)
-    try:
-        auth = init_saml_auth(req, conf['saml_path'])
-    except OneLogin_Saml2_Error:
-        return abort(500)
-    errors = []
-    try:
-        auth.process_response()
-    except OneLogin_Saml2_Error:
+    conf = get_remote_app_config(remote_app)
+    saml_response = request.form.get('SAMLResponse')
+    if saml_response is not None and \
+            _ext.response_checker.check(saml_response) is not None:
         return abort(400)
+    req = prepare_flask_request(request)
+    auth = None
+    if _ext.verify_pool is not None and saml_response is not None:
+        try:
+            with timed('process_response', remote_app):
+                auth = _ext.verify_pool.verify(remote_app, conf, req)
+        except OneLogin_Saml2_Error:
+            return abort(400)
+    if auth is None:
+        try:
+            with timed('init_saml_auth', remote_app):
+                auth = init_saml_auth(req, conf['saml_path'],
+                                      remote_app=remote_app)
+        except OneLogin_Saml2_Error:
+            return abort(500)
+        try:
+            with timed('process_response', remote_app):
+                auth.process_response()
+        except OneLogin_Saml2_Error:
+            return abort(400)
     errors = auth.get_errors()
     if len(errors) == 0 and auth.is_authenticated():
-        if 'RelayState' in request.form:
-            # Get state token stored in RelayState
-            state_token = request.form['RelayState']
-            try:
-                if not state_token:
-                    raise ValueError
-                # Check authenticity and integrity of state and decode the
-                # values.
-                state = serializer.loads(state_token)
-                # Verify that state is for this session, app and that next
-                # parameter have not been modified.
-                if (state['sid'] != _create_identifier() or
-                        state['app'] != remote_app):
-                    raise ValueError
-                # Store next url
-                set_session_next_url(remote_app, state['next'])
-            except (ValueError, BadData):
-                if current_app.config.get('OAUTHCLIENT_STATE_ENABLED', True) \
-                   or (not(current_app.debug or current_app.testing)):
-                    return abort(400)
-        return authorized_signup_handler(auth, remote_app)
+        check_state(remote_app)
+        if is_replayed(auth, remote_app):
+            return abort(403)
+        from .handlers import authorized_signup_handler
+        response = authorized_signup_handler(auth, remote_app)
+        remember_session(auth, remote_app)
+        return response
     return abort(403)
 
 
+@blueprint.route('/logout/<remote_app>/')
+def logout(remote_app):
+    """
+    Log the user out locally and at the IdP.
+
+    See :func:`logout_response`.
+
+    Args:
+        remote_app (str): The remote application key name.
+
+    Returns:
+        flask.Response: Redirect response to the IdP.
+
+    """
+    return logout_response(remote_app)
+
+
+@blueprint.route('/sls/<remote_app>')
+def sls(remote_app):
+    """
+    Single logout service of the remote application.
+
+    Point the ``singleLogoutService`` of the SP in ``settings.json`` to this
+    endpoint. See :func:`sls_response`.
+
+    Args:
+        remote_app (str): The remote application key name.
+
+    Returns:
+        flask.Response: Redirect response.
+
+    """
+    return sls_response(remote_app)
+
+
 @blueprint.route('/metadata/<remote_app>')
 def metadata(remote_app):
     """
     Create remote application specific metadata xml for ServiceProvider.
 
     The metadata-XML response is created using the settings provided in the
-    remote app's specific ``saml_path``.
+    remote app's specific ``saml_path``. The validated document is kept in
+    memory until the files in ``saml_path`` change or
+    ``SHIBBOLETH_METADATA_MAX_AGE`` is exceeded, and is served with an
+    ``ETag`` so that conditional requests are answered with ``304``.
 
     Args:
         remote_app (str): The remote application key name.
@@ -204,24 +680,23 @@ def metadata(remote_app):
         flask.Response: The SP's metadata xml.
 
     """
-    if remote_app not in current_app.config['SHIBBOLETH_REMOTE_APPS']:
-        return abort(404)
-    conf = current_app.config['SHIBBOLETH_REMOTE_APPS'][remote_app]
-    if 'saml_path' not in conf:
-        return abort(500, 'Bad server configuration.')
-    req = prepare_flask_request(request)
-    try:
-        auth = init_saml_auth(req, conf['saml_path'])
-    except OneLogin_Saml2_Error:
-        return abort(500)
+    conf = get_remote_app_config(remote_app)
+    entry = get_metadata(remote_app, conf)
+    if not isinstance(entry, SPMetadata):
+        return entry
+    return metadata_response(entry)
 
-    settings = auth.get_settings()
-    metadata = settings.get_sp_metadata()
-    errors = settings.validate_metadata(metadata)
 
-    if len(errors) == 0:
-        resp = make_response(metadata, 200)
-        resp.headers['Content-Type'] = 'text/xml'
-    else:
-        resp = make_response(', '.join(errors), 500)
-    return resp
+@blueprint.route('/discovery')
+def discovery():
+    """
+    Discovery service for the configured IdPs.
+
+    Serves the autocomplete of a "where are you from" page. See
+    :func:`discovery_response` for the parameters.
+
+    Returns:
+        flask.Response: The matching IdPs as JSON.
+
+    """
+    return discovery_response()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Loading of the remote applications when the application starts.
+
+With ``SHIBBOLETH_WARMUP`` set, the settings, IdP verification keys and
+attribute mappings of all ``SHIBBOLETH_REMOTE_APPS`` are loaded and validated
+in parallel while the extension is initialized, so that configuration errors
+show up at startup and the first login of a worker does not pay for them.
+
+The time it took to load each remote application is logged and sent as stage
+``warmup`` of :data:`shibboleth_authenticator.signals.stage_timed`.
+"""
+
+from __future__ import absolute_import, print_function
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+
+from .keys import idp_certs
+from .signals import stage_timed
+
+WARMUP_MODES = ('degrade', 'fail')
+"""Reactions to remote applications that fail to load."""
+
+WarmupResult = namedtuple('WarmupResult', 'remote_app duration error')
+"""Outcome of loading a remote application."""
+
+
+def warm_up_remote_app(ext, remote_apps, remote_app):
+    """Load and validate a remote application.
+
+    :param ext: The :class:`shibboleth_authenticator.ShibbolethAuthenticator`.
+    :param remote_apps: The ``SHIBBOLETH_REMOTE_APPS`` configuration.
+    :param remote_app: The remote application key name.
+    :returns: A :class:`WarmupResult`.
+    """
+    start = default_timer()
+    error = None
+    try:
+        conf = remote_apps[remote_app]
+        if 'saml_path' not in conf:
+            raise ValueError('No saml_path configured.')
+        settings = ext.settings_cache.get(
+            remote_app, conf['saml_path'],
+            entity_id=conf.get('entity_id'),
+            index=ext.federation_index,
+        )
+        if ext.key_cache is not None:
+            for cert in idp_certs(settings):
+                ext.key_cache.get(cert)
+        if 'mappings' in conf:
+            ext.mappers.get(remote_app, remote_apps)
+    except Exception as e:
+        error = e
+    return WarmupResult(remote_app, default_timer() - start, error)
+
+
+def warm_up(app, ext):
+    """Load all remote applications of an application in parallel.
+
+    :param app: The Flask application.
+    :param ext: The :class:`shibboleth_authenticator.ShibbolethAuthenticator`.
+    :returns: Dictionary mapping the remote applications to their
+        :class:`WarmupResult`.
+    :raises ValueError: If a remote application fails to load and
+        ``SHIBBOLETH_WARMUP`` is ``'fail'``.
+    """
+    mode = app.config['SHIBBOLETH_WARMUP']
+    if mode not in WARMUP_MODES:
+        raise ValueError('Unknown warm-up mode: {0}'.format(mode))
+    remote_apps = app.config['SHIBBOLETH_REMOTE_APPS']
+    names = sorted(remote_apps)
+    if not names:
+        return {}
+
+    pool = ThreadPool(min(len(names), app.config['SHIBBOLETH_WARMUP_THREADS']))
+    try:
+        results = pool.map(
+            lambda name: warm_up_remote_app(ext, remote_apps, name), names
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+    failed = []
+    for result in results:
+        if result.error is None:
+            app.logger.info('Loaded remote application %s in %.3f s.',
+                            result.remote_app, result.duration)
+        else:
+            failed.append(result)
+            app.logger.error('Failed to load remote application %s: %s',
+                             result.remote_app, result.error)
+        if stage_timed.receivers:
+            stage_timed.send(app, remote_app=result.remote_app,
+                             stage='warmup', duration=result.duration)
+    if failed and mode == 'fail':
+        raise ValueError('Failed to load remote applications: {0}'.format(
+            ', '.join(result.remote_app for result in failed)
+        ))
+    return dict((result.remote_app, result) for result in results)
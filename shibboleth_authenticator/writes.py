@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Deferred writes of non-critical user data.
+
+With a write queue configured, first logins only create the user row needed
+to sign in. The full name of the profile, the extra mapped attributes and
+the time of the login are pushed onto the queue as a :class:`ProfileWrite`
+and written in batches by a background worker. Extra attributes and the
+time of the last login are stored in the ``extra_data`` of the
+:class:`invenio_oauthclient.models.RemoteAccount` of the user.
+"""
+
+from __future__ import absolute_import, print_function
+
+import atexit
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from flask import current_app, has_app_context
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:
+    from Queue import Empty, Full, Queue
+
+ProfileWrite = namedtuple(
+    'ProfileWrite', 'user_id remote_app full_name extra login_at'
+)
+"""Non-critical data of a login."""
+
+
+def minimal_user_data(user_data):
+    """Strip the account information down to what registration needs.
+
+    :param user_data: The ``user`` part of the account information.
+    :returns: The user data without the full name.
+    """
+    user_data = dict(user_data)
+    if 'profile' in user_data:
+        user_data['profile'] = dict(
+            (k, v) for k, v in user_data['profile'].items()
+            if k != 'full_name'
+        )
+    return user_data
+
+
+def profile_write(user, remote_app, account_info):
+    """Create the deferred write of a login.
+
+    :param user: The :class:`invenio_accounts.models.User` that logged in.
+    :param remote_app: The remote application key name.
+    :param account_info: The account information.
+    :returns: A :class:`ProfileWrite`.
+    """
+    return ProfileWrite(
+        user_id=user.id,
+        remote_app=remote_app,
+        full_name=account_info['user'].get('profile', {}).get('full_name'),
+        extra=account_info.get('extra', {}),
+        login_at=time.time(),
+    )
+
+
+def apply_writes(writes, session=None):
+    """Write a batch of deferred writes in a single transaction.
+
+    Only the latest write of a user and remote application is applied.
+
+    :param writes: Iterable of :class:`ProfileWrite`.
+    :param session: The database session to commit. Defaults to
+        ``db.session``.
+    """
+    from invenio_db import db
+    from invenio_oauthclient.models import RemoteAccount
+    try:
+        from invenio_userprofiles.models import UserProfile
+    except ImportError:
+        UserProfile = None
+
+    if session is None:
+        session = db.session
+    merged = OrderedDict()
+    for write in writes:
+        merged[(write.user_id, write.remote_app)] = write
+    if not merged:
+        return
+    writes = list(merged.values())
+    user_ids = set(w.user_id for w in writes)
+
+    if UserProfile is not None:
+        profiles = dict(
+            (p.user_id, p) for p in session.query(UserProfile).filter(
+                UserProfile.user_id.in_(user_ids)
+            )
+        )
+        for write in writes:
+            if not write.full_name:
+                continue
+            profile = profiles.get(write.user_id)
+            if profile is None:
+                profile = profiles[write.user_id] = UserProfile(
+                    user_id=write.user_id
+                )
+                session.add(profile)
+            profile.full_name = write.full_name
+
+    accounts = dict(
+        ((a.user_id, a.client_id), a) for a in session.query(
+            RemoteAccount
+        ).filter(
+            RemoteAccount.user_id.in_(user_ids),
+            RemoteAccount.client_id.in_(set(w.remote_app for w in writes)),
+        )
+    )
+    for write in writes:
+        account = accounts.get((write.user_id, write.remote_app))
+        if account is None:
+            account = RemoteAccount(user_id=write.user_id,
+                                    client_id=write.remote_app,
+                                    extra_data={})
+            session.add(account)
+        extra_data = dict(account.extra_data or {})
+        extra_data.update(write.extra or {})
+        extra_data['last_login'] = datetime.utcfromtimestamp(
+            write.login_at
+        ).isoformat()
+        account.extra_data = extra_data
+    session.commit()
+
+
+_queues = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_queues():
+    for queue in list(_queues):
+        queue.flush()
+
+
+def _work(ref, queue):
+    # The worker only holds the queue object weakly, so that write queues
+    # and their applications can be collected. It ends once they are.
+    while True:
+        try:
+            batch = [queue.get(timeout=1.0)]
+        except Empty:
+            if ref() is None:
+                return
+            continue
+        owner = ref()
+        try:
+            if owner is not None:
+                batch.extend(owner._take(owner.interval))
+                owner._apply(batch)
+        finally:
+            for _ in batch:
+                queue.task_done()
+        if owner is None:
+            return
+        del owner
+
+
+class LocalWriteQueue(object):
+    """In-process queue flushed by a background thread.
+
+    The worker waits until ``batch_size`` writes are queued or
+    ``interval`` seconds have passed, and then applies the batch in an
+    application context. If the queue is full, writes are applied by the
+    caller. Writes are applied in a session of their own, so that they are
+    not mixed with the transaction of a request. A batch that fails
+    because another process created a remote account at the same time is
+    applied again. Queued writes are flushed when the interpreter exits.
+    """
+
+    def __init__(self, app, batch_size=100, interval=1.0, maxsize=10000):
+        """Initialize the queue.
+
+        :param app: The Flask application.
+        :param batch_size: Maximum number of writes per transaction.
+        :param interval: Maximum number of seconds a write waits.
+        :param maxsize: Maximum number of queued writes.
+        """
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        _queues.add(self)
+
+    def put(self, write):
+        """Queue a write.
+
+        :param write: A :class:`ProfileWrite`.
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(write)
+        except Full:
+            self._apply([write])
+
+    def _ensure_worker(self):
+        # The worker does not survive a fork of the process.
+        if self._thread is not None and self._pid == os.getpid() and \
+                self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or \
+                    not self._thread.is_alive():
+                if self._pid is not None and self._pid != os.getpid():
+                    # Writes queued before a fork are applied by the parent.
+                    self._queue = Queue(self._queue.maxsize)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=_work, args=(weakref.ref(self), self._queue),
+                    name='shibboleth-writes',
+                )
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _take(self, timeout):
+        batch = []
+        deadline = time.time() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _apply(self, batch):
+        if has_app_context() and current_app._get_current_object() is \
+                self.app:
+            return self._apply_in_context(batch)
+        with self.app.app_context():
+            self._apply_in_context(batch)
+
+    def _apply_in_context(self, batch):
+        from invenio_db import db
+        from sqlalchemy.exc import IntegrityError
+
+        # A remote account created concurrently by another process is found
+        # and updated by the second attempt.
+        for retry in (True, False):
+            session = db.create_session({})()
+            try:
+                apply_writes(batch, session)
+                return
+            except Exception as err:
+                session.rollback()
+                if retry and isinstance(err, IntegrityError):
+                    continue
+                self.app.logger.exception(
+                    'Failed to write %d deferred profile updates.',
+                    len(batch)
+                )
+                return
+            finally:
+                session.close()
+
+    def flush(self):
+        """Apply all queued writes before returning."""
+        if self._pid is not None and self._pid != os.getpid():
+            # The writes were queued before a fork, the parent applies them.
+            return
+        batch = self._take(0)
+        while batch:
+            try:
+                self._apply(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            batch = self._take(0)
+        if self._thread is not None and self._thread.is_alive():
+            # Wait for the batch the worker is writing.
+            self._queue.join()
+
+
+def create_write_queue(app):
+    """Create the write queue configured for an application.
+
+    :param app: The Flask application.
+    :returns: A write queue or ``None`` if writes are not deferred.
+    """
+    backend = app.config['SHIBBOLETH_WRITE_QUEUE']
+    if not backend:
+        return None
+    if backend == 'local':
+        return LocalWriteQueue(
+            app,
+            batch_size=app.config['SHIBBOLETH_WRITE_BATCH_SIZE'],
+            interval=app.config['SHIBBOLETH_WRITE_INTERVAL'],
+            maxsize=app.config['SHIBBOLETH_WRITE_QUEUE_SIZE'],
+        )
+    raise ValueError('Unknown write queue backend: {0}'.format(backend))
@@ -18,6 +18,7 @@
 
 """Test helpers."""
 
+import os
 from inspect import isfunction
 
 import six
@@ -49,3 +50,56 @@ def check_csrf_disabled(form):
         for f in form:
             if isinstance(f, FormField):
                 check_csrf_disabled(f)
+
+
+def invalid_configuration(app):
+    """Configure a remote app without SAML settings."""
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider'
+            )
+        )
+    )
+
+
+def valid_configuration(app):
+    """Configure a remote app with valid SAML settings."""
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(os.path.dirname(__file__),
+                                       'data', 'valid')
+            )
+        )
+    )
+
+
+def authorized_valid_config(app):
+    """Configure a remote app accepting the test responses."""
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(os.path.dirname(__file__),
+                                       'data', 'settings'),
+                mappings=dict(
+                    email='mail',
+                    full_name='sn',
+                    user_unique_id='uid',
+                )
+            )
+        )
+    )
+    app.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
+
+
+def load_file(filename):
+    """Load content of file."""
+    filename = os.path.join(os.path.dirname(__file__), 'data', filename)
+    if(os.path.exists(filename)):
+        f = open(filename, 'r')
+        content = f.read()
+        f.close()
+        return content
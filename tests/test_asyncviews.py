@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test async views."""
+
+from __future__ import absolute_import, print_function
+
+import asyncio
+
+import pytest
+from flask import session
+from flask_login import current_user
+from invenio_accounts.models import SessionActivity
+from werkzeug.exceptions import HTTPException
+
+from helpers import (authorized_valid_config, invalid_configuration, load_file,
+                     valid_configuration)
+from shibboleth_authenticator import asyncviews
+from shibboleth_authenticator.views import SESSION_KEY
+
+
+def _run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def _abort_code(coro):
+    with pytest.raises(HTTPException) as excinfo:
+        _run(coro)
+    return excinfo.value.code
+
+
+@pytest.fixture
+def async_app(views_fixture):
+    """Application prepared like for the first request of a client."""
+    views_fixture.try_trigger_before_first_request_functions()
+    return views_fixture
+
+
+def test_login(async_app):
+    """Test async login view."""
+    app = async_app
+    valid_configuration(app)
+    with app.test_request_context('/shibboleth/login/idp/?next=/test'):
+        resp = _run(asyncviews.login('idp'))
+        assert resp.status_code == 302
+        assert 'SAMLRequest=' in resp.headers['Location']
+        assert 'RelayState=' in resp.headers['Location']
+
+    with app.test_request_context('/'):
+        assert _abort_code(asyncviews.login('unknown')) == 404
+
+
+def test_authorized(async_app):
+    """Test async authorized view."""
+    app = async_app
+    authorized_valid_config(app)
+    with app.test_request_context(
+            '/shibboleth/authorized/idp', method='POST',
+            data=dict(SAMLResponse=load_file('valid.xml.base64'))):
+        resp = _run(asyncviews.authorized('idp'))
+        assert resp.status_code == 302
+        assert current_user.is_authenticated
+        assert current_user.email == 'smartin@yaco.es'
+
+    with app.test_request_context(
+            '/shibboleth/authorized/idp', method='POST',
+            data=dict(SAMLResponse=load_file('expired.xml.base64'))):
+        assert _abort_code(asyncviews.authorized('idp')) == 403
+        assert not current_user.is_authenticated
+
+    with app.test_request_context(
+            '/shibboleth/authorized/idp', method='POST',
+            data=dict(SAMLResponse='PGZvbz4=')):
+        assert _abort_code(asyncviews.authorized('idp')) == 400
+
+
+def test_authorized_session(async_app):
+    """Test that the session is regenerated by an async login."""
+    app = async_app
+    authorized_valid_config(app)
+    with app.test_request_context('/'):
+        session['next'] = '/test'
+        resp = app.process_response(app.make_response(''))
+        cookie = resp.headers['Set-Cookie'].split(';')[0]
+        old_sid = session.sid_s
+
+    with app.test_request_context(
+            '/shibboleth/authorized/idp', method='POST',
+            data=dict(SAMLResponse=load_file('valid.xml.base64')),
+            headers={'Cookie': cookie}):
+        assert session.sid_s == old_sid
+        resp = app.process_response(_run(asyncviews.authorized('idp')))
+        assert resp.status_code == 302
+        assert session.sid_s != old_sid
+        assert SessionActivity.query.filter_by(
+            sid_s=session.sid_s).count() == 1
+
+
+def test_metadata(async_app):
+    """Test async metadata view."""
+    app = async_app
+    valid_configuration(app)
+    with app.test_request_context('/shibboleth/metadata/idp'):
+        resp = _run(asyncviews.metadata('idp'))
+        assert resp.status_code == 200
+        assert resp.headers['Content-Type'] == 'text/xml'
+        etag = resp.get_etag()[0]
+
+    with app.test_request_context('/shibboleth/metadata/idp',
+                                  headers={'If-None-Match': etag}):
+        assert _run(asyncviews.metadata('idp')).status_code == 304
+
+    invalid_configuration(app)
+    app.extensions['shibboleth-authenticator'].metadata_cache.invalidate()
+    with app.test_request_context('/shibboleth/metadata/idp'):
+        assert _abort_code(asyncviews.metadata('idp')) == 500
+
+
+def test_logout(async_app):
+    """Test async logout and single logout service views."""
+    app = async_app
+    authorized_valid_config(app)
+    with app.test_request_context('/shibboleth/logout/idp/?next=/done'):
+        resp = _run(asyncviews.logout('idp'))
+        assert resp.headers['Location'].endswith('/done')
+
+        session[SESSION_KEY] = dict(remote_app='idp', nameid='alice',
+                                    nameid_format=None, session_index='s1')
+        resp = _run(asyncviews.logout('idp'))
+        assert 'SAMLRequest=' in resp.headers['Location']
+        assert SESSION_KEY not in session
+
+    with app.test_request_context('/shibboleth/sls/idp?SAMLRequest=foo'):
+        assert _abort_code(asyncviews.sls('idp')) == 400
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test caches."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+
+import pytest
+from onelogin.saml2.utils import OneLogin_Saml2_Error
+
+from shibboleth_authenticator.cache import (MetadataCache, SettingsCache,
+                                            read_settings, settings_stamp)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def saml_path(tmpdir):
+    """Copy of the valid python3-saml settings."""
+    path = str(tmpdir.join('saml'))
+    shutil.copytree(os.path.join(DATA, 'valid'), path)
+    return path
+
+
+def test_read_settings(saml_path):
+    """Test reading settings with inlined certificates."""
+    settings = read_settings(saml_path)
+    assert 'security' in settings
+    assert settings['sp']['x509cert'].startswith('-----BEGIN CERTIFICATE')
+    assert settings['sp']['privateKey']
+
+    # custom_base_path is ignored like python3-saml does.
+    settings = read_settings(os.path.join(DATA, 'settings'))
+    assert 'custom_base_path' not in settings
+
+    with pytest.raises(OneLogin_Saml2_Error):
+        read_settings(os.path.join(DATA, 'missing'))
+
+
+def test_settings_cache(saml_path):
+    """Test settings cache."""
+    cache = SettingsCache()
+    assert 'idp' not in cache
+    settings = cache.get('idp', saml_path)
+    assert 'idp' in cache
+    assert cache.get('idp', saml_path) is settings
+    assert settings.get_sp_key()
+
+    # Modified files are reloaded.
+    filename = os.path.join(saml_path, 'advanced_settings.json')
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + 10))
+    reloaded = cache.get('idp', saml_path)
+    assert reloaded is not settings
+    assert cache.get('idp', saml_path) is reloaded
+
+    # A different saml_path for the same remote app is reloaded.
+    other = cache.get('idp', os.path.join(DATA, 'settings'))
+    assert other is not reloaded
+
+    cache.invalidate('idp')
+    assert 'idp' not in cache
+    cache.get('idp', saml_path)
+    cache.invalidate()
+    assert 'idp' not in cache
+
+    with pytest.raises(OneLogin_Saml2_Error):
+        cache.get('idp', os.path.join(DATA, 'missing'))
+    assert 'idp' not in cache
+
+
+def test_metadata_cache(saml_path):
+    """Test metadata cache."""
+    cache = MetadataCache()
+    stamp = settings_stamp(saml_path)
+    assert cache.get('idp', stamp) is None
+
+    entry = cache.set('idp', stamp, u'<xml/>', 60)
+    assert entry.xml == b'<xml/>'
+    assert entry.etag
+    assert cache.get('idp', stamp) is entry
+
+    # Changed files
+    filename = os.path.join(saml_path, 'settings.json')
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + 10))
+    assert cache.get('idp', settings_stamp(saml_path)) is None
+
+    # Expired entry
+    cache.set('idp', stamp, u'<xml/>', 0)
+    assert cache.get('idp', stamp) is None
+
+    cache.set('idp', stamp, u'<xml/>', 60)
+    cache.invalidate()
+    assert cache.get('idp', stamp) is None
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test discovery of identity providers."""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+import pytest
+from flask import url_for
+
+from shibboleth_authenticator.discovery import (Catalogue, Discovery, IdP,
+                                                display_name, fold, load_idps)
+from shibboleth_authenticator.federation import FederationIndex, build_index
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def index(tmpdir):
+    """Federation index of the test metadata."""
+    filename = str(tmpdir.join('federation.idx'))
+    build_index(os.path.join(DATA, 'federation.xml'), filename)
+    return FederationIndex(filename)
+
+
+@pytest.fixture
+def remote_apps():
+    """Remote applications with and without federation metadata."""
+    return dict(
+        hzdr=dict(title='Helmholtz-Zentrum Dresden-Rossendorf',
+                  scopes=['hzdr.de']),
+        example=dict(entity_id='https://idp.example.org/idp/shibboleth'),
+        other=dict(entity_id='https://idp.example.com/idp/shibboleth',
+                   title=dict(en='Other University', de='Andere Uni')),
+        hidden=dict(title='Hidden IdP', discovery=False),
+    )
+
+
+def test_fold():
+    """Test folding of texts."""
+    assert fold(u'Beispieluniversit\xe4t') == 'beispieluniversitat'
+    assert fold('https://idp.Example.org/idp') == 'https idp example org idp'
+    assert fold('  ') == ''
+
+
+def test_load_idps(remote_apps, index):
+    """Test collecting the IdPs of the remote applications."""
+    idps = dict((idp.remote_app, idp) for idp in load_idps(remote_apps))
+    assert sorted(idps) == ['example', 'hzdr', 'other']
+    assert idps['example'].display_names == {}
+    assert display_name(idps['example']) == 'example'
+    assert display_name(idps['hzdr'], ['de']) == \
+        'Helmholtz-Zentrum Dresden-Rossendorf'
+
+    idps = dict((idp.remote_app, idp) for idp in
+                load_idps(remote_apps, index))
+    assert idps['example'].scopes == ['example.org']
+    assert display_name(idps['example']) == 'Example University'
+    assert display_name(idps['example'], ['de']) == \
+        u'Beispieluniversit\xe4t'
+    assert display_name(idps['other'], ['de']) == 'Andere Uni'
+    assert idps['hzdr'].scopes == ['hzdr.de']
+
+
+def test_search(remote_apps, index):
+    """Test searching the catalogue."""
+    catalogue = Catalogue(load_idps(remote_apps, index))
+    assert len(catalogue) == 3
+
+    def search(query):
+        return [idp.remote_app for idp in catalogue.search(query)]
+
+    # Empty queries list all IdPs by name
+    assert search('') == ['example', 'hzdr', 'other']
+    # Prefixes of names, scopes and entityIDs
+    assert search('helm') == ['hzdr']
+    assert search('h') == ['hzdr']
+    assert search('idp') == ['example', 'other']
+    assert search('hzdr.de') == ['hzdr']
+    assert search('example') == ['example', 'other']
+    assert search('idp.example.com') == ['other']
+    # Accents and case are ignored
+    assert search(u'BEISPIELUNIVERSIT\xc4T') == ['example']
+    # Infixes of three or more characters rank after prefixes
+    assert search('dorf') == ['hzdr']
+    assert search('versit') == ['example', 'other']
+    assert search('uni') == ['example', 'other']
+    # All terms must match
+    assert search('example uni') == ['example', 'other']
+    assert search('dresden example') == []
+    assert search('xyz') == []
+    assert search('zz') == []
+
+
+def test_discovery(remote_apps, index):
+    """Test that the catalogue is rebuilt when the configuration changes."""
+    discovery = Discovery()
+    catalogue = discovery.get(remote_apps)
+    assert discovery.get(remote_apps) is catalogue
+    assert len(catalogue) == 3
+
+    remote_apps['new'] = dict(title='New IdP')
+    assert len(discovery.get(remote_apps)) == 4
+    assert discovery.get(remote_apps, index) is not catalogue
+
+    catalogue = discovery.get(remote_apps, index)
+    discovery.invalidate()
+    assert discovery.get(remote_apps, index) is not catalogue
+    assert len(Catalogue([IdP('a', None, {}, [])])) == 1
+
+
+def test_discovery_view(app, remote_apps, index):
+    """Test discovery view."""
+    app.config['SHIBBOLETH_REMOTE_APPS'] = remote_apps
+    app.extensions['shibboleth-authenticator'].federation_index = index
+    url = url_for('shibboleth_authenticator.discovery')
+    with app.test_client() as client:
+        resp = client.get(url, query_string=dict(q='uni', next='/records'),
+                          headers={'Accept-Language': 'de'})
+        assert resp.status_code == 200
+        assert resp.headers['Content-Type'] == 'application/json'
+        assert resp.cache_control.public
+        assert resp.cache_control.max_age == 300
+        assert 'Accept-Language' in resp.headers['Vary']
+        data = resp.get_json()
+        assert data['total'] == 2
+        assert data['page'] == 1
+        assert [r['name'] for r in data['results']] == [
+            u'Beispieluniversit\xe4t', 'Andere Uni'
+        ]
+        result = data['results'][0]
+        assert result['remote_app'] == 'example'
+        assert result['entity_id'] == 'https://idp.example.org/idp/shibboleth'
+        assert result['scopes'] == ['example.org']
+        assert result['login_url'] == url_for(
+            'shibboleth_authenticator.login', remote_app='example',
+            next='/records'
+        )
+
+        # Conditional requests
+        resp = client.get(url, query_string=dict(q='uni'),
+                          headers={'If-None-Match': resp.get_etag()[0]})
+        assert resp.status_code == 200
+        etag = resp.get_etag()[0]
+        resp = client.get(url, query_string=dict(q='uni'),
+                          headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+
+        # Pagination
+        resp = client.get(url, query_string=dict(size=2, page=2))
+        data = resp.get_json()
+        assert data['total'] == 3
+        assert [r['remote_app'] for r in data['results']] == ['other']
+        app.config['SHIBBOLETH_DISCOVERY_MAX_PAGE_SIZE'] = 1
+        resp = client.get(url, query_string=dict(size=2))
+        assert resp.get_json()['size'] == 1
+        assert len(resp.get_json()['results']) == 1
+
+        for query_string in (dict(page='x'), dict(page=0), dict(size=-1)):
+            resp = client.get(url, query_string=query_string)
+            assert resp.status_code == 400
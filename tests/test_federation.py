@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test federation metadata index."""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+import pytest
+from flask import url_for
+from onelogin.saml2.utils import OneLogin_Saml2_Error
+
+from shibboleth_authenticator.cli import shibboleth
+from shibboleth_authenticator.federation import (FederationIndex, build_index,
+                                                 decode_record, encode_record,
+                                                 iter_idps)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+FEDERATION = os.path.join(DATA, 'federation.xml')
+
+
+@pytest.fixture
+def index(tmpdir):
+    """Federation index of the test metadata."""
+    filename = str(tmpdir.join('federation.idx'))
+    assert build_index(FEDERATION, filename) == 2
+    return FederationIndex(filename)
+
+
+def test_iter_idps():
+    """Test parsing of federation metadata."""
+    idps = dict((idp['entity_id'], idp) for idp in iter_idps(FEDERATION))
+    assert sorted(idps) == ['https://idp.example.com/idp/shibboleth',
+                            'https://idp.example.org/idp/shibboleth']
+
+    idp = idps['https://idp.example.org/idp/shibboleth']
+    assert len(idp['sso']) == 2
+    assert len(idp['slo']) == 1
+    assert len(idp['signing']) == 1
+    assert not idp['encryption']
+    assert ' ' not in idp['signing'][0]
+    assert idp['scopes'] == ['example.org']
+    assert idp['display_names']['en'] == 'Example University'
+
+    idp = idps['https://idp.example.com/idp/shibboleth']
+    assert len(idp['signing']) == 2
+    assert len(idp['encryption']) == 1
+
+
+def test_record():
+    """Test encoding and decoding of index records."""
+    for idp in iter_idps(FEDERATION):
+        record = encode_record(idp)
+        assert decode_record(idp['entity_id'], record) == idp
+
+
+def test_index(index):
+    """Test federation index."""
+    assert len(index) == 2
+    assert list(index.entity_ids()) == [
+        'https://idp.example.com/idp/shibboleth',
+        'https://idp.example.org/idp/shibboleth',
+    ]
+    assert index.get('https://sp.example.org/shibboleth') is None
+    assert index.get('https://idp.example.org/idp/shibboleth')
+
+    settings = index.idp_settings('https://idp.example.org/idp/shibboleth')
+    assert settings['singleSignOnService']['url'] == \
+        'https://idp.example.org/idp/profile/SAML2/Redirect/SSO'
+    assert settings['singleLogoutService']['url'] == \
+        'https://idp.example.org/idp/profile/SAML2/Redirect/SLO'
+    assert settings['x509cert']
+
+    settings = index.idp_settings('https://idp.example.com/idp/shibboleth')
+    assert settings['singleSignOnService']['binding'].endswith('HTTP-POST')
+    assert 'singleLogoutService' not in settings
+    assert len(settings['x509certMulti']['signing']) == 2
+    assert len(settings['x509certMulti']['encryption']) == 1
+
+    with pytest.raises(OneLogin_Saml2_Error):
+        index.idp_settings('https://unknown.example.org')
+
+    # Rebuilt index is picked up
+    stamp = index.stamp()
+    build_index(FEDERATION, index.filename)
+    assert index.stamp() != stamp
+    assert index.get('https://idp.example.org/idp/shibboleth')
+
+    with pytest.raises(OneLogin_Saml2_Error):
+        FederationIndex(index.filename + '.missing').get('x')
+
+    # Invalid index file
+    with open(index.filename, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(OneLogin_Saml2_Error):
+        index.get('https://idp.example.org/idp/shibboleth')
+
+
+def test_damaged_index(index):
+    """Test that empty and truncated index files are rejected."""
+    with open(index.filename, 'rb') as f:
+        data = f.read()
+    for size in (0, 4, 40, len(data) - 1):
+        with open(index.filename, 'wb') as f:
+            f.write(data[:size])
+        # Force a new stamp even within the mtime resolution.
+        os.utime(index.filename, (0, size))
+        with pytest.raises(OneLogin_Saml2_Error):
+            index.get('https://idp.example.org/idp/shibboleth')
+        with pytest.raises(OneLogin_Saml2_Error):
+            len(index)
+
+
+def test_cli(app, tmpdir):
+    """Test index command."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(shibboleth, ['index', FEDERATION])
+    assert result.exit_code != 0
+
+    filename = str(tmpdir.join('cli.idx'))
+    app.config['SHIBBOLETH_FEDERATION_INDEX'] = filename
+    result = runner.invoke(shibboleth, ['index', FEDERATION])
+    assert result.exit_code == 0
+    assert len(FederationIndex(filename)) == 2
+
+    filename = str(tmpdir.join('other.idx'))
+    result = runner.invoke(shibboleth, ['index', FEDERATION, '-o', filename])
+    assert result.exit_code == 0
+    assert len(FederationIndex(filename)) == 2
+
+
+def test_federation_login(views_fixture, index):
+    """Test login with an IdP taken from the federation index."""
+    app = views_fixture
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            fed=dict(
+                title='Federation IdP',
+                saml_path=os.path.join(DATA, 'valid'),
+                entity_id='https://idp.example.org/idp/shibboleth',
+            ),
+            unknown=dict(
+                title='Unknown IdP',
+                saml_path=os.path.join(DATA, 'valid'),
+                entity_id='https://unknown.example.org',
+            ),
+        )
+    )
+    ext = app.extensions['shibboleth-authenticator']
+    with app.test_client() as client:
+        resp = client.get(
+            url_for('shibboleth_authenticator.login', remote_app='fed')
+        )
+        assert resp.status_code == 500
+
+        ext.federation_index = index
+        resp = client.get(
+            url_for('shibboleth_authenticator.login', remote_app='fed')
+        )
+        assert resp.status_code == 302
+        assert resp.headers['Location'].startswith(
+            'https://idp.example.org/idp/profile/SAML2/Redirect/SSO'
+        )
+
+        resp = client.get(
+            url_for('shibboleth_authenticator.login', remote_app='unknown')
+        )
+        assert resp.status_code == 500
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test that loading the extension stays cheap."""
+
+from __future__ import absolute_import, print_function
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+IMPORT_BUDGET = 0.5
+"""Maximum cumulative import time of the package in seconds.
+
+The bound is generous, loading the package takes a few tens of
+milliseconds. It catches expensive work at import time, which
+:data:`HEAVY_MODULES` cannot see.
+"""
+
+HEAVY_MODULES = (
+    'invenio_accounts',
+    'invenio_db',
+    'invenio_oauthclient',
+    'lxml',
+    'onelogin.saml2.auth',
+    'onelogin.saml2.settings',
+    'onelogin.saml2.utils',
+    'sqlalchemy',
+    'xmlsec',
+)
+"""Modules which must only be imported by the first request."""
+
+SCRIPT = """
+import json
+import sys
+
+import flask
+
+import shibboleth_authenticator
+import shibboleth_authenticator.cli
+import shibboleth_authenticator.views
+
+app = flask.Flask('testapp')
+shibboleth_authenticator.ShibbolethAuthenticator(app)
+app.register_blueprint(shibboleth_authenticator.views.blueprint)
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+IMPORT_SCRIPT = """
+import flask
+import flask_login
+
+import shibboleth_authenticator
+import shibboleth_authenticator.cli
+import shibboleth_authenticator.views
+"""
+
+
+def _run(*args):
+    return subprocess.Popen(
+        [sys.executable] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True,
+    ).communicate()
+
+
+def test_heavy_modules_deferred():
+    """Test that loading the extension does not import SAML or the DB."""
+    out, err = _run('-c', SCRIPT)
+    assert out, err
+    modules = set(json.loads(out))
+    loaded = [
+        name for name in HEAVY_MODULES
+        if name in modules or any(m.startswith(name + '.') for m in modules)
+    ]
+    assert loaded == []
+
+
+def import_time(output, package='shibboleth_authenticator'):
+    """Return the cumulative import time of a package in seconds.
+
+    :param output: The standard error of ``python -X importtime``.
+    :param package: The name of the package.
+    """
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only count modules imported at the top level, the cumulative
+        # time includes nested imports.
+        if not name.startswith(' ') or name.startswith('  '):
+            continue
+        name = name.strip()
+        if name == package or name.startswith(package + '.'):
+            total += int(cumulative)
+    return total / 1e6
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason='python -X importtime requires Python 3.7')
+def test_import_time():
+    """Test that importing the package does no expensive work."""
+    _, err = _run('-X', 'importtime', '-c', IMPORT_SCRIPT)
+    assert 0 < import_time(err) < IMPORT_BUDGET, err
+
+
+def test_parse_import_time():
+    """Test parsing of the import time report."""
+    assert import_time('\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       100 |        100 |   lxml',
+        'import time:      1000 |       2000 | shibboleth_authenticator',
+        'import time:       500 |        500 | shibboleth_authenticator.cli',
+        'unrelated output',
+    ])) == 0.0025
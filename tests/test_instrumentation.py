@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test timing instrumentation."""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+import mock
+import pytest
+from flask import url_for
+
+from shibboleth_authenticator.instrumentation import (PrometheusTimer,
+                                                      StatsdTimer, timed)
+from shibboleth_authenticator.signals import stage_timed
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _login(app):
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(DATA, 'settings'),
+                mappings=dict(
+                    email='mail',
+                    full_name='sn',
+                    user_unique_id='uid',
+                )
+            )
+        )
+    )
+    app.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
+    with open(os.path.join(DATA, 'valid.xml.base64')) as f:
+        response = f.read()
+    with app.test_client() as client:
+        resp = client.post(
+            url_for('shibboleth_authenticator.authorized', remote_app='idp'),
+            data=dict(SAMLResponse=response)
+        )
+        assert resp.status_code == 302
+
+
+def test_timed(app):
+    """Test that timings are only taken with connected receivers."""
+    with mock.patch('shibboleth_authenticator.instrumentation.'
+                    'default_timer') as timer:
+        with timed('stage', 'idp'):
+            pass
+        assert not timer.called
+
+    records = []
+
+    def receiver(sender, **kwargs):
+        records.append((sender, kwargs))
+
+    with stage_timed.connected_to(receiver):
+        with pytest.raises(ValueError):
+            with timed('stage', 'idp'):
+                raise ValueError
+    assert len(records) == 1
+    sender, kwargs = records[0]
+    assert sender is app
+    assert kwargs['remote_app'] == 'idp'
+    assert kwargs['stage'] == 'stage'
+    assert kwargs['duration'] >= 0
+
+
+def test_authorized_stages(views_fixture):
+    """Test that all stages of a login are timed."""
+    stages = []
+
+    def receiver(sender, remote_app=None, stage=None, duration=None):
+        assert remote_app == 'idp'
+        stages.append(stage)
+
+    with stage_timed.connected_to(receiver):
+        _login(views_fixture)
+    assert stages == ['init_saml_auth', 'process_response', 'account_info',
+                      'user_lookup', 'register', 'link', 'commit']
+
+
+def test_statsd_timer(views_fixture):
+    """Test statsd adapter."""
+    client = mock.Mock()
+    timer = StatsdTimer(client, prefix='test').connect(views_fixture)
+    try:
+        _login(views_fixture)
+    finally:
+        timer.disconnect()
+    names = [c[0][0] for c in client.timing.call_args_list]
+    assert 'test.idp.process_response' in names
+    assert all(c[0][1] >= 0 for c in client.timing.call_args_list)
+
+
+def test_prometheus_timer(views_fixture):
+    """Test Prometheus adapter."""
+    prometheus_client = pytest.importorskip('prometheus_client')
+    registry = prometheus_client.CollectorRegistry()
+    timer = PrometheusTimer(registry=registry).connect()
+    try:
+        _login(views_fixture)
+    finally:
+        timer.disconnect()
+    assert registry.get_sample_value(
+        'shibboleth_login_stage_seconds_count',
+        dict(remote_app='idp', stage='process_response'),
+    ) == 1
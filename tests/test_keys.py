@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test verification key cache."""
+
+from __future__ import absolute_import, print_function
+
+import base64
+import json
+import os
+
+import mock
+import xmlsec
+from flask import url_for
+from onelogin.saml2.utils import OneLogin_Saml2_Utils
+from onelogin.saml2.xml_utils import OneLogin_Saml2_XML
+
+from shibboleth_authenticator.keys import KeyCache, current_key_cache, install
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _cert(name):
+    with open(os.path.join(DATA, name, 'settings.json')) as f:
+        cert = json.load(f)['idp']['x509cert']
+    return OneLogin_Saml2_Utils.format_cert(cert)
+
+
+def test_key_cache():
+    """Test LRU behaviour and counters."""
+    cert1, cert2 = _cert('settings'), _cert('valid')
+    cache = KeyCache(maxsize=1)
+    key = cache.get(cert1)
+    assert cache.get(cert1) is key
+    assert cache.info() == dict(hits=1, misses=1, size=1, maxsize=1)
+
+    cache.get(cert2)
+    assert cert2 in cache
+    assert cert1 not in cache
+
+    cache.clear()
+    assert cache.info() == dict(hits=0, misses=0, size=0, maxsize=1)
+
+
+def test_key_cache_rotation():
+    """Test eviction of rotated certificates."""
+    cert1, cert2 = _cert('settings'), _cert('valid')
+    settings = mock.Mock()
+    cache = KeyCache()
+
+    settings.get_idp_data.return_value = dict(x509cert=cert1)
+    cache.update('idp', settings)
+    cache.update('other', settings)
+    cache.get(cert1)
+
+    # Still in use by another remote app.
+    settings.get_idp_data.return_value = dict(
+        x509certMulti=dict(signing=[cert2])
+    )
+    cache.update('idp', settings)
+    assert cert1 in cache
+
+    cache.update('other', settings)
+    assert cert1 not in cache
+
+
+def test_key_cache_fingerprints():
+    """Test that fingerprints are computed when settings are loaded."""
+    cert = _cert('settings')
+    settings = mock.Mock()
+    settings.get_idp_data.return_value = dict(x509cert=cert)
+    cache = KeyCache()
+    with mock.patch('shibboleth_authenticator.keys.cert_fingerprint',
+                    return_value='fp') as fingerprint:
+        cache.update('idp', settings)
+        for i in range(3):
+            cache.get(cert)
+    assert fingerprint.call_count == 1
+
+
+def test_current_key_cache(base_app):
+    """Test that the key cache is only used by its application."""
+    assert current_key_cache() is None
+    with base_app.app_context():
+        assert current_key_cache() is None
+        base_app.extensions['shibboleth-authenticator'] = mock.Mock(
+            key_cache=KeyCache()
+        )
+        assert isinstance(current_key_cache(), KeyCache)
+
+
+def test_validate_node_sign(base_app):
+    """Test that python3-saml validates signatures with cached keys."""
+    with open(os.path.join(DATA, 'valid.xml.base64')) as f:
+        xml = base64.b64decode(f.read())
+    cert = _cert('settings')
+    install()
+
+    def validate(document):
+        document = OneLogin_Saml2_XML.to_etree(document)
+        xmlsec.tree.add_ids(document, ['ID'])
+        node = OneLogin_Saml2_XML.query(document, '//ds:Signature')[0]
+        return OneLogin_Saml2_Utils.validate_node_sign(node, document, cert)
+
+    tampered = xml.replace(b'idp.example.com', b'idp.example.org')
+    assert validate(xml) is True
+    assert validate(tampered) is False
+
+    cache = KeyCache()
+    base_app.extensions['shibboleth-authenticator'] = mock.Mock(
+        key_cache=cache
+    )
+    with base_app.app_context():
+        assert validate(xml) is True
+        assert validate(tampered) is False
+        assert cache.info()['misses'] == 1
+        assert cache.info()['hits'] == 1
+        # Keys of other calls are not cached.
+        OneLogin_Saml2_Utils.validate_binary_sign(b'data', b'sig', cert)
+        assert cache.info()['hits'] == 1
+
+
+def test_authorized_key_cache(views_fixture):
+    """Test that signatures are verified with cached keys."""
+    app = views_fixture
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(DATA, 'settings'),
+                mappings=dict(
+                    email='mail',
+                    full_name='sn',
+                    user_unique_id='uid',
+                )
+            )
+        )
+    )
+    app.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
+    with open(os.path.join(DATA, 'valid.xml.base64')) as f:
+        response = f.read()
+
+    ext = app.extensions['shibboleth-authenticator']
+    ext.key_cache = key_cache = KeyCache()
+    ext.settings_cache.on_load = key_cache.on_settings_load
+    with app.test_client() as client:
+        for i in range(2):
+            resp = client.post(
+                url_for('shibboleth_authenticator.authorized',
+                        remote_app='idp'),
+                data=dict(SAMLResponse=response)
+            )
+            assert resp.status_code == 302
+    assert key_cache.misses == 1
+    assert key_cache.hits >= 1
+    assert _cert('settings') in key_cache
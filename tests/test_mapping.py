@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test attribute mapping."""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+import pytest
+from flask import url_for
+from flask_login import current_user
+
+from shibboleth_authenticator.mapping import (AccountInfoMapper,
+                                              AttributeMappingError,
+                                              MapperRegistry)
+
+ATTRIBUTES = dict(
+    mail=['John.Doe@Example.org'],
+    cn=['John Doe'],
+    eppn=['jdoe@example.org'],
+    isMemberOf=['staff', 'ou=admins,dc=example', 'students'],
+)
+
+
+def test_mapper():
+    """Test fallbacks, transforms and multi-valued fields."""
+    mapper = AccountInfoMapper('idp', dict(
+        email=dict(attributes=['email', 'mail'], transforms=['lowercase']),
+        full_name=['displayName', 'cn'],
+        user_unique_id='eppn',
+        groups=dict(attributes='isMemberOf', multi=True,
+                    transforms=[('regex', r'^(?:ou=)?(\w+)')]),
+        affiliation=dict(attributes='affiliation', required=False,
+                         default='member'),
+    ))
+    assert mapper(ATTRIBUTES) == dict(
+        user=dict(
+            email='john.doe@example.org',
+            profile=dict(full_name='John Doe', username='jdoe'),
+        ),
+        external_id='jdoe@example.org',
+        external_method='idp',
+        extra=dict(groups=['staff', 'admins', 'students'],
+                   affiliation='member'),
+    )
+
+    mapper = AccountInfoMapper('idp', dict(
+        email='mail',
+        full_name='cn',
+        user_unique_id='eppn',
+        username=dict(attributes='mail',
+                      transforms=['strip_scope', 'uppercase']),
+    ))
+    account_info = mapper(ATTRIBUTES)
+    assert account_info['user']['profile']['username'] == 'JOHN.DOE'
+    assert 'extra' not in account_info
+
+
+def test_mapper_errors():
+    """Test structured errors."""
+    mapper = AccountInfoMapper('idp', dict(
+        email=['email', 'mail'], full_name='cn', user_unique_id='eppn',
+    ))
+    with pytest.raises(AttributeMappingError) as excinfo:
+        mapper(dict(cn=['John Doe'], eppn=['jdoe']))
+    assert excinfo.value.remote_app == 'idp'
+    assert excinfo.value.field == 'email'
+    assert excinfo.value.attributes == ('email', 'mail')
+    assert 'email, mail' in str(excinfo.value)
+
+    # Empty values are missing values.
+    with pytest.raises(KeyError):
+        mapper(dict(mail=[''], cn=['John Doe'], eppn=['jdoe']))
+
+    with pytest.raises(ValueError):
+        AccountInfoMapper('idp', dict(email='mail'))
+    with pytest.raises(ValueError):
+        AccountInfoMapper('idp', dict(
+            email=dict(attributes='mail', transforms=['unknown']),
+            full_name='cn', user_unique_id='eppn',
+        ))
+
+
+def test_registry():
+    """Test compilation of the configured mappings."""
+    remote_apps = dict(
+        idp=dict(mappings=dict(email='mail', full_name='cn',
+                               user_unique_id='eppn')),
+        other=dict(title='No mappings'),
+    )
+    registry = MapperRegistry(remote_apps)
+    mapper = registry.get('idp', remote_apps)
+    assert registry.get('idp', remote_apps) is mapper
+
+    remote_apps['idp'] = dict(mappings=dict(email='mail', full_name='cn',
+                                            user_unique_id='mail'))
+    assert registry.get('idp', remote_apps) is not mapper
+    with pytest.raises(KeyError):
+        registry.get('other', remote_apps)
+    with pytest.raises(KeyError):
+        registry.get('invalid', remote_apps)
+
+
+def test_authorized_missing_attribute(views_fixture):
+    """Test login with a missing attribute."""
+    app = views_fixture
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(os.path.dirname(__file__),
+                                       'data', 'settings'),
+                mappings=dict(
+                    email='mail',
+                    full_name='displayName',
+                    user_unique_id='uid',
+                )
+            )
+        )
+    )
+    app.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
+    with open(os.path.join(os.path.dirname(__file__), 'data',
+                           'valid.xml.base64')) as f:
+        response = f.read()
+    with app.test_client() as client:
+        resp = client.post(
+            url_for('shibboleth_authenticator.authorized', remote_app='idp'),
+            data=dict(SAMLResponse=response)
+        )
+        assert resp.status_code == 302
+        assert not current_user.is_authenticated
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test pre-validation of SAML responses."""
+
+from __future__ import absolute_import, print_function
+
+import base64
+import os
+
+import pytest
+from flask import url_for
+
+from shibboleth_authenticator.precheck import (ENTITY, INVALID_BASE64,
+                                               INVALID_ROOT, TOO_DEEP,
+                                               TOO_LARGE, ResponseChecker)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _encode(xml):
+    return base64.b64encode(xml).decode('ascii')
+
+
+@pytest.mark.parametrize('filename', ['valid.xml.base64',
+                                      'expired.xml.base64'])
+def test_check_valid(filename):
+    """Test that real responses pass."""
+    with open(os.path.join(DATA, filename)) as f:
+        response = f.read()
+    checker = ResponseChecker(max_size=262144, max_depth=32)
+    assert checker.check(response) is None
+    assert checker.info() == {}
+
+
+def test_check_invalid():
+    """Test rejection reasons and counters."""
+    checker = ResponseChecker(max_size=1024, max_depth=3)
+    response = b'<samlp:Response xmlns:samlp="x"><a><b/></a></samlp:Response>'
+    assert checker.check(_encode(response)) is None
+    assert checker.check(_encode(b'<?xml version="1.0"?>\n' + response)) \
+        is None
+
+    assert checker.check('A' * 1025) == TOO_LARGE
+    assert checker.check('not base64!') == INVALID_BASE64
+    assert checker.check('QUJD=') == INVALID_BASE64
+    assert checker.check(u'\xe4\xe4\xe4\xe4') == INVALID_BASE64
+    assert checker.check('') == INVALID_ROOT
+    assert checker.check(_encode(b'<html><body/></html>')) == INVALID_ROOT
+    assert checker.check(_encode(
+        b'<Response><!DOCTYPE x [<!ENTITY a "b">]></Response>'
+    )) == ENTITY
+    assert checker.check(_encode(
+        b'<Response><a><b><c/></b></a></Response>'
+    )) is None
+    assert checker.check(_encode(
+        b'<Response><a><b><c></c></b></a></Response>'
+    )) == TOO_DEEP
+    assert checker.info() == {
+        TOO_LARGE: 1, INVALID_BASE64: 3, INVALID_ROOT: 2, ENTITY: 1,
+        TOO_DEEP: 1,
+    }
+
+    # Checks can be disabled.
+    checker = ResponseChecker()
+    assert checker.check(_encode(
+        b'<Response>' + b'<a>' * 100 + b'</a>' * 100 + b'</Response>'
+    )) is None
+
+
+def test_authorized_precheck(views_fixture):
+    """Test that malformed responses are rejected by the view."""
+    app = views_fixture
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(DATA, 'settings'),
+            )
+        )
+    )
+    ext = app.extensions['shibboleth-authenticator']
+    with app.test_client() as client:
+        resp = client.post(
+            url_for('shibboleth_authenticator.authorized', remote_app='idp'),
+            data=dict(SAMLResponse=_encode(b'<html/>'))
+        )
+        assert resp.status_code == 400
+        assert ext.response_checker.info() == {INVALID_ROOT: 1}
+        assert 'idp' not in ext.settings_cache
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test bulk provisioning."""
+
+from __future__ import absolute_import, print_function
+
+import io
+import json
+
+import pytest
+from invenio_accounts.models import User
+from invenio_oauthclient.models import UserIdentity
+from invenio_userprofiles import UserProfile
+
+from shibboleth_authenticator.cli import shibboleth
+from shibboleth_authenticator.provisioning import (provision, read_csv,
+                                                   read_jsonl)
+
+CSV = u"""email_mapping,id_mapping,full_name_mapping
+new1@hzdr.de,new1@hzdr.de,New One
+new2@hzdr.de,nick@hzdr.de,New Two
+info@hzdr.de,info@hzdr.de,Existing
+new1@hzdr.de,new1@hzdr.de,New One
+invalid@hzdr.de,,Invalid
+"""
+
+
+def test_read():
+    """Test readers."""
+    records = list(read_csv(io.StringIO(u'a,b\nx;y,\n')))
+    assert records == [dict(a=['x', 'y'])]
+    records = list(read_jsonl(io.StringIO(
+        u'{"a": ["x", "y"], "b": "z"}\n\n'
+    )))
+    assert records == [dict(a=['x', 'y'], b=['z'])]
+
+
+def test_provision(userprofiles_app, user):
+    """Test provisioning of users, profiles and links."""
+    progress = []
+    stats = provision(
+        read_csv(io.StringIO(CSV)), 'hzdr', chunk_size=3,
+        progress=lambda n, s: progress.append(n),
+    )
+    assert stats == dict(created=2, linked=1, existing=1, duplicate=0,
+                         invalid=1)
+    assert progress == [3, 5]
+
+    new1 = User.query.filter_by(email='new1@hzdr.de').one()
+    assert new1.active
+    assert UserProfile.get_by_userid(new1.id).full_name == 'New One'
+    assert UserProfile.get_by_userid(new1.id).username == 'new1'
+    # Username of an existing profile is not taken.
+    new2 = User.query.filter_by(email='new2@hzdr.de').one()
+    assert UserProfile.get_by_userid(new2.id).username is None
+    assert UserIdentity.query.filter_by(method='hzdr').count() == 3
+    assert UserIdentity.query.get(('info@hzdr.de', 'hzdr')).id_user == \
+        user.id
+
+    # Linked external ids are skipped.
+    stats = provision(read_csv(io.StringIO(CSV)), 'hzdr')
+    assert stats == dict(created=0, linked=0, existing=3, duplicate=1,
+                         invalid=1)
+
+    with pytest.raises(ValueError):
+        provision(read_csv(io.StringIO(CSV)), 'hzdr', chunk_size=0)
+
+
+def test_provision_normalize(userprofiles_app, user):
+    """Test email matching and username validation."""
+    stats = provision(read_csv(io.StringIO(
+        u"email_mapping,id_mapping,full_name_mapping\n"
+        u"Info@HZDR.de,other@hzdr.de,Existing\n"
+        u"New.User@hzdr.de,new.user@hzdr.de,New User\n"
+        u"new.user@HZDR.de,new2@hzdr.de,New User\n"
+    )), 'hzdr')
+    assert stats == dict(created=1, linked=1, existing=0, duplicate=1,
+                         invalid=0)
+    assert UserIdentity.query.get(('other@hzdr.de', 'hzdr')).id_user == \
+        user.id
+    new = User.query.filter_by(email='New.User@hzdr.de').one()
+    # "New.User" is not a valid username.
+    assert UserProfile.get_by_userid(new.id).username is None
+
+
+def test_provision_linked_user(userprofiles_app, user):
+    """Test that users linked to the remote app are not linked again."""
+    provision(read_csv(io.StringIO(CSV)), 'hzdr')
+    stats = provision(read_csv(io.StringIO(
+        u"email_mapping,id_mapping,full_name_mapping\n"
+        u"info@hzdr.de,renamed@hzdr.de,Existing\n"
+        u"new3@hzdr.de,new3@hzdr.de,New Three\n"
+    )), 'hzdr')
+    assert stats == dict(created=1, linked=0, existing=1, duplicate=0,
+                         invalid=0)
+    assert UserIdentity.query.get(('renamed@hzdr.de', 'hzdr')) is None
+    assert UserIdentity.query.filter_by(id_user=user.id).count() == 1
+
+
+def test_cli(userprofiles_app, tmpdir):
+    """Test provision command."""
+    source = tmpdir.join('users.jsonl')
+    source.write('\n'.join(json.dumps(dict(
+        email_mapping='user{0}@hzdr.de'.format(i),
+        id_mapping='user{0}'.format(i),
+        full_name_mapping='User {0}'.format(i),
+    )) for i in range(5)))
+    runner = userprofiles_app.test_cli_runner()
+    result = runner.invoke(shibboleth, ['provision', 'invalid', str(source)])
+    assert result.exit_code != 0
+
+    result = runner.invoke(shibboleth, ['provision', 'hzdr', str(source),
+                                        '--chunk-size', '2'])
+    assert result.exit_code == 0
+    assert 'Created 5 users' in result.output
+    assert User.query.filter(User.email.like('user%')).count() == 5
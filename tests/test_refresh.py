@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test refresh of the federation metadata."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import threading
+import time
+
+import pytest
+from lxml import etree
+from onelogin.saml2.errors import (OneLogin_Saml2_Error,
+                                   OneLogin_Saml2_ValidationError)
+from onelogin.saml2.metadata import OneLogin_Saml2_Metadata
+from onelogin.saml2.utils import OneLogin_Saml2_Utils
+
+from shibboleth_authenticator import ShibbolethAuthenticator
+from shibboleth_authenticator.cli import shibboleth
+from shibboleth_authenticator.federation import build_index, iter_idps
+from shibboleth_authenticator.refresh import _file_lock, verify_metadata
+from shibboleth_authenticator.signals import metadata_refreshed
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+FEDERATION = os.path.join(DATA, 'federation.xml')
+CERTS = os.path.join(DATA, 'valid', 'certs')
+IDP = 'https://idp.example.org/idp/shibboleth'
+ERRORS = (OneLogin_Saml2_Error, OneLogin_Saml2_ValidationError)
+
+
+def _read(name):
+    with open(os.path.join(CERTS, name)) as f:
+        return f.read()
+
+
+def signed(valid_until=3600, entities=None):
+    """Return the test federation metadata signed with the SP key."""
+    root = etree.parse(FEDERATION).getroot()
+    if valid_until is not None:
+        root.set('validUntil', OneLogin_Saml2_Utils.parse_time_to_SAML(
+            time.time() + valid_until))
+    if entities is not None:
+        for entity in root.iter('{*}EntityDescriptor'):
+            if entity.get('entityID') not in entities:
+                entity.getparent().remove(entity)
+    return OneLogin_Saml2_Metadata.sign_metadata(
+        etree.tostring(root), _read('sp.key'), _read('sp.crt')
+    )
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serve ``server.document`` with an ETag."""
+
+    def do_GET(self):
+        """Answer a conditional GET."""
+        self.server.requests.append(dict(self.headers))
+        etag = '"{0}"'.format(hash(self.server.document))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(self.server.status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(self.server.document)))
+        self.end_headers()
+        self.wfile.write(self.server.document)
+
+    def log_message(self, *args):
+        """Do not log requests."""
+
+
+@pytest.fixture
+def server():
+    """Local HTTP server serving metadata."""
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.document = signed()
+    server.status = 200
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def refresh_app(base_app, server, tmpdir):
+    """Application refreshing its federation index from the server."""
+    base_app.config.update(
+        SHIBBOLETH_FEDERATION_INDEX=str(tmpdir.join('federation.idx')),
+        SHIBBOLETH_FEDERATION_URL='http://127.0.0.1:{0}/metadata'.format(
+            server.server_port),
+        SHIBBOLETH_FEDERATION_CERT=os.path.join(CERTS, 'sp.crt'),
+        SHIBBOLETH_FEDERATION_REFRESH=None,
+    )
+    base_app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        fed=dict(
+            title='Federation IdP',
+            saml_path=os.path.join(DATA, 'valid'),
+            entity_id=IDP,
+        ),
+    )
+    ShibbolethAuthenticator(base_app)
+    return base_app
+
+
+def test_verify_metadata(tmpdir):
+    """Test verification of signed metadata."""
+    cert = _read('sp.crt')
+    filename = str(tmpdir.join('metadata.xml'))
+
+    def verify(document, now=None, cert=cert):
+        with open(filename, 'wb') as f:
+            f.write(document)
+        return verify_metadata(filename, cert, now=now)
+
+    assert 3500 < verify(signed()) <= 3600
+    with pytest.raises(ERRORS):
+        verify(signed(valid_until=None))
+    with pytest.raises(ERRORS):
+        verify(signed(valid_until=-60))
+    with pytest.raises(ERRORS):
+        verify(signed(), now=time.time() + 7200)
+    with open(FEDERATION, 'rb') as f:
+        with pytest.raises(ERRORS):
+            verify(f.read())
+    with pytest.raises(ERRORS):
+        verify(signed().replace(b'Example University', b'Evil University'))
+    with pytest.raises(ERRORS):
+        other = next(iter_idps(FEDERATION))['signing'][0]
+        verify(signed(), cert=OneLogin_Saml2_Utils.format_cert(other))
+    with pytest.raises(ERRORS):
+        verify(b'<md:EntitiesDescriptor')
+    with pytest.raises(ERRORS):
+        verify(b'<foo/>')
+
+
+def test_refresh(refresh_app, server):
+    """Test conditional refresh and swap of the federation index."""
+    ext = refresh_app.extensions['shibboleth-authenticator']
+    refresher = ext.metadata_refresher
+    sent = []
+
+    def receiver(app, **kwargs):
+        sent.append(kwargs)
+
+    with metadata_refreshed.connected_to(receiver):
+        assert refresher.refresh() == 'updated'
+        assert len(ext.federation_index) == 2
+        assert 'fed' in ext.settings_cache
+        assert 'If-None-Match' not in server.requests[-1]
+
+        assert refresher.refresh() == 'not_modified'
+        assert 'If-None-Match' in server.requests[-1]
+
+        # Failures keep the previous index
+        stamp = ext.federation_index.stamp()
+        server.document = signed().replace(b'Example', b'Evil')
+        assert refresher.refresh() == 'failed'
+        server.document = signed(entities=['https://idp.example.com/'
+                                           'idp/shibboleth'])
+        assert refresher.refresh() == 'failed'
+        assert 'missing' in refresher.last_error
+        server.status = 500
+        server.document = signed(valid_until=7200)
+        assert refresher.refresh() == 'failed'
+        assert ext.federation_index.stamp() == stamp
+        assert ext.federation_index.get(IDP)
+        assert sorted(os.listdir(os.path.dirname(
+            ext.federation_index.filename))) == [
+                'federation.idx', 'federation.idx.lock']
+
+        server.status = 200
+        assert refresher.refresh() == 'updated'
+        assert ext.federation_index.stamp() != stamp
+
+    assert [s['status'] for s in sent] == [
+        'updated', 'not_modified', 'failed', 'failed', 'failed', 'updated'
+    ]
+    assert sent[0]['count'] == 2
+    assert isinstance(sent[2]['error'], ERRORS)
+    info = refresher.info()
+    assert info['refreshes'] == 2
+    assert info['not_modified'] == 1
+    assert info['failures'] == 3
+    assert info['last_error'] is None
+
+
+def test_refresh_busy(refresh_app, server):
+    """Test that a refresh is skipped while another process refreshes."""
+    refresher = refresh_app.extensions['shibboleth-authenticator'] \
+        .metadata_refresher
+    with _file_lock(refresher.index.filename + '.lock') as locked:
+        assert locked
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if refresher.refresh() == 'busy' else 1)
+        assert os.waitpid(pid, 0)[1] == 0
+    assert not server.requests
+    assert refresher.refresh() == 'updated'
+
+
+def test_background_refresh(refresh_app, server):
+    """Test refresh by the background thread."""
+    ext = refresh_app.extensions['shibboleth-authenticator']
+    refresher = ext.metadata_refresher
+    refresher.interval = 3600
+    build_index(FEDERATION, ext.federation_index.filename)
+
+    # A fresh index is not fetched again right away
+    refresher.start()
+    time.sleep(0.2)
+    assert not server.requests
+    refresher.stop()
+
+    os.remove(ext.federation_index.filename)
+    refresher.start()
+    for _ in range(50):
+        if refresher.refreshes:
+            break
+        time.sleep(0.1)
+    refresher.stop()
+    assert refresher.refreshes == 1
+    assert len(ext.federation_index) == 2
+
+
+def test_create(base_app):
+    """Test configuration of the refresher."""
+    ext = ShibbolethAuthenticator(base_app)
+    assert ext.metadata_refresher is None
+
+    base_app.config['SHIBBOLETH_FEDERATION_URL'] = 'http://localhost/'
+    with pytest.raises(ValueError):
+        ShibbolethAuthenticator(base_app)
+    base_app.config['SHIBBOLETH_FEDERATION_INDEX'] = 'federation.idx'
+    with pytest.raises(ValueError):
+        ShibbolethAuthenticator(base_app)
+
+
+def test_cli(refresh_app, base_app, server):
+    """Test refresh command."""
+    runner = refresh_app.test_cli_runner()
+    result = runner.invoke(shibboleth, ['refresh'])
+    assert result.exit_code == 0
+    assert 'updated' in result.output
+
+    server.status = 500
+    server.document = b'<foo/>'
+    result = runner.invoke(shibboleth, ['refresh'])
+    assert result.exit_code != 0
+    assert 'keeping the previous index' in result.output
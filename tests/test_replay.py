@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test assertion replay cache."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import time
+
+import mock
+import pytest
+from flask import url_for
+
+from shibboleth_authenticator.replay import (MemoryReplayCache,
+                                             RedisReplayCache,
+                                             create_replay_cache)
+from shibboleth_authenticator.views import is_replayed
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_memory_replay_cache():
+    """Test in-process replay cache."""
+    cache = MemoryReplayCache(maxsize=2)
+    assert cache.add('idp', 'a', 60)
+    assert not cache.add('idp', 'a', 60)
+    assert cache.add('other', 'a', 60)
+
+    # Oldest entry is evicted when the cache is full.
+    assert cache.add('idp', 'b', 60)
+    assert len(cache) == 2
+    assert cache.add('idp', 'a', 60)
+
+    # Expired entries are dropped.
+    with mock.patch('shibboleth_authenticator.replay.time.time',
+                    return_value=time.time() + 120):
+        assert cache.add('idp', 'b', 60)
+        assert len(cache) == 1
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_redis_replay_cache(app):
+    """Test Redis replay cache."""
+    cache = RedisReplayCache(app.config['ACCOUNTS_SESSION_REDIS_URL'],
+                             prefix='shibboleth:test:replay:')
+    cache.clear()
+    assert cache.add('idp', 'a', 60)
+    assert not cache.add('idp', 'a', 60)
+    assert cache.add('other', 'a', 60)
+    assert 0 < cache.client.ttl('shibboleth:test:replay:idp:a') <= 60
+    cache.clear()
+    assert cache.add('idp', 'a', 0.2)
+    cache.clear()
+
+
+def test_create_replay_cache(app):
+    """Test creation of the configured backend."""
+    app.config['SHIBBOLETH_REPLAY_CACHE'] = 'memory'
+    assert isinstance(create_replay_cache(app), MemoryReplayCache)
+    app.config['SHIBBOLETH_REPLAY_CACHE'] = 'redis'
+    assert isinstance(create_replay_cache(app), RedisReplayCache)
+    app.config['SHIBBOLETH_REPLAY_CACHE'] = None
+    assert create_replay_cache(app) is None
+    app.config['SHIBBOLETH_REPLAY_CACHE'] = 'invalid'
+    with pytest.raises(ValueError):
+        create_replay_cache(app)
+
+
+@mock.patch('shibboleth_authenticator.handlers.oauth_get_user')
+def test_authorized_replay(mock_get_user, views_fixture):
+    """Test that replayed responses are rejected before the handler."""
+    app = views_fixture
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(DATA, 'settings'),
+                mappings=dict(
+                    email='mail',
+                    full_name='sn',
+                    user_unique_id='uid',
+                )
+            )
+        )
+    )
+    app.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
+    mock_get_user.return_value = None
+    ext = app.extensions['shibboleth-authenticator']
+    ext.replay_cache = MemoryReplayCache()
+    with open(os.path.join(DATA, 'valid.xml.base64')) as f:
+        response = f.read()
+
+    # python3-saml only reports NotOnOrAfter in strict mode.
+    with mock.patch(
+        'onelogin.saml2.auth.OneLogin_Saml2_Auth.'
+        'get_last_assertion_not_on_or_after',
+        return_value=int(time.time()) + 60,
+    ), app.test_client() as client:
+        url = url_for('shibboleth_authenticator.authorized',
+                      remote_app='idp')
+        resp = client.post(url, data=dict(SAMLResponse=response))
+        assert resp.status_code == 302
+        assert mock_get_user.call_count == 1
+
+        resp = client.post(url, data=dict(SAMLResponse=response))
+        assert resp.status_code == 403
+        assert mock_get_user.call_count == 1
+
+    # Assertions without NotOnOrAfter are tracked as well.
+    ext.replay_cache.clear()
+    with app.test_client() as client:
+        resp = client.post(url, data=dict(SAMLResponse=response))
+        assert resp.status_code == 302
+        calls = mock_get_user.call_count
+        resp = client.post(url, data=dict(SAMLResponse=response))
+        assert resp.status_code == 403
+        assert mock_get_user.call_count == calls
+
+
+def test_replay_ttl(app):
+    """Test the lifetime of assertions without NotOnOrAfter."""
+    auth = mock.Mock()
+    auth.get_last_assertion_id.return_value = 'a'
+    auth.get_last_assertion_not_on_or_after.return_value = None
+    ext = app.extensions['shibboleth-authenticator']
+    ext.replay_cache = mock.Mock()
+    ext.replay_cache.add.return_value = True
+    with app.app_context():
+        assert not is_replayed(auth, 'idp')
+        ext.replay_cache.add.assert_called_with(
+            'idp', 'a', app.permanent_session_lifetime.total_seconds()
+        )
+        app.config['SHIBBOLETH_REPLAY_TTL'] = 60
+        ext.replay_cache.add.return_value = False
+        assert is_replayed(auth, 'idp')
+        ext.replay_cache.add.assert_called_with('idp', 'a', 60)
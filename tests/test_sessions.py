@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test single logout and the session index."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import time
+
+import mock
+import pytest
+from flask import make_response, session, url_for
+from flask_login import current_user
+from onelogin.saml2.logout_request import OneLogin_Saml2_Logout_Request
+from onelogin.saml2.logout_response import OneLogin_Saml2_Logout_Response
+from onelogin.saml2.settings import OneLogin_Saml2_Settings
+
+from shibboleth_authenticator.sessions import (RedisSessionIndex,
+                                               create_session_index)
+from shibboleth_authenticator.views import (LOGOUT_REQUEST_KEY, SESSION_KEY,
+                                            index_session)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+NAMEID = '492882615acf31c8096b627245d76ae53036c090'
+SESSION_INDEX = '_6273d77b8cde0c333ec79d22a9fa0003b9fe2d75cb'
+
+
+def test_redis_session_index(app):
+    """Test Redis session index."""
+    index = RedisSessionIndex(app.config['ACCOUNTS_SESSION_REDIS_URL'],
+                              prefix='shibboleth:test:sessions:')
+    index.clear()
+    index.add('idp', 'alice', 's1', 'a', 60)
+    index.add('idp', 'alice', 's2', 'b', 60)
+    index.add('idp', 'alice', None, 'd', 60)
+    index.add('idp', 'bob', 's1', 'c', 60)
+    assert 0 < index.client.ttl('shibboleth:test:sessions:idp:alice') <= 60
+    assert index.pop('idp', 'alice', ['s2', 's3']) == ['b']
+    assert index.pop('idp', 'alice', ['s2']) == []
+    assert sorted(index.pop('idp', 'alice')) == ['a', 'd']
+    assert not index.client.exists('shibboleth:test:sessions:idp:alice')
+    with mock.patch('shibboleth_authenticator.sessions.time.time',
+                    return_value=time.time() + 120):
+        assert index.pop('idp', 'bob', ['s1']) == []
+    index.clear()
+
+
+def test_create_session_index(app):
+    """Test creation of the configured backend."""
+    assert create_session_index(app) is None
+    app.config['SHIBBOLETH_SESSION_INDEX'] = 'redis'
+    assert isinstance(create_session_index(app), RedisSessionIndex)
+    for backend in ('memory', 'invalid'):
+        app.config['SHIBBOLETH_SESSION_INDEX'] = backend
+        with pytest.raises(ValueError):
+            create_session_index(app)
+
+
+@pytest.fixture
+def slo_app(views_fixture):
+    """Application with a remote application supporting single logout."""
+    views_fixture.config['SHIBBOLETH_REMOTE_APPS'].update(
+        idp=dict(
+            title='Test identity provider',
+            saml_path=os.path.join(DATA, 'settings'),
+            mappings=dict(
+                email='mail',
+                full_name='sn',
+                user_unique_id='uid',
+            ),
+        ),
+    )
+    views_fixture.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
+    ext = views_fixture.extensions['shibboleth-authenticator']
+    index = RedisSessionIndex(
+        views_fixture.config['ACCOUNTS_SESSION_REDIS_URL'],
+        prefix='shibboleth:test:sessions:',
+    )
+    index.clear()
+    ext.session_index = index
+    yield views_fixture
+    index.clear()
+
+
+def _indexed(ext):
+    index = ext.session_index
+    return index.client.hlen(index._key('idp', NAMEID))
+
+
+def _settings():
+    return OneLogin_Saml2_Settings(
+        custom_base_path=os.path.join(DATA, 'settings')
+    )
+
+
+def _login(client):
+    with open(os.path.join(DATA, 'valid.xml.base64')) as f:
+        resp = client.post(
+            url_for('shibboleth_authenticator.authorized', remote_app='idp'),
+            data=dict(SAMLResponse=f.read())
+        )
+    assert resp.status_code == 302
+    assert current_user.is_authenticated
+    return client.cookie_jar
+
+
+def _logout_request(session_index=SESSION_INDEX):
+    request = OneLogin_Saml2_Logout_Request(
+        _settings(), name_id=NAMEID, session_index=session_index
+    )
+    return request.get_request()
+
+
+def test_index_renewal(slo_app):
+    """Test that index entries are renewed with their session."""
+    index = slo_app.extensions['shibboleth-authenticator'].session_index
+    key = index._key('idp', NAMEID)
+    cookie = slo_app.config['SESSION_COOKIE_NAME']
+    with slo_app.test_request_context():
+        session[SESSION_KEY] = dict(remote_app='idp', nameid=NAMEID,
+                                    session_index=SESSION_INDEX)
+        session.sid_s = 'sid'
+        index.add('idp', NAMEID, SESSION_INDEX, 'sid', 1)
+
+        # Sessions that are not saved are not renewed.
+        index_session(slo_app, make_response(''))
+        assert index.client.ttl(key) <= 1
+
+        response = make_response('')
+        response.set_cookie(cookie, 'value')
+        index_session(slo_app, response)
+        ttl = slo_app.permanent_session_lifetime.total_seconds()
+        assert index.client.ttl(key) > ttl - 5
+        with mock.patch('shibboleth_authenticator.sessions.time.time',
+                        return_value=time.time() + 60):
+            assert index.pop('idp', NAMEID) == ['sid']
+
+
+def test_idp_logout(slo_app):
+    """Test that a logout request of the IdP ends all sessions."""
+    ext = slo_app.extensions['shibboleth-authenticator']
+    store = slo_app.kvsession_store
+    sls_url = url_for('shibboleth_authenticator.sls', remote_app='idp')
+    sids = []
+    for _ in range(2):
+        with slo_app.test_client() as client:
+            _login(client)
+            sids.append(session.sid_s)
+            assert session[SESSION_KEY]['nameid'] == NAMEID
+            assert session[SESSION_KEY]['session_index'] == SESSION_INDEX
+    assert _indexed(ext) == 2
+    assert all(store.get(sid) for sid in sids)
+
+    # Another session index does not match
+    with slo_app.test_client() as client:
+        resp = client.get(sls_url, query_string=dict(
+            SAMLRequest=_logout_request('_other')))
+        assert resp.status_code == 302
+    assert _indexed(ext) == 2
+
+    # The logout request may come from any browser
+    with slo_app.test_client() as client:
+        resp = client.get(sls_url, query_string=dict(
+            SAMLRequest=_logout_request(), RelayState='/relay'))
+        assert resp.status_code == 302
+        location = resp.headers['Location']
+        assert location.startswith(
+            'http://idp.example.com/SingleLogoutService.php?SAMLResponse=')
+        assert 'RelayState=%2Frelay' in location
+    assert _indexed(ext) == 0
+    for sid in sids:
+        with pytest.raises(KeyError):
+            store.get(sid)
+
+    # The browser of the user is logged out as well
+    with slo_app.test_client() as client:
+        _login(client)
+        resp = client.get(sls_url, query_string=dict(
+            SAMLRequest=_logout_request(None)))
+        assert resp.status_code == 302
+        assert not current_user.is_authenticated
+
+    with slo_app.test_client() as client:
+        resp = client.get(sls_url, query_string=dict(SAMLRequest='invalid'))
+        assert resp.status_code == 400
+        resp = client.get(sls_url)
+        assert resp.status_code == 400
+
+
+def test_sp_logout(slo_app):
+    """Test logout started by the user."""
+    logout_url = url_for('shibboleth_authenticator.logout', remote_app='idp',
+                         next='/done')
+    sls_url = url_for('shibboleth_authenticator.sls', remote_app='idp')
+    ext = slo_app.extensions['shibboleth-authenticator']
+    with slo_app.test_client() as client:
+        _login(client)
+        resp = client.get(logout_url)
+        assert resp.status_code == 302
+        assert resp.headers['Location'].startswith(
+            'http://idp.example.com/SingleLogoutService.php?SAMLRequest=')
+        assert not current_user.is_authenticated
+        assert _indexed(ext) == 0
+
+        request_id = session[LOGOUT_REQUEST_KEY]
+        response = OneLogin_Saml2_Logout_Response(_settings())
+        response.build(request_id)
+        resp = client.get(sls_url, query_string=dict(
+            SAMLResponse=response.get_response(), RelayState='/done'))
+        assert resp.status_code == 302
+        assert resp.headers['Location'].endswith('/done')
+        assert LOGOUT_REQUEST_KEY not in session
+
+        # Users without a SAML session are only logged out locally
+        resp = client.get(logout_url)
+        assert resp.status_code == 302
+        assert resp.headers['Location'].endswith('/done')
+
+    # IdPs without single logout
+    with slo_app.test_client() as client:
+        _login(client)
+        with mock.patch(
+                'onelogin.saml2.auth.OneLogin_Saml2_Auth.get_slo_url',
+                return_value=None):
+            resp = client.get(logout_url)
+        assert resp.status_code == 302
+        assert resp.headers['Location'].endswith('/done')
+        assert not current_user.is_authenticated
+
+
+def test_no_session_index(slo_app):
+    """Test logout without a session index."""
+    slo_app.extensions['shibboleth-authenticator'].session_index = None
+    sls_url = url_for('shibboleth_authenticator.sls', remote_app='idp')
+    with slo_app.test_client() as client:
+        _login(client)
+    with slo_app.test_client() as client:
+        resp = client.get(sls_url, query_string=dict(
+            SAMLRequest=_logout_request()))
+        assert resp.status_code == 302
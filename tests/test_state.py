@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test state token serializers."""
+
+from __future__ import absolute_import, print_function
+
+import time
+
+import mock
+import pytest
+from flask import url_for
+from itsdangerous import BadData, SignatureExpired
+
+from helpers import authorized_valid_config, load_file
+from shibboleth_authenticator.state import (CompactStateSerializer,
+                                            JSONWebStateSerializer,
+                                            MemoryStateStore, RedisStateStore,
+                                            StoredStateSerializer,
+                                            create_state_serializer)
+
+STATE = dict(app='idp', next=u'/deposit/new?c=r\xf6dare', sid='a' * 128)
+
+
+@pytest.mark.parametrize('cls', [JSONWebStateSerializer,
+                                 CompactStateSerializer])
+def test_serializer(cls):
+    """Test round trip, tampering, expiry and key rotation."""
+    serializer = cls(['new', 'old'], 300)
+    token = serializer.dumps(STATE)
+    state = serializer.loads(token)
+    assert state['app'] == 'idp'
+    assert state['next'] == STATE['next']
+    assert state['sid'] == serializer.sid(STATE['sid'])
+    assert state['sid'] != serializer.sid('b' * 128)
+
+    # Tokens signed with an old key are accepted.
+    assert serializer.loads(cls(['old'], 300).dumps(STATE)) == state
+    with pytest.raises(BadData):
+        cls(['old'], 300).loads(token)
+
+    for invalid in ('', 'x', token[:-2], token[:10] + 'A' + token[11:]):
+        with pytest.raises(BadData):
+            serializer.loads(invalid)
+
+    with mock.patch('time.time', return_value=time.time() + 600):
+        with pytest.raises(SignatureExpired):
+            serializer.loads(token)
+
+
+def test_compact_size():
+    """Test that compact tokens fit into RelayState."""
+    serializer = CompactStateSerializer(['key'], 300)
+    assert len(serializer.dumps(dict(STATE, next='/'))) <= 80
+    assert len(serializer.dumps(STATE)) < \
+        len(JSONWebStateSerializer(['key'], 300).dumps(STATE)) / 3
+
+
+def test_memory_state_store():
+    """Test in-process state store."""
+    store = MemoryStateStore(60, maxsize=2)
+    store.put('a', STATE)
+    assert store.pop('a') == STATE
+    assert store.pop('a') is None
+
+    store.put('a', STATE)
+    store.put('b', STATE)
+    store.put('c', STATE)
+    assert len(store) == 2
+    assert store.pop('a') is None
+
+    with mock.patch('time.time', return_value=time.time() + 120):
+        assert store.pop('b') is None
+        store.put('d', STATE)
+        assert len(store) == 1
+
+
+def test_redis_state_store(app):
+    """Test Redis state store."""
+    store = RedisStateStore(app.config['ACCOUNTS_SESSION_REDIS_URL'], 60,
+                            prefix='shibboleth:test:state:')
+    store.put('a', STATE)
+    assert 0 < store.client.ttl('shibboleth:test:state:a') <= 60
+    assert store.pop('a') == STATE
+    assert store.pop('a') is None
+
+
+def test_stored_state_serializer():
+    """Test that stored states are single-use."""
+    serializer = StoredStateSerializer(MemoryStateStore(60))
+    token = serializer.dumps(STATE)
+    assert len(token) == 22
+    assert token != serializer.dumps(STATE)
+    assert serializer.loads(token) == STATE
+    for invalid in (token, '', 'unknown'):
+        with pytest.raises(BadData):
+            serializer.loads(invalid)
+
+
+def test_create_state_serializer(app):
+    """Test creation of the configured serializer."""
+    assert isinstance(create_state_serializer(app), JSONWebStateSerializer)
+    app.config['SHIBBOLETH_STATE_FORMAT'] = 'compact'
+    assert isinstance(create_state_serializer(app), CompactStateSerializer)
+    app.config['SHIBBOLETH_STATE_FORMAT'] = 'invalid'
+    with pytest.raises(ValueError):
+        create_state_serializer(app)
+
+    app.config['SHIBBOLETH_STATE_FORMAT'] = 'jws'
+    app.config['SHIBBOLETH_STATE_STORE'] = 'memory'
+    serializer = create_state_serializer(app)
+    assert isinstance(serializer.store, MemoryStateStore)
+    app.config['SHIBBOLETH_STATE_STORE'] = 'redis'
+    serializer = create_state_serializer(app)
+    assert isinstance(serializer.store, RedisStateStore)
+    app.config['SHIBBOLETH_STATE_STORE'] = 'invalid'
+    with pytest.raises(ValueError):
+        create_state_serializer(app)
+
+    app.config['SHIBBOLETH_STATE_STORE'] = None
+    ext = app.extensions['shibboleth-authenticator']
+    assert ext.state_serializer is ext.state_serializer
+
+
+@pytest.mark.parametrize('config', [
+    dict(SHIBBOLETH_STATE_FORMAT='compact'),
+    dict(SHIBBOLETH_STATE_STORE='memory'),
+])
+def test_login_state(views_fixture, config):
+    """Test login with compact and stored state tokens."""
+    from shibboleth_authenticator._compat import _create_identifier
+    from shibboleth_authenticator.views import serializer
+
+    app = views_fixture
+    app.config.update(config)
+    authorized_valid_config(app)
+    with app.test_client() as client:
+        resp = client.get(
+            url_for('shibboleth_authenticator.login', remote_app='idp',
+                    next='/next')
+        )
+        assert resp.status_code == 302
+        relay_state = resp.headers['Location'].split('RelayState=')[1]
+        assert len(relay_state) <= 80
+        assert serializer.loads(relay_state)['next'] == '/next'
+
+        url = url_for('shibboleth_authenticator.authorized', remote_app='idp')
+        token = serializer.dumps(dict(app='idp', next='/next',
+                                      sid=_create_identifier()))
+        resp = client.post(url, data=dict(
+            SAMLResponse=load_file('valid.xml.base64'), RelayState=token
+        ))
+        assert resp.status_code == 302
+        assert resp.headers['Location'].endswith('/next')
+
+        # State tokens of a store can only be used once.
+        if 'SHIBBOLETH_STATE_STORE' in config:
+            resp = client.post(url, data=dict(
+                SAMLResponse=load_file('valid.xml.base64'),
+                RelayState=token,
+            ))
+            assert resp.status_code == 400
+
+        token = serializer.dumps(dict(app='idp', next='/next',
+                                      sid=STATE['sid']))
+        resp = client.post(url, data=dict(
+            SAMLResponse=load_file('valid.xml.base64'), RelayState=token
+        ))
+        assert resp.status_code == 400
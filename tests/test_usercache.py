@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test resolved user cache."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import time
+
+import mock
+import pytest
+from flask import url_for
+from flask_login import current_user
+from invenio_db import db
+from invenio_oauthclient.models import UserIdentity
+
+from shibboleth_authenticator.usercache import (MemoryUserCache,
+                                                RedisUserCache,
+                                                create_user_cache)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_memory_user_cache():
+    """Test in-process user cache."""
+    cache = MemoryUserCache(ttl=60, maxsize=2)
+    assert cache.get('idp', 'a') is None
+    cache.set('idp', 'a', 1)
+    cache.set('idp', 'b', 2)
+    assert cache.get('idp', 'a') == 1
+    cache.set('idp', 'c', 3)
+    assert len(cache) == 2
+    assert cache.get('idp', 'a') is None
+    cache.invalidate('idp', 'b')
+    assert cache.get('idp', 'b') is None
+
+    with mock.patch('shibboleth_authenticator.usercache.time.time',
+                    return_value=time.time() + 120):
+        assert cache.get('idp', 'c') is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_redis_user_cache(app):
+    """Test Redis user cache."""
+    cache = RedisUserCache(app.config['ACCOUNTS_SESSION_REDIS_URL'],
+                           prefix='shibboleth:test:user:')
+    cache.clear()
+    assert cache.get('idp', 'a') is None
+    cache.set('idp', 'a', 1)
+    assert cache.get('idp', 'a') == 1
+    assert 0 < cache.client.ttl('shibboleth:test:user:idp:a') <= 300
+    cache.invalidate('idp', 'a')
+    assert cache.get('idp', 'a') is None
+    cache.clear()
+
+
+def test_create_user_cache(app):
+    """Test creation of the configured backend."""
+    assert create_user_cache(app) is None
+    app.config['SHIBBOLETH_USER_CACHE'] = 'memory'
+    assert isinstance(create_user_cache(app), MemoryUserCache)
+    app.config['SHIBBOLETH_USER_CACHE'] = 'redis'
+    assert isinstance(create_user_cache(app), RedisUserCache)
+    app.config['SHIBBOLETH_USER_CACHE'] = 'invalid'
+    with pytest.raises(ValueError):
+        create_user_cache(app)
+
+
+def test_authorized_user_cache(base_app):
+    """Test login of cached users and invalidation."""
+    from shibboleth_authenticator import ShibbolethAuthenticator, handlers
+    from shibboleth_authenticator.views import blueprint
+
+    app = base_app
+    app.config.update(
+        SHIBBOLETH_USER_CACHE='memory',
+        OAUTHCLIENT_SESSION_KEY_PREFIX='prefix',
+    )
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(DATA, 'settings'),
+                mappings=dict(
+                    email='mail',
+                    full_name='sn',
+                    user_unique_id='uid',
+                )
+            )
+        )
+    )
+    ShibbolethAuthenticator(app)
+    app.register_blueprint(blueprint)
+    cache = app.extensions['shibboleth-authenticator'].user_cache
+
+    url = url_for('shibboleth_authenticator.authorized', remote_app='idp')
+    with open(os.path.join(DATA, 'valid.xml.base64')) as f:
+        data = dict(SAMLResponse=f.read())
+
+    def login():
+        with app.test_client() as client:
+            resp = client.post(url, data=data)
+            assert resp.status_code == 302
+            assert current_user.is_authenticated
+            return current_user.id
+
+    user_id = login()
+    identity = UserIdentity.query.one()
+    assert cache.get('idp', identity.id) == user_id
+
+    with mock.patch.object(handlers, 'get_linked_user') as linked:
+        assert login() == user_id
+        assert not linked.called
+
+    # Entries are kept when the unlinking is rolled back.
+    db.session.delete(identity)
+    db.session.flush()
+    assert cache.get('idp', identity.id) == user_id
+    db.session.rollback()
+    assert cache.get('idp', identity.id) == user_id
+    db.session.commit()
+    assert cache.get('idp', identity.id) == user_id
+
+    # Unlinking drops the entry once it is committed.
+    identity = UserIdentity.query.one()
+    db.session.delete(identity)
+    db.session.flush()
+    assert cache.get('idp', identity.id) == user_id
+    db.session.commit()
+    assert cache.get('idp', identity.id) is None
+    assert login() == user_id
+    assert cache.get('idp', identity.id) == user_id
+
+    # Entries of deleted users are dropped on lookup.
+    cache.set('idp', identity.id, user_id + 100)
+    assert login() == user_id
+    assert cache.get('idp', identity.id) == user_id
@@ -24,7 +24,8 @@ import pytest
 from invenio_oauthclient.utils import fill_form
 
 from helpers import check_csrf_disabled
-from shibboleth_authenticator.utils import (get_account_info,
+from shibboleth_authenticator.utils import (AllowedHosts, get_account_info,
+                                            get_allowed_hosts,
                                             get_safe_redirect_target)
 
 
@@ -62,3 +63,63 @@ def test_get_safe_rediect_target(mock_request, app):
 
     mock_request.args.get.return_value = None
     assert not get_safe_redirect_target()
+
+    # Encoded paths are kept
+    mock_request.args.get.return_value = '/a%20b?c%26d'
+    assert get_safe_redirect_target() == '/a%20b?c%26d'
+
+    # Paths with special characters are parsed
+    mock_request.args.get.return_value = '/a%20b?c#d'
+    assert get_safe_redirect_target() == '/a%20b?c'
+
+    mock_request.args.get.return_value = u'/a b%2?c\xe4'
+    assert get_safe_redirect_target() == '/a%20b%252?c%C3%A4'
+
+    mock_request.args.get.return_value = 'https://fzr.de//evil.org/path'
+    assert get_safe_redirect_target() == '/evil.org/path'
+
+    mock_request.args.get.return_value = '//fzr.de/path'
+    assert get_safe_redirect_target() == '/path'
+
+    mock_request.args.get.return_value = '/\\fzr.de/path'
+    assert get_safe_redirect_target() == '/%5Cfzr.de/path'
+
+    # Wildcard subdomains
+    app.config['APP_ALLOWED_HOSTS'] = ['*.hzdr.de']
+    mock_request.args.get.return_value = 'https://www.HZDR.de/path'
+    assert get_safe_redirect_target() == 'https://www.HZDR.de/path'
+    mock_request.args.get.return_value = url2
+    assert get_safe_redirect_target() == '/path/subpath?parameter=test'
+
+    # Referrer is used without next parameter
+    mock_request.args.get.return_value = None
+    mock_request.referrer = 'https://rodare.hzdr.de/records/1'
+    assert get_safe_redirect_target() == mock_request.referrer
+
+
+def test_allowed_hosts(app):
+    """Test compiled allowed hosts."""
+    hosts = AllowedHosts(['hzdr.de', '*.example.org', '.Example.com.'])
+    assert 'hzdr.de' in hosts
+    assert 'HZDR.DE.' in hosts
+    assert 'www.hzdr.de' not in hosts
+    assert 'example.org' not in hosts
+    assert 'www.example.org' in hosts
+    assert 'a.b.example.org' in hosts
+    assert 'badexample.org' not in hosts
+    assert 'example.com' in hosts
+    assert 'www.example.com' in hosts
+    assert 'example.com.evil.org' not in hosts
+    assert None not in hosts
+    assert '' not in hosts
+
+    assert 'hzdr.de' not in AllowedHosts(None)
+    assert 'hzdr.de' in AllowedHosts(['*'])
+
+    # Recompiled when the configuration is replaced
+    with app.app_context():
+        allowed_hosts = get_allowed_hosts()
+        assert get_allowed_hosts() is allowed_hosts
+        app.config['APP_ALLOWED_HOSTS'] = ['hzdr.de']
+        assert get_allowed_hosts() is not allowed_hosts
+        assert 'hzdr.de' in get_allowed_hosts()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test verification of SAML responses in worker processes."""
+
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import threading
+
+import mock
+import pytest
+from flask import url_for
+from flask_login import current_user
+
+from shibboleth_authenticator.verify import (VerifiedResponse, VerifyPool,
+                                             create_verify_pool, init_worker,
+                                             verify_response)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+SETTINGS = os.path.join(DATA, 'settings')
+
+
+def _load_file(filename):
+    with open(os.path.join(DATA, filename)) as f:
+        return f.read()
+
+
+def _req(filename):
+    return {
+        'https': 'off',
+        'http_host': 'localhost.localdomain',
+        'server_port': None,
+        'script_name': '/shibboleth/authorized/idp',
+        'get_data': {},
+        'post_data': {'SAMLResponse': _load_file(filename)},
+    }
+
+
+@pytest.fixture
+def pool():
+    """Verification pool with a single worker."""
+    pool = VerifyPool(1, maxsize=1, timeout=30, remote_apps=dict(
+        idp=dict(saml_path=SETTINGS),
+        broken=dict(saml_path=os.path.join(DATA, 'missing')),
+        unused=dict(title='No saml_path'),
+    ))
+    yield pool
+    pool.close()
+
+
+def test_verify_response():
+    """Test processing of a response in a worker."""
+    init_worker(dict(idp=(SETTINGS, None)))
+    status, response = verify_response('idp', SETTINGS, None,
+                                       _req('valid.xml.base64'))
+    assert status == 'verified'
+    assert isinstance(response, VerifiedResponse)
+    assert response.is_authenticated()
+    assert not response.get_errors()
+    assert response.get_nameid()
+    assert response.get_last_assertion_id()
+    assert response.get_attributes()['mail'] == ['smartin@yaco.es']
+
+    status, response = verify_response('idp', SETTINGS, None,
+                                       _req('expired.xml.base64'))
+    assert status == 'verified'
+    assert not response.is_authenticated()
+    assert response.get_errors()
+    assert response.get_last_error_reason()
+
+    req = _req('valid.xml.base64')
+    del req['post_data']['SAMLResponse']
+    status, message = verify_response('idp', SETTINGS, None, req)
+    assert status == 'invalid'
+
+    status, message = verify_response(
+        'missing', os.path.join(DATA, 'missing'), None, req
+    )
+    assert status == 'failed'
+
+
+def test_pool(pool):
+    """Test verification in a worker process."""
+    assert set(pool.remote_apps) == set(['idp', 'broken'])
+    conf = dict(saml_path=SETTINGS)
+    response = pool.verify('idp', conf, _req('valid.xml.base64'))
+    assert response.is_authenticated()
+    assert pool.info()['verified'] == 1
+
+    # Failures are left to the request
+    assert pool.verify(
+        'broken', dict(saml_path=os.path.join(DATA, 'missing')),
+        _req('valid.xml.base64')
+    ) is None
+    assert pool.info()['failed'] == 1
+    assert pool.verify('idp', conf, dict(_req('valid.xml.base64'), post_data={
+        'SAMLResponse': 'PGZvbz4=',
+    })) is None
+    assert pool.info()['failed'] == 2
+
+
+def _raise(*args):
+    raise RuntimeError('Worker failed.')
+
+
+@pytest.mark.skipif(sys.version_info[0] < 3,
+                    reason='Requires error callbacks of Python 3.')
+def test_pool_error(pool):
+    """Test that failing tasks release their slot."""
+    conf = dict(saml_path=SETTINGS)
+    with mock.patch('shibboleth_authenticator.verify.verify_response',
+                    _raise):
+        assert pool.verify('idp', conf, _req('valid.xml.base64')) is None
+    assert pool.info()['failed'] == 1
+    assert pool._slots.acquire(False)
+    pool._slots.release()
+
+
+def test_pool_saturated(pool):
+    """Test fallback if the pool is saturated."""
+    conf = dict(saml_path=SETTINGS)
+    assert pool._slots.acquire(False)
+    try:
+        assert pool.verify('idp', conf, _req('valid.xml.base64')) is None
+        assert pool.info()['saturated'] == 1
+    finally:
+        pool._slots.release()
+
+    # Slots are released by finished verifications after a timeout
+    done = threading.Event()
+    pool.timeout = 0
+    release = pool._release
+
+    def _release(result=None):
+        release(result)
+        done.set()
+
+    pool._release = _release
+    assert pool.verify('idp', conf, _req('valid.xml.base64')) is None
+    assert pool.info()['saturated'] == 1
+    assert pool.info()['timeouts'] == 1
+    assert done.wait(30)
+    pool.timeout = 30
+    assert pool.verify('idp', conf, _req('valid.xml.base64'))
+
+
+def test_create_verify_pool(app):
+    """Test creation of the configured pool."""
+    assert app.extensions['shibboleth-authenticator'].verify_pool is None
+    app.config['SHIBBOLETH_VERIFY_PROCESSES'] = 2
+    pool = create_verify_pool(app)
+    assert pool.info()['maxsize'] == 4
+    app.config['SHIBBOLETH_VERIFY_QUEUE_SIZE'] = 1
+    assert create_verify_pool(app).maxsize == 1
+
+
+def test_authorized(views_fixture, pool):
+    """Test authorized view with a verification pool."""
+    app = views_fixture
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(dict(
+        idp=dict(
+            title='Test identity provider',
+            saml_path=SETTINGS,
+            mappings=dict(
+                email='mail',
+                full_name='sn',
+                user_unique_id='uid',
+            ),
+        )
+    ))
+    app.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
+    ext = app.extensions['shibboleth-authenticator']
+    ext.verify_pool = pool
+    try:
+        with app.test_client() as client:
+            with mock.patch('shibboleth_authenticator.views.init_saml_auth') \
+                    as init_saml_auth:
+                resp = client.post(
+                    url_for('shibboleth_authenticator.authorized',
+                            remote_app='idp'),
+                    data=dict(SAMLResponse=_load_file('valid.xml.base64'))
+                )
+                assert not init_saml_auth.called
+            assert resp.status_code == 302
+            assert current_user.email == 'smartin@yaco.es'
+            assert pool.info()['verified'] == 1
+
+            resp = client.post(
+                url_for('shibboleth_authenticator.authorized',
+                        remote_app='idp'),
+                data=dict(SAMLResponse=_load_file('expired.xml.base64'))
+            )
+            assert resp.status_code == 403
+
+            resp = client.post(
+                url_for('shibboleth_authenticator.authorized',
+                        remote_app='idp'),
+                data=dict(SAMLResponse='PGZvbz4=')
+            )
+            assert resp.status_code == 400
+    finally:
+        ext.verify_pool = None
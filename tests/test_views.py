@@ -25,20 +25,11 @@ from flask import url_for
 from flask_login import current_user
 from onelogin.saml2.auth import OneLogin_Saml2_Error
 
-from helpers import check_redirect_location
+from helpers import (authorized_valid_config, check_redirect_location,
+                     invalid_configuration, load_file, valid_configuration)
 from shibboleth_authenticator._compat import _create_identifier
 
 
-def _invalid_configuration(app):
-    app.config['SHIBBOLETH_REMOTE_APPS'].update(
-        dict(
-            idp=dict(
-                title='Test identity provider'
-            )
-        )
-    )
-
-
 def _invalid__saml_configuration(app):
     app.config['SHIBBOLETH_REMOTE_APPS'].update(
         dict(
@@ -51,51 +42,11 @@ def _invalid__saml_configuration(app):
     )
 
 
-def _valid_configuration(app):
-    app.config['SHIBBOLETH_REMOTE_APPS'].update(
-        dict(
-            idp=dict(
-                title='Test identity provider',
-                saml_path=os.path.join(os.path.dirname(__file__),
-                                       'data', 'valid')
-            )
-        )
-    )
-
-
-def _authorized_valid_config(app):
-    app.config['SHIBBOLETH_REMOTE_APPS'].update(
-        dict(
-            idp=dict(
-                title='Test identity provider',
-                saml_path=os.path.join(os.path.dirname(__file__),
-                                       'data', 'settings'),
-                mappings=dict(
-                    email='mail',
-                    full_name='sn',
-                    user_unique_id='uid',
-                )
-            )
-        )
-    )
-    app.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
-
-
-def patch_auth(request, path):
+def patch_auth(request, path, remote_app=None):
     """Patch init saml function."""
     raise OneLogin_Saml2_Error('Failed')
 
 
-def _load_file(filename):
-    """Load content of file."""
-    filename = os.path.join(os.path.dirname(__file__), 'data', filename)
-    if(os.path.exists(filename)):
-        f = open(filename, 'r')
-        content = f.read()
-        f.close()
-        return content
-
-
 def test_login(views_fixture):
     """Test login view."""
     app = views_fixture
@@ -107,7 +58,7 @@ def test_login(views_fixture):
         assert resp.status_code == 404
 
         # Invalid configuration
-        _invalid_configuration(app)
+        invalid_configuration(app)
         resp = client.get(
             url_for('shibboleth_authenticator.login', remote_app='idp')
         )
@@ -129,7 +80,7 @@ def test_login_fail(mock_auth, views_fixture):
     """Test failing login view."""
     app = views_fixture
     with app.test_client() as client:
-        _valid_configuration(app)
+        valid_configuration(app)
         resp = client.get(
             url_for('shibboleth_authenticator.login', remote_app='idp')
         )
@@ -141,11 +92,13 @@ def test_redirect_uri(views_fixture):
     app = views_fixture
     with app.test_client() as client:
         # Test redirect
-        _valid_configuration(app)
+        valid_configuration(app)
         resp = client.get(
             url_for('shibboleth_authenticator.login', remote_app='idp')
         )
         assert resp.status_code == 302
+        ext = app.extensions['shibboleth-authenticator']
+        assert 'idp' in ext.settings_cache
 
 
 def test_authorized(views_fixture):
@@ -161,7 +114,7 @@ def test_authorized(views_fixture):
         assert resp.status_code == 404
 
         # Invalid configuration
-        _invalid_configuration(app)
+        invalid_configuration(app)
         resp = client.get(
             url_for('shibboleth_authenticator.authorized', remote_app='idp')
         )
@@ -175,7 +128,7 @@ def test_authorized(views_fixture):
         assert resp.status_code == 500
 
         # Valid configuration, no authorization response
-        _valid_configuration(app)
+        valid_configuration(app)
         resp = client.get(
             url_for('shibboleth_authenticator.authorized', remote_app='idp')
         )
@@ -188,11 +141,11 @@ def test_failing_authorized1(mock_authenticate, mock_register, views_fixture):
     """Test authorized signup handler."""
     app = views_fixture
     with app.test_client() as client:
-        _authorized_valid_config(app)
+        authorized_valid_config(app)
         mock_register.return_value = None
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
-            data=dict(SAMLResponse=_load_file('valid.xml.base64'))
+            data=dict(SAMLResponse=load_file('valid.xml.base64'))
         )
         assert resp.status_code == 302
         assert not current_user.is_authenticated
@@ -203,11 +156,11 @@ def test_failing_authorized2(mock_authenticate, views_fixture):
     """Test authorized signup handler."""
     app = views_fixture
     with app.test_client() as client:
-        _authorized_valid_config(app)
+        authorized_valid_config(app)
         mock_authenticate.return_value = False
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
-            data=dict(SAMLResponse=_load_file('valid.xml.base64'))
+            data=dict(SAMLResponse=load_file('valid.xml.base64'))
         )
         assert resp.status_code == 302
         assert not current_user.is_authenticated
@@ -217,19 +170,19 @@ def test_valid_authorized(views_fixture):
     """Test authorized signup handler."""
     app = views_fixture
     with app.test_client() as client:
-        _authorized_valid_config(app)
+        authorized_valid_config(app)
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
-            data=dict(SAMLResponse=_load_file('valid.xml.base64'))
+            data=dict(SAMLResponse=load_file('valid.xml.base64'))
         )
         assert resp.status_code == 302
         assert current_user.email == 'smartin@yaco.es'
         assert current_user.is_authenticated
 
-        _authorized_valid_config(app)
+        authorized_valid_config(app)
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
-            data=dict(SAMLResponse=_load_file('expired.xml.base64'))
+            data=dict(SAMLResponse=load_file('expired.xml.base64'))
         )
         assert resp.status_code == 403
         assert not current_user.is_authenticated
@@ -246,7 +199,7 @@ def test_valid_authorized(views_fixture):
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
             data=dict(
-                SAMLResponse=_load_file('valid.xml.base64'),
+                SAMLResponse=load_file('valid.xml.base64'),
                 RelayState=state,
             )
         )
@@ -263,7 +216,7 @@ def test_valid_authorized(views_fixture):
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
             data=dict(
-                SAMLResponse=_load_file('valid.xml.base64'),
+                SAMLResponse=load_file('valid.xml.base64'),
                 RelayState=state,
             )
         )
@@ -272,30 +225,55 @@ def test_valid_authorized(views_fixture):
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
             data=dict(
-                SAMLResponse=_load_file('valid.xml.base64'),
+                SAMLResponse=load_file('valid.xml.base64'),
                 RelayState='',
             )
         )
         assert resp.status_code == 400
 
 
+def test_authorized_returning_user(views_fixture):
+    """Test that a returning user is found by the existing link."""
+    from shibboleth_authenticator import handlers
+    app = views_fixture
+    url = url_for('shibboleth_authenticator.authorized', remote_app='idp')
+    data = dict(SAMLResponse=load_file('valid.xml.base64'))
+    authorized_valid_config(app)
+    with mock.patch.object(handlers, 'oauth_get_user',
+                           wraps=handlers.oauth_get_user) as get_user, \
+            mock.patch.object(handlers, 'oauth_link_external_id',
+                              wraps=handlers.oauth_link_external_id) as link:
+        with app.test_client() as client:
+            resp = client.post(url, data=data)
+            assert resp.status_code == 302
+            assert get_user.call_count == 1
+            assert link.call_count == 1
+
+        with app.test_client() as client:
+            resp = client.post(url, data=data)
+            assert resp.status_code == 302
+            assert current_user.email == 'smartin@yaco.es'
+            assert get_user.call_count == 1
+            assert link.call_count == 1
+
+
 def test_valid_authorized_userprofiles(userprofiles_fixture):
     """Test authorized signup handler with userprofiles enabled."""
     app = userprofiles_fixture
     with app.test_client() as client:
-        _authorized_valid_config(app)
+        authorized_valid_config(app)
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
-            data=dict(SAMLResponse=_load_file('valid.xml.base64'))
+            data=dict(SAMLResponse=load_file('valid.xml.base64'))
         )
         assert resp.status_code == 302
         assert current_user.email == 'smartin@yaco.es'
         assert current_user.is_authenticated
 
-        _authorized_valid_config(app)
+        authorized_valid_config(app)
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
-            data=dict(SAMLResponse=_load_file('expired.xml.base64'))
+            data=dict(SAMLResponse=load_file('expired.xml.base64'))
         )
         assert resp.status_code == 403
         assert not current_user.is_authenticated
@@ -312,7 +290,7 @@ def test_valid_authorized_userprofiles(userprofiles_fixture):
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
             data=dict(
-                SAMLResponse=_load_file('valid.xml.base64'),
+                SAMLResponse=load_file('valid.xml.base64'),
                 RelayState=state,
             )
         )
@@ -329,7 +307,7 @@ def test_valid_authorized_userprofiles(userprofiles_fixture):
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
             data=dict(
-                SAMLResponse=_load_file('valid.xml.base64'),
+                SAMLResponse=load_file('valid.xml.base64'),
                 RelayState=state,
             )
         )
@@ -338,7 +316,7 @@ def test_valid_authorized_userprofiles(userprofiles_fixture):
         resp = client.post(
             url_for('shibboleth_authenticator.authorized', remote_app='idp'),
             data=dict(
-                SAMLResponse=_load_file('valid.xml.base64'),
+                SAMLResponse=load_file('valid.xml.base64'),
                 RelayState='',
             )
         )
@@ -352,7 +330,7 @@ def test_metadata_fail(mock_len, views_fixture):
     mock_len.return_value = 1
     with app.test_client() as client:
         # Valid configuration
-        _valid_configuration(app)
+        valid_configuration(app)
         resp = client.get(
             url_for('shibboleth_authenticator.metadata', remote_app='idp')
         )
@@ -370,19 +348,42 @@ def test_metadata(views_fixture):
         assert resp.status_code == 404
 
         # Invalid configuration
-        _invalid_configuration(app)
+        invalid_configuration(app)
         resp = client.get(
             url_for('shibboleth_authenticator.metadata', remote_app='idp')
         )
         assert resp.status_code == 500
 
         # Valid configuration
-        _valid_configuration(app)
+        valid_configuration(app)
         resp = client.get(
             url_for('shibboleth_authenticator.metadata', remote_app='idp')
         )
         assert resp.status_code == 200
         assert resp.headers['Content-Type'] in ['text/xml', 'application/xml']
+        assert resp.headers['ETag']
+        assert resp.headers['Last-Modified']
+        assert 'max-age' in resp.headers['Cache-Control']
+
+        # Cached metadata is served again
+        etag = resp.headers['ETag']
+        with mock.patch('shibboleth_authenticator.views.init_saml_auth',
+                        side_effect=patch_auth) as mock_auth:
+            resp = client.get(
+                url_for('shibboleth_authenticator.metadata', remote_app='idp')
+            )
+            assert resp.status_code == 200
+            assert resp.headers['ETag'] == etag
+
+            # Conditional request
+            resp = client.get(
+                url_for('shibboleth_authenticator.metadata',
+                        remote_app='idp'),
+                headers={'If-None-Match': etag}
+            )
+            assert resp.status_code == 304
+            assert not resp.data
+            assert not mock_auth.called
 
         # Invalid configuration of python3-saml
         _invalid__saml_configuration(app)
@@ -390,3 +391,58 @@ def test_metadata(views_fixture):
             url_for('shibboleth_authenticator.metadata', remote_app='idp')
         )
         assert resp.status_code == 500
+
+
+def test_prepare_flask_request(app):
+    """Test that the request data is not copied."""
+    from flask import request
+    from shibboleth_authenticator.views import prepare_flask_request
+    with app.test_request_context('/shibboleth/authorized/idp?a=b',
+                                  method='POST', data=dict(SAMLResponse='x'),
+                                  base_url='https://example.org:8443/app'):
+        req = prepare_flask_request(request)
+        assert req['post_data'] is request.form
+        assert req['get_data'] is request.args
+        assert req['https'] == 'on'
+        assert req['http_host'] == 'example.org:8443'
+        assert req['server_port'] == 8443
+        assert req['script_name'] == '/app/shibboleth/authorized/idp'
+
+    with app.test_request_context('/', base_url='http://[::1]'):
+        assert prepare_flask_request(request)['server_port'] is None
+
+
+def test_proxy_fix(base_app):
+    """Test that X-Forwarded-* headers are honoured."""
+    from shibboleth_authenticator import ShibbolethAuthenticator
+    from shibboleth_authenticator.views import blueprint
+
+    app = base_app
+    app.config['SHIBBOLETH_PROXY_FIX'] = True
+    ShibbolethAuthenticator(app)
+    ShibbolethAuthenticator(app)
+    app.register_blueprint(blueprint)
+    valid_configuration(app)
+
+    requests = []
+
+    def init_saml_auth(req, saml_path, remote_app=None):
+        requests.append(req)
+        raise OneLogin_Saml2_Error('Failed')
+
+    with mock.patch('shibboleth_authenticator.views.init_saml_auth',
+                    init_saml_auth), app.test_client() as client:
+        resp = client.get(
+            url_for('shibboleth_authenticator.login', remote_app='idp'),
+            base_url='http://127.0.0.1:5000',
+            headers={
+                'X-Forwarded-Proto': 'https',
+                'X-Forwarded-Host': 'localhost.localdomain',
+                'X-Forwarded-Prefix': '/prefix',
+            }
+        )
+    assert resp.status_code == 500, resp.data
+    assert requests[0]['https'] == 'on'
+    assert requests[0]['http_host'] == 'localhost.localdomain'
+    assert requests[0]['server_port'] is None
+    assert requests[0]['script_name'] == '/prefix/shibboleth/login/idp/'
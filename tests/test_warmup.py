@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test loading of the remote applications at startup."""
+
+from __future__ import absolute_import, print_function
+
+import os
+
+import pytest
+
+from shibboleth_authenticator import ShibbolethAuthenticator
+from shibboleth_authenticator.keys import idp_certs
+from shibboleth_authenticator.signals import stage_timed
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def remote_apps(base_app):
+    """Application with working and broken remote applications."""
+    base_app.config['SHIBBOLETH_REMOTE_APPS'] = dict(
+        valid=dict(
+            saml_path=os.path.join(DATA, 'valid'),
+            mappings=dict(email='mail', full_name='sn',
+                          user_unique_id='uid'),
+        ),
+        settings=dict(saml_path=os.path.join(DATA, 'settings')),
+        invalid=dict(saml_path=os.path.join(DATA, 'invalid')),
+        mappings=dict(
+            saml_path=os.path.join(DATA, 'settings'),
+            mappings=dict(email='mail'),
+        ),
+        missing=dict(title='No saml_path'),
+    )
+    return base_app
+
+
+def test_warmup_disabled(remote_apps):
+    """Test that remote applications are loaded on first use by default."""
+    del remote_apps.config['SHIBBOLETH_REMOTE_APPS']['mappings']
+    ext = ShibbolethAuthenticator(remote_apps)
+    assert ext.warmup_results == {}
+    assert 'valid' not in ext.settings_cache
+
+
+def test_warmup_degrade(remote_apps):
+    """Test that failing remote applications are reported."""
+    durations = []
+
+    def receiver(app, remote_app=None, stage=None, duration=None):
+        assert stage == 'warmup'
+        durations.append(remote_app)
+
+    remote_apps.config['SHIBBOLETH_WARMUP'] = 'degrade'
+    remote_apps.config['SHIBBOLETH_KEY_CACHE_SIZE'] = 64
+    with stage_timed.connected_to(receiver):
+        ext = ShibbolethAuthenticator(remote_apps)
+    results = ext.warmup_results
+    assert sorted(durations) == sorted(results)
+    assert sorted(results) == [
+        'invalid', 'mappings', 'missing', 'settings', 'valid'
+    ]
+    for name in ('valid', 'settings'):
+        assert results[name].error is None
+        assert results[name].duration >= 0
+        assert name in ext.settings_cache
+    for name in ('invalid', 'mappings', 'missing'):
+        assert results[name].error is not None
+    assert 'valid' in ext.mappers._mappers
+
+    for cert in idp_certs(ext.settings_cache.get(
+            'valid', os.path.join(DATA, 'valid'))):
+        assert cert in ext.key_cache
+
+
+def test_warmup_fail(remote_apps):
+    """Test that failing remote applications stop the startup."""
+    remote_apps.config['SHIBBOLETH_WARMUP'] = 'fail'
+    with pytest.raises(ValueError) as excinfo:
+        ShibbolethAuthenticator(remote_apps)
+    assert 'invalid, mappings, missing' in str(excinfo.value)
+
+    for name in ('invalid', 'mappings', 'missing'):
+        del remote_apps.config['SHIBBOLETH_REMOTE_APPS'][name]
+    ext = ShibbolethAuthenticator(remote_apps)
+    assert sorted(ext.warmup_results) == ['settings', 'valid']
+
+    remote_apps.config['SHIBBOLETH_WARMUP'] = 'eager'
+    with pytest.raises(ValueError):
+        ShibbolethAuthenticator(remote_apps)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of the shibboleth-authenticator module for Invenio.
+# Copyright (C) 2017  Helmholtz-Zentrum Dresden-Rossendorf
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test deferred profile writes."""
+
+from __future__ import absolute_import, print_function
+
+import gc
+import os
+import time
+
+import mock
+import pytest
+from flask import url_for
+from flask_login import current_user
+from invenio_db import db
+from invenio_oauthclient.models import RemoteAccount
+from invenio_userprofiles import UserProfile
+from sqlalchemy.exc import IntegrityError
+
+from shibboleth_authenticator.writes import (LocalWriteQueue, ProfileWrite,
+                                             _flush_queues, apply_writes,
+                                             create_write_queue,
+                                             minimal_user_data)
+
+
+def test_minimal_user_data():
+    """Test stripping of registration data."""
+    user_data = dict(email='a@b.c',
+                     profile=dict(full_name='A B', username='a'))
+    assert minimal_user_data(user_data) == dict(email='a@b.c',
+                                                profile=dict(username='a'))
+    assert user_data['profile']['full_name'] == 'A B'
+
+
+def test_apply_writes(user):
+    """Test batched writes."""
+    now = time.time()
+    apply_writes([
+        ProfileWrite(user.id, 'idp', 'Old Name', dict(a=1), now - 10),
+        ProfileWrite(user.id, 'idp', 'New Name', dict(b=2), now),
+        ProfileWrite(user.id, 'other', None, {}, now),
+    ])
+    assert UserProfile.get_by_userid(user.id).full_name == 'New Name'
+    account = RemoteAccount.get(user.id, 'idp')
+    assert account.extra_data['b'] == 2
+    assert 'a' not in account.extra_data
+    assert account.extra_data['last_login']
+    assert RemoteAccount.get(user.id, 'other').extra_data['last_login']
+
+    # Existing data is updated.
+    apply_writes([ProfileWrite(user.id, 'idp', None, dict(c=3), now)])
+    account = RemoteAccount.get(user.id, 'idp')
+    assert account.extra_data['b'] == 2
+    assert account.extra_data['c'] == 3
+    assert UserProfile.get_by_userid(user.id).full_name == 'New Name'
+
+
+def test_local_write_queue(userprofiles_app, user):
+    """Test background worker."""
+    app = userprofiles_app
+    user_id = user.id
+    # The sessions of the queue share the connection of the in-memory
+    # database, which must not be in a transaction.
+    db.session.commit()
+    queue = LocalWriteQueue(app, interval=0.01)
+    queue.put(ProfileWrite(user_id, 'idp', 'Worker', {}, time.time()))
+    queue.flush()
+    assert queue._thread.is_alive()
+    assert UserProfile.get_by_userid(user_id).full_name == 'Worker'
+    db.session.commit()
+
+    # Full queue is written by the caller.
+    queue = LocalWriteQueue(app, maxsize=1)
+    with mock.patch.object(queue, '_ensure_worker'):
+        queue.put(ProfileWrite(user_id, 'idp', 'First', {}, time.time()))
+        queue.put(ProfileWrite(user_id, 'idp', 'Second', {}, time.time()))
+        assert UserProfile.get_by_userid(user_id).full_name == 'Second'
+        db.session.commit()
+        queue.flush()
+    assert UserProfile.get_by_userid(user_id).full_name == 'First'
+
+
+def test_local_write_queue_isolation(userprofiles_app, user):
+    """Test that failing writes of the caller keep its transaction."""
+    app = userprofiles_app
+    db.session.commit()
+    queue = LocalWriteQueue(app, maxsize=1)
+    with mock.patch.object(queue, '_ensure_worker'), \
+            mock.patch('shibboleth_authenticator.writes.apply_writes',
+                       side_effect=RuntimeError):
+        queue.put(ProfileWrite(user.id, 'idp', 'First', {}, time.time()))
+        user.active = False
+        queue.put(ProfileWrite(user.id, 'idp', 'Second', {}, time.time()))
+        assert user in db.session.dirty
+    db.session.rollback()
+
+
+def test_local_write_queue_atexit(app):
+    """Test that queued writes are flushed on exit."""
+    queue = LocalWriteQueue(app)
+    with mock.patch.object(queue, 'flush') as flush:
+        _flush_queues()
+    flush.assert_called_once_with()
+
+    # Queues are not kept alive by the registration or the worker.
+    queue._ensure_worker()
+    thread = queue._thread
+    del queue, flush
+    gc.collect()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_local_write_queue_fork(app):
+    """Test that writes queued before a fork are left to the parent."""
+    queue = LocalWriteQueue(app)
+    queue._ensure_worker()
+    parent_queue = queue._queue
+    parent_queue.put(ProfileWrite(1, 'idp', 'Parent', {}, time.time()))
+    with mock.patch('shibboleth_authenticator.writes.os.getpid',
+                    return_value=os.getpid() + 1):
+        with mock.patch.object(queue, '_apply') as apply:
+            # Returns although the worker of the parent does not exist.
+            queue.flush()
+            assert not apply.called
+            queue._ensure_worker()
+        assert queue._queue is not parent_queue
+        assert queue._queue.empty()
+
+
+def test_local_write_queue_retry(app):
+    """Test that batches are applied again after a concurrent insert."""
+    queue = LocalWriteQueue(app)
+    write = ProfileWrite(1, 'idp', 'Retry', {}, time.time())
+    error = IntegrityError('INSERT', {}, Exception('duplicate'))
+    with mock.patch('shibboleth_authenticator.writes.apply_writes',
+                    side_effect=[error, None]) as apply:
+        queue._apply([write])
+    assert apply.call_count == 2
+    with mock.patch('shibboleth_authenticator.writes.apply_writes',
+                    side_effect=error) as apply, \
+            mock.patch.object(app.logger, 'exception') as log:
+        queue._apply([write])
+    assert apply.call_count == 2
+    assert log.called
+
+
+def test_create_write_queue(app):
+    """Test creation of the configured backend."""
+    assert create_write_queue(app) is None
+    app.config['SHIBBOLETH_WRITE_QUEUE'] = 'local'
+    assert isinstance(create_write_queue(app), LocalWriteQueue)
+    app.config['SHIBBOLETH_WRITE_QUEUE'] = 'invalid'
+    with pytest.raises(ValueError):
+        create_write_queue(app)
+
+
+def test_authorized_deferred(userprofiles_fixture):
+    """Test that the profile is completed by the queue."""
+    app = userprofiles_fixture
+    app.config['SHIBBOLETH_REMOTE_APPS'].update(
+        dict(
+            idp=dict(
+                title='Test identity provider',
+                saml_path=os.path.join(os.path.dirname(__file__),
+                                       'data', 'settings'),
+                mappings=dict(
+                    email='mail',
+                    full_name='sn',
+                    user_unique_id='uid',
+                    affiliation=dict(attributes='eduPersonAffiliation',
+                                     multi=True),
+                )
+            )
+        )
+    )
+    app.config['OAUTHCLIENT_SESSION_KEY_PREFIX'] = 'prefix'
+    ext = app.extensions['shibboleth-authenticator']
+    ext.write_queue = LocalWriteQueue(app)
+    with open(os.path.join(os.path.dirname(__file__), 'data',
+                           'valid.xml.base64')) as f:
+        response = f.read()
+
+    with mock.patch.object(ext.write_queue, '_ensure_worker'), \
+            app.test_client() as client:
+        resp = client.post(
+            url_for('shibboleth_authenticator.authorized', remote_app='idp'),
+            data=dict(SAMLResponse=response)
+        )
+        assert resp.status_code == 302
+        assert current_user.is_authenticated
+        user_id = current_user.id
+        profile = UserProfile.get_by_userid(user_id)
+        assert profile.username == 'smartin'
+        assert profile.full_name == ''
+
+        db.session.commit()
+        ext.write_queue.flush()
+    assert UserProfile.get_by_userid(user_id).full_name == 'Martin2'
+    extra_data = RemoteAccount.get(user_id, 'idp').extra_data
+    assert extra_data['affiliation'] == ['user', 'admin']
+    assert extra_data['last_login']